@@ -0,0 +1,116 @@
+import json
+import random
+import sys
+import timeit
+
+from fa_search_bot.sites.furaffinity.fa_submission import FASubmissionFull, FAUser, Rating
+from fa_search_bot.subscriptions.query_parser import (
+    InvalidQueryException,
+    SubmissionBatch,
+    SubmissionText,
+    optimise_query,
+    parse_query,
+)
+
+####
+# Compares the speed of matching submissions against subscription and blocklist queries, by walking the parsed query
+# trees, against the optimised and compiled matchers, and against checking the whole set of submissions as one batch.
+# Pass the path to a subscriptions.json file to use real queries, otherwise a synthetic set is generated.
+####
+
+SUBMISSION_COUNT = 200
+REPEATS = 3
+
+
+def load_queries(filename: str) -> list[str]:
+    with open(filename, "r") as f:
+        data = json.load(f)
+    queries = []
+    for destination in data["destinations"].values():
+        queries += [sub["query"] for sub in destination["subscriptions"]]
+        queries += [block["query"] for block in destination["blocks"]]
+    return queries
+
+
+def synthetic_queries(vocab: list[str], count: int = 5000) -> list[str]:
+    templates = [
+        "{0}",
+        "{0} {1}",
+        "{0} or {1}",
+        "{0} -{1}",
+        "{0}* rating:general",
+        "*{0}",
+        '"{0} {1}"',
+        "title:{0} or keyword:{1}",
+        "artist:{0}",
+        "{0} except {0}-{1}",
+        "({0} or {1}) and ({2} or -{0})",
+        "{0}*{1}",
+    ]
+    return [random.choice(templates).format(*random.sample(vocab, 3)) for _ in range(count)]
+
+
+def random_submission(sub_id: int, vocab: list[str]) -> FASubmissionFull:
+    def words(n: int) -> str:
+        return " ".join(random.choice(vocab) for _ in range(n))
+
+    return FASubmissionFull(
+        str(sub_id),
+        "",
+        "",
+        "",
+        words(5),
+        FAUser(random.choice(vocab).title(), random.choice(vocab)),
+        words(random.randint(10, 300)) + ".",
+        [random.choice(vocab) for _ in range(random.randint(0, 30))],
+        random.choice(list(Rating)),
+        None,
+    )
+
+
+def main() -> None:
+    vocab = [f"word{i}" for i in range(2000)] + ["deer", "dog", "fox", "wolf", "cat", "dragon", "ych", "comic"]
+    if len(sys.argv) > 1:
+        query_strs = load_queries(sys.argv[1])
+    else:
+        query_strs = synthetic_queries(vocab)
+    queries = []
+    for query_str in query_strs:
+        try:
+            queries.append(parse_query(query_str))
+        except InvalidQueryException:
+            pass
+    print(f"Parsed {len(queries)} queries")
+    optimised = [optimise_query(q) for q in queries]
+    compiled = [q.matcher() for q in optimised]
+    submissions = [random_submission(i, vocab) for i in range(SUBMISSION_COUNT)]
+    # Build the text views up front, so that both approaches are compared with warm caches
+    texts = [SubmissionText(submission) for submission in submissions]
+
+    def run_interpreted() -> int:
+        return sum(q.matches_text(t) for t in texts for q in queries)
+
+    def run_optimised() -> int:
+        return sum(q.matches_text(t) for t in texts for q in optimised)
+
+    def run_compiled() -> int:
+        return sum(m(t) for t in texts for m in compiled)
+
+    def run_batched() -> int:
+        batch = SubmissionBatch(submissions)
+        return sum(batch.matches(q).bit_count() for q in optimised)
+
+    assert run_interpreted() == run_optimised() == run_compiled() == run_batched()
+    for name, func in [
+        ("interpreted", run_interpreted),
+        ("optimised", run_optimised),
+        ("compiled", run_compiled),
+        ("batched", run_batched),
+    ]:
+        best = min(timeit.repeat(func, number=1, repeat=REPEATS))
+        per_sub = best / len(submissions) * 1000
+        print(f"{name}: {best:.3f}s total, {per_sub:.3f}ms per submission")
+
+
+if __name__ == "__main__":
+    main()
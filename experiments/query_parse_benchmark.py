@@ -0,0 +1,53 @@
+import random
+import sys
+import timeit
+
+from query_compile_benchmark import load_queries, synthetic_queries
+
+from fa_search_bot.subscriptions.query_parser import InvalidQueryException, QueryStringParser, parse_query_pyparsing
+
+####
+# Compares the throughput of the pyparsing query grammar against the hand-written recursive descent parser, and checks
+# that both parse every query to the same result.
+# Pass the path to a subscriptions.json file to use real queries, otherwise a synthetic set is generated.
+####
+
+REPEATS = 3
+
+
+def parse_all(parse, query_strs: list[str]) -> list:
+    results = []
+    for query_str in query_strs:
+        try:
+            results.append(parse(query_str))
+        except InvalidQueryException:
+            results.append(None)
+    return results
+
+
+def main() -> None:
+    random.seed(1234)
+    vocab = [f"word{i}" for i in range(2000)] + ["deer", "dog", "fox", "wolf", "cat", "dragon", "ych", "comic"]
+    if len(sys.argv) > 1:
+        query_strs = load_queries(sys.argv[1])
+    else:
+        query_strs = synthetic_queries(vocab)
+    print(f"Loaded {len(query_strs)} queries")
+
+    def run_pyparsing() -> list:
+        return parse_all(parse_query_pyparsing, query_strs)
+
+    def run_hand_written() -> list:
+        return parse_all(lambda query_str: QueryStringParser(query_str).parse(), query_strs)
+
+    mismatches = [q for q, a, b in zip(query_strs, run_pyparsing(), run_hand_written()) if a != b]
+    print(f"Parsers disagree on {len(mismatches)} queries")
+    for query_str in mismatches[:10]:
+        print(f"  {query_str!r}")
+    for name, func in [("pyparsing", run_pyparsing), ("hand-written", run_hand_written)]:
+        best = min(timeit.repeat(func, number=1, repeat=REPEATS))
+        print(f"{name}: {best:.3f}s total, {len(query_strs) / best:.0f} queries per second")
+
+
+if __name__ == "__main__":
+    main()
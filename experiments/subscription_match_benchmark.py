@@ -0,0 +1,311 @@
+import argparse
+import json
+import random
+import resource
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Sequence, Set
+
+from fa_search_bot.config import SubscriptionWatcherConfig
+from fa_search_bot.sites.furaffinity.fa_submission import FASubmission, FASubmissionFull, FAUser, Rating
+from fa_search_bot.subscriptions.data_fetcher import DataFetcher
+from fa_search_bot.subscriptions.query_parser import InvalidQueryException, SubmissionText, parse_query
+from fa_search_bot.subscriptions.subscription import Subscription
+from fa_search_bot.subscriptions.subscription_watcher import SubscriptionWatcher
+
+####
+# Benchmarks matching submissions against sets of subscriptions, to catch regressions in the matching hot path before
+# deploying. Runs entirely offline.
+# Submissions are generated synthetically, or replayed from a file of recorded FAExport submission JSON, either a JSON
+# list or one JSON object per line. Subscription sets of each size are generated from templates covering the whole
+# query grammar, with a blocklist on some destinations.
+# For each engine and subscription set size, reports submissions per second, the p50 and p99 time to match a single
+# submission, the memory taken by the subscription set, and the peak memory allocated while matching.
+# The batch engine matches micro-batches, as the data fetchers do when catching up, so its latencies are per batch,
+# divided by the batch size.
+####
+
+SIZES = [1_000, 10_000, 100_000]
+SUBMISSION_COUNT = 200
+# Each destination has this many subscriptions on average
+SUBS_PER_DESTINATION = 5
+# Share of destinations which have a blocklist
+BLOCKLIST_SHARE = 0.2
+# Submissions to check while tracing memory allocations, as tracing is slow
+MEMORY_SAMPLE_SIZE = 20
+
+QUERY_TEMPLATES = [
+    "{0}",
+    "{0} {1}",
+    "{0} and {1}",
+    "{0} or {1}",
+    "{0} OR {1} OR {2}",
+    "-{0} {1}",
+    "!{0} {1}",
+    "{0} not {1}",
+    "({0} or {1}) and ({2} or -{0})",
+    "-({0} or {1}) {2}",
+    "{0}*",
+    "*{0}",
+    "{0}*{1}",
+    "{0}*{1}*",
+    '"{0} {1}"',
+    '"{0} {1}" -{2}',
+    "title:{0}",
+    "description:{0} {1}",
+    "keyword:{0}*",
+    "tags:{0} or tags:{1}",
+    "artist:{0}",
+    "@title {0} @keywords {1}",
+    'title:"{0} {1}"',
+    "desc:*{0}",
+    "rating:general {0}",
+    "rating:adult -{0} {1}",
+    "{0} rating:mature",
+    "{0} except {0}-{1}",
+    '{0} ignore "{0} {1}"',
+    "{0} except ({0}* or {1}-{0})",
+    "{0}* except {0}{1}",
+]
+BLOCK_TEMPLATES = [
+    "{0}",
+    "{0}*",
+    '"{0} {1}"',
+    "rating:adult",
+    "keyword:{0}",
+]
+
+
+def make_vocab(size: int = 20_000) -> List[str]:
+    common = ["deer", "dog", "fox", "wolf", "cat", "dragon", "ych", "comic", "sketch", "commission", "male", "female"]
+    return common + [f"w{i}" for i in range(size - len(common))]
+
+
+class WordSampler:
+    """
+    Picks words for submissions with a Zipf-like distribution, so that some words are common in submissions, as they
+    are in reality. Words for queries are picked uniformly, so that most subscriptions are for rarer things.
+    """
+
+    def __init__(self, vocab: List[str], rand: random.Random) -> None:
+        self.vocab = vocab
+        self.rand = rand
+        weights = [1 / (rank + 1) for rank in range(len(vocab))]
+        total = sum(weights)
+        self.cum_weights = []
+        running = 0.0
+        for weight in weights:
+            running += weight / total
+            self.cum_weights.append(running)
+
+    def words(self, count: int) -> List[str]:
+        return self.rand.choices(self.vocab, cum_weights=self.cum_weights, k=count)
+
+    def query_words(self, count: int) -> List[str]:
+        return self.rand.sample(self.vocab, count)
+
+
+def synthetic_queries(sampler: WordSampler, count: int, templates: Sequence[str]) -> List[str]:
+    rand = sampler.rand
+    queries = []
+    while len(queries) < count:
+        query = rand.choice(templates).format(*sampler.query_words(3))
+        try:
+            parse_query(query)
+        except InvalidQueryException:
+            continue
+        queries.append(query)
+    return queries
+
+
+def synthetic_submissions(sampler: WordSampler, count: int) -> List[FASubmissionFull]:
+    rand = sampler.rand
+    punctuation = [" ", " ", " ", ", ", ". ", "-", "\n", "! "]
+
+    def text(word_count: int) -> str:
+        return "".join(word + rand.choice(punctuation) for word in sampler.words(word_count)).strip()
+
+    submissions = []
+    for sub_id in range(count):
+        artist = sampler.words(1)[0]
+        submissions.append(
+            FASubmissionFull(
+                str(sub_id),
+                "",
+                "",
+                "",
+                text(rand.randint(1, 8)).title(),
+                FAUser(artist.title(), artist),
+                text(rand.choice([5, 20, 50, 200, 1000])),
+                sampler.words(rand.randint(0, 40)),
+                rand.choice(list(Rating)),
+                None,
+            )
+        )
+    return submissions
+
+
+def load_replay(filename: str) -> List[FASubmissionFull]:
+    with open(filename, "r") as f:
+        contents = f.read()
+    try:
+        data = json.loads(contents)
+    except json.JSONDecodeError:
+        data = [json.loads(line) for line in contents.splitlines() if line.strip()]
+    if isinstance(data, dict):
+        data = [data]
+    return [FASubmission.from_full_dict(submission) for submission in data]
+
+
+def build_watcher(sampler: WordSampler, size: int) -> SubscriptionWatcher:
+    watcher = SubscriptionWatcher(SubscriptionWatcherConfig(True, 1, 1), None, None, None)
+    destination_count = max(1, size // SUBS_PER_DESTINATION)
+    subscriptions = []
+    for index, query_str in enumerate(synthetic_queries(sampler, size, QUERY_TEMPLATES)):
+        subscriptions.append(Subscription(query_str, index % destination_count))
+    watcher.subscriptions = subscriptions
+    for destination in range(destination_count):
+        if sampler.rand.random() < BLOCKLIST_SHARE:
+            for block in synthetic_queries(sampler, sampler.rand.randint(1, 3), BLOCK_TEMPLATES):
+                watcher.add_to_blocklist(destination, block)
+    # Build each blocklist query now, rather than the first time it is needed, as each one built registers its phrases,
+    # which makes the shared phrase matcher get rebuilt
+    for destination in watcher.blocklists:
+        watcher.get_destination_blocklist_query(destination)
+    return watcher
+
+
+def clear_watcher(watcher: SubscriptionWatcher) -> None:
+    # Unregister the queries from the shared phrase and wildcard matchers, so they do not slow later runs
+    for subscription in watcher.subscriptions.copy():
+        watcher.subscriptions.discard(subscription)
+    for destination in list(watcher.blocklists):
+        for tag in list(watcher.blocklists[destination]):
+            watcher.remove_from_blocklist(destination, tag)
+
+
+def engine_check_subscriptions(watcher: SubscriptionWatcher, batch: List[FASubmissionFull]) -> List[List[Subscription]]:
+    return [watcher.check_subscriptions(submission) for submission in batch]
+
+
+def engine_check_subscriptions_batch(
+    watcher: SubscriptionWatcher, batch: List[FASubmissionFull]
+) -> List[List[Subscription]]:
+    return watcher.check_subscriptions_batch(batch)
+
+
+def engine_scan(watcher: SubscriptionWatcher, batch: List[FASubmissionFull]) -> List[List[Subscription]]:
+    # Checks every active subscription's compiled matcher, without the subscription index, as a baseline
+    results = []
+    for submission in batch:
+        text = SubmissionText(submission)
+        matches = []
+        for subscription in watcher.subscriptions.copy():
+            if not subscription.matches_query(submission, text):
+                continue
+            blocklist_matcher = watcher.get_destination_blocklist_matcher(subscription.destination)
+            if blocklist_matcher is None or blocklist_matcher(text):
+                matches.append(subscription)
+        results.append(matches)
+    return results
+
+
+Engine = Callable[[SubscriptionWatcher, List[FASubmissionFull]], List[List[Subscription]]]
+ENGINES: Dict[str, Engine] = {
+    "check_subscriptions": engine_check_subscriptions,
+    "check_subscriptions_batch": engine_check_subscriptions_batch,
+    "scan": engine_scan,
+}
+ENGINE_BATCH_SIZES = {
+    "check_subscriptions_batch": DataFetcher.MAX_BATCH_SIZE,
+}
+
+
+def batches(submissions: List[FASubmissionFull], batch_size: int) -> List[List[FASubmissionFull]]:
+    return [submissions[i : i + batch_size] for i in range(0, len(submissions), batch_size)]
+
+
+def percentile(sorted_values: List[float], share: float) -> float:
+    index = min(len(sorted_values) - 1, int(share * len(sorted_values)))
+    return sorted_values[index]
+
+
+def run_engine(
+    name: str, watcher: SubscriptionWatcher, submissions: List[FASubmissionFull]
+) -> List[Set[int]]:
+    engine = ENGINES[name]
+    batch_size = ENGINE_BATCH_SIZES.get(name, 1)
+    latencies = []
+    results: List[Set[int]] = []
+    start = time.perf_counter()
+    for batch in batches(submissions, batch_size):
+        batch_start = time.perf_counter()
+        match_matrix = engine(watcher, batch)
+        batch_time = time.perf_counter() - batch_start
+        latencies += [batch_time / len(batch)] * len(batch)
+        results += [{id(subscription) for subscription in matches} for matches in match_matrix]
+    total = time.perf_counter() - start
+    latencies.sort()
+    # Trace memory on a few submissions, separately, as tracing slows matching down
+    sample = submissions[:MEMORY_SAMPLE_SIZE]
+    tracemalloc.start()
+    for batch in batches(sample, batch_size):
+        engine(watcher, batch)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    match_count = sum(len(matches) for matches in results)
+    print(
+        f"  {name}: {len(submissions) / total:.1f} submissions/s, "
+        f"p50 {percentile(latencies, 0.5) * 1000:.3f}ms, p99 {percentile(latencies, 0.99) * 1000:.3f}ms, "
+        f"peak matching memory {peak / 1024:.0f}KiB, {match_count} matches"
+    )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark matching submissions against subscriptions, offline")
+    parser.add_argument("--replay", help="File of recorded FAExport submission JSON, to use instead of synthetic ones")
+    parser.add_argument("--submissions", type=int, default=SUBMISSION_COUNT, help="Number of synthetic submissions")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="Subscription set sizes to benchmark")
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    sampler = WordSampler(make_vocab(), random.Random(args.seed))
+    if args.replay:
+        submissions = load_replay(args.replay)
+        print(f"Replaying {len(submissions)} submissions from {args.replay}")
+    else:
+        submissions = synthetic_submissions(sampler, args.submissions)
+        print(f"Generated {len(submissions)} synthetic submissions")
+
+    for size in args.sizes:
+        tracemalloc.start()
+        build_start = time.perf_counter()
+        watcher = build_watcher(sampler, size)
+        build_time = time.perf_counter() - build_start
+        set_memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        block_count = sum(len(blocks) for blocks in watcher.blocklists.values())
+        print(
+            f"{size} subscriptions, {block_count} blocklist entries: built in {build_time:.1f}s, "
+            f"using {set_memory / 1024 / 1024:.1f}MiB"
+        )
+        # The shared phrase and affix matchers are built on the first match after subscriptions change
+        warm_up_start = time.perf_counter()
+        engine_check_subscriptions(watcher, submissions[:1])
+        print(f"  Shared matchers built in {time.perf_counter() - warm_up_start:.1f}s")
+        expected: Optional[List[Set[int]]] = None
+        for name in args.engines:
+            results = run_engine(name, watcher, submissions)
+            if expected is None:
+                expected = results
+            elif results != expected:
+                raise AssertionError(f"Engine {name} matched different subscriptions to {args.engines[0]}")
+        clear_watcher(watcher)
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"Max resident memory: {max_rss / 1024:.0f}MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import timeit
+
+from fa_search_bot.sites.furaffinity.fa_submission import FASubmissionFull, FAUser, Rating
+from fa_search_bot.subscriptions.query_parser import MAX_WILDCARDS, RegexQuery, compile_query
+
+####
+# Times adversarial wildcard queries against adversarial submissions, to check that the worst case time per submission
+# grows linearly with the length of the submission, rather than exponentially with the number of wildcards.
+# The regex alone is only timed for short texts, as it takes too long for longer ones.
+####
+
+REPEATS = 3
+QUERIES = [
+    "a*b",
+    "a*a*a*b",
+    "a*a*a*a*a*b",
+    "*a*a*a*a*",
+    "*".join(["a"] * MAX_WILDCARDS) + "*b",
+]
+TEXTS = {
+    "one long word": lambda n: "a" * n,
+    "many short words": lambda n: " ".join(["aaaa"] * (n // 5)),
+    "punctuated word": lambda n: "a-" * (n // 2),
+    # These contain every part of each query, so they are not skipped before matching, but still cannot match
+    "long word then b": lambda n: "a" * (n - 2) + " b",
+    "short words then b": lambda n: " ".join(["aaaa"] * (n // 5)) + " b",
+}
+LENGTHS = [100, 1_000, 10_000, 100_000]
+REGEX_MAX_LENGTH = 40
+
+
+def submission_with_description(description: str) -> FASubmissionFull:
+    return FASubmissionFull(
+        "1", "", "", "", "title", FAUser("artist", "artist"), description, [], Rating.GENERAL, None
+    )
+
+
+def time_best(func) -> float:
+    return min(timeit.repeat(func, number=1, repeat=REPEATS))
+
+
+def main() -> None:
+    for query_str in QUERIES:
+        query = RegexQuery.from_string_with_asterisks(query_str)
+        wildcard = query.wildcard[1]
+        matcher = compile_query(query)
+        print(f"Query: {query_str}")
+        for text_name, make_text in TEXTS.items():
+            regex_text = make_text(REGEX_MAX_LENGTH)
+            regex_time = time_best(lambda: list(query.pattern.finditer(regex_text)))
+            print(f"  {text_name}, regex alone, {len(regex_text)} chars: {regex_time * 1000:.3f}ms")
+            for length in LENGTHS:
+                text = make_text(length)
+                submission = submission_with_description(text)
+
+                def check_submission() -> None:
+                    # Matching the words, and finding the match locations, as an exception query would
+                    matcher(submission)
+                    wildcard.spans(text)
+
+                print(f"  {text_name}, {length} chars: {time_best(check_submission) * 1000:.3f}ms per submission")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,6 @@ from __future__ import annotations
 
 import asyncio
 import logging
-from math import ceil
 from typing import TYPE_CHECKING
 
 from prometheus_client import Gauge, Info, start_http_server  # type: ignore
@@ -49,6 +48,7 @@ start_time = Gauge("fasearchbot_startup_unixtime", "Last time FASearchBot was st
 
 class FASearchBot:
     VERSION = __VERSION__
+    LOG_INTERVAL = 20
 
     def __init__(self, config: Config) -> None:
         self.config = config
@@ -59,6 +59,8 @@ class FASearchBot:
             "fasearchbot", self.config.telegram.api_id, self.config.telegram.api_hash
         )
         self.alive = False
+        # Set when the bot is closing, to interrupt the periodic logger
+        self._stop_event = asyncio.Event()
         self.functionalities: list[BotFunctionality] = []
         self.db = Database()
         self.submission_cache = SubmissionCache(self.db)
@@ -100,6 +102,7 @@ class FASearchBot:
             logger.info("Registering functionality: %s", func.__class__.__name__)
             func.register(self.client)
         self.alive = True
+        self._stop_event.clear()
         event_loop = asyncio.get_event_loop()
 
         # Log every couple seconds so we know the bot is still running
@@ -118,6 +121,7 @@ class FASearchBot:
     def close(self) -> None:
         # Shut down sub watcher
         self.alive = False
+        self._stop_event.set()
         logger.debug("Shutting down subscription watcher")
         self.subscription_watcher.stop_tasks()
         event_loop = asyncio.get_event_loop()
@@ -133,16 +137,13 @@ class FASearchBot:
         logger.debug("Shutdown complete")
 
     async def periodic_log(self) -> None:
-        sleep_seconds = 20
-        sleep_increment = 0.1
         while self.alive:
             logger.info("Main thread alive")
             try:
                 # Sleep with one eye open
-                for _ in range(ceil(sleep_seconds/sleep_increment)):
-                    await asyncio.sleep(sleep_increment)
-                    if not self.alive:
-                        break
+                await asyncio.wait_for(self._stop_event.wait(), self.LOG_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
             except KeyboardInterrupt:
                 logger.info("Received keyboard interrupt")
                 self.alive = False
@@ -40,6 +40,28 @@ class SubscriptionWatcherConfig:
     enabled: bool
     num_data_fetchers: int
     num_media_fetchers: int
+    # Share of submissions for which the time taken checking each query is recorded. Zero disables the profiler
+    query_profile_sample_rate: float = 0
+    # Bounds within which the number of data and media fetchers are scaled while running, starting from the numbers
+    # above. If a pool has no bounds set, it stays at a fixed size
+    min_data_fetchers: Optional[int] = None
+    max_data_fetchers: Optional[int] = None
+    min_media_fetchers: Optional[int] = None
+    max_media_fetchers: Optional[int] = None
+
+    @property
+    def data_fetcher_bounds(self) -> tuple[int, int]:
+        return _pool_bounds(self.num_data_fetchers, self.min_data_fetchers, self.max_data_fetchers)
+
+    @property
+    def media_fetcher_bounds(self) -> tuple[int, int]:
+        return _pool_bounds(self.num_media_fetchers, self.min_media_fetchers, self.max_media_fetchers)
+
+    @property
+    def autoscaling_enabled(self) -> bool:
+        data_min, data_max = self.data_fetcher_bounds
+        media_min, media_max = self.media_fetcher_bounds
+        return data_min != data_max or media_min != media_max
 
     @classmethod
     def from_dict(cls, conf: dict) -> "SubscriptionWatcherConfig":
@@ -47,9 +69,21 @@ class SubscriptionWatcherConfig:
             enabled=conf.get("enabled", True),
             num_data_fetchers=conf.get("num_data_fetchers", 2),
             num_media_fetchers=conf.get("num_media_fetchers", 2),
+            query_profile_sample_rate=conf.get("query_profile_sample_rate", 0),
+            min_data_fetchers=conf.get("min_data_fetchers"),
+            max_data_fetchers=conf.get("max_data_fetchers"),
+            min_media_fetchers=conf.get("min_media_fetchers"),
+            max_media_fetchers=conf.get("max_media_fetchers"),
         )
 
 
+def _pool_bounds(num: int, min_num: Optional[int], max_num: Optional[int]) -> tuple[int, int]:
+    # A pool always keeps at least one fetcher, and the starting number is always within its bounds
+    lower = max(1, min(num, num if min_num is None else min_num))
+    upper = max(num, num if max_num is None else max_num)
+    return lower, upper
+
+
 @dataclasses.dataclass
 class Config:
     fa_api_url: str
@@ -8,7 +8,7 @@ from typing import TYPE_CHECKING
 from telethon.events import NewMessage, StopPropagation
 
 from fa_search_bot.functionalities.functionalities import BotFunctionality
-from fa_search_bot.subscriptions.query_parser import InvalidQueryException
+from fa_search_bot.subscriptions.query_parser import InvalidQueryException, check_wildcard_limit, parse_query
 from fa_search_bot.subscriptions.subscription import Subscription
 
 if TYPE_CHECKING:
@@ -82,6 +82,7 @@ class SubscriptionFunctionality(BotFunctionality):
             return "Please specify the subscription query you wish to add."
         try:
             new_sub = Subscription(query, destination)
+            check_wildcard_limit(new_sub.query)
         except InvalidQueryException as e:
             logger.error("Failed to parse new subscription query: %s", query, exc_info=e)
             return f"Failed to parse subscription query: {html.escape(str(e))}"
@@ -103,7 +104,7 @@ class SubscriptionFunctionality(BotFunctionality):
 
     def _list_subs(self, destination: int) -> str:
         self.usage_counter.labels(function=self.USE_CASE_LIST).inc()
-        subs = [sub for sub in self.watcher.subscriptions if sub.destination == destination]
+        subs = self.watcher.subscriptions.for_destination(destination)
         subs.sort(key=lambda sub: sub.query_str.casefold())
         sub_list_entries = []
         for sub in subs:
@@ -116,12 +117,12 @@ class SubscriptionFunctionality(BotFunctionality):
 
     def _pause_destination(self, chat_id: int) -> str:
         self.usage_counter.labels(function=self.USE_CASE_PAUSE_DEST).inc()
-        subs = [sub for sub in self.watcher.subscriptions if sub.destination == chat_id]
+        subs = self.watcher.subscriptions.for_destination(chat_id)
         if not subs:
             return "There are no subscriptions posting here to pause."
-        running_subs = [sub for sub in subs if sub.paused is False]
-        if not running_subs:
+        if not self.watcher.subscriptions.count_active(chat_id):
             return "All subscriptions are already paused."
+        running_subs = [sub for sub in subs if sub.paused is False]
         for sub in running_subs:
             sub.paused = True
         self.watcher.save_to_json()
@@ -129,10 +130,9 @@ class SubscriptionFunctionality(BotFunctionality):
 
     def _pause_subscription(self, chat_id: int, sub_name: str) -> str:
         self.usage_counter.labels(function=self.USE_CASE_PAUSE_SUB).inc()
-        pause_sub = Subscription(sub_name, chat_id)
-        if pause_sub not in self.watcher.subscriptions:
+        matching = self.watcher.subscriptions.get_by_query(chat_id, sub_name)
+        if matching is None:
             return f'There is not a subscription for "{html.escape(sub_name)}" in this chat.'
-        matching = [sub for sub in self.watcher.subscriptions if sub == pause_sub][0]
         if matching.paused:
             return f'Subscription for "{html.escape(sub_name)}" is already paused.'
         matching.paused = True
@@ -141,12 +141,12 @@ class SubscriptionFunctionality(BotFunctionality):
 
     def _resume_destination(self, chat_id: int) -> str:
         self.usage_counter.labels(function=self.USE_CASE_RESUME_DEST).inc()
-        subs = [sub for sub in self.watcher.subscriptions if sub.destination == chat_id]
+        subs = self.watcher.subscriptions.for_destination(chat_id)
         if not subs:
             return "There are no subscriptions posting here to resume."
-        running_subs = [sub for sub in subs if sub.paused is True]
-        if not running_subs:
+        if not self.watcher.subscriptions.count_paused(chat_id):
             return "All subscriptions are already running."
+        running_subs = [sub for sub in subs if sub.paused is True]
         for sub in running_subs:
             sub.paused = False
         self.watcher.save_to_json()
@@ -154,10 +154,9 @@ class SubscriptionFunctionality(BotFunctionality):
 
     def _resume_subscription(self, chat_id: int, sub_name: str) -> str:
         self.usage_counter.labels(function=self.USE_CASE_RESUME_SUB).inc()
-        pause_sub = Subscription(sub_name, chat_id)
-        if pause_sub not in self.watcher.subscriptions:
+        matching = self.watcher.subscriptions.get_by_query(chat_id, sub_name)
+        if matching is None:
             return f'There is not a subscription for "{html.escape(sub_name)}" in this chat.'
-        matching = [sub for sub in self.watcher.subscriptions if sub == pause_sub][0]
         if not matching.paused:
             return f'Subscription for "{html.escape(sub_name)}" is already running.'
         matching.paused = False
@@ -207,6 +206,7 @@ class BlocklistFunctionality(BotFunctionality):
         if query == "":
             return "Please specify the tag you wish to add to blocklist."
         try:
+            check_wildcard_limit(parse_query(query))
             self.watcher.add_to_blocklist(destination, query)
         except InvalidQueryException as e:
             return f"Failed to parse blocklist query: {e}"
@@ -216,7 +216,7 @@ class BlocklistFunctionality(BotFunctionality):
     def _remove_from_blocklist(self, destination: int, query: str) -> str:
         self.usage_counter.labels(function=self.USE_CASE_REMOVE).inc()
         try:
-            self.watcher.blocklists.get(destination, set()).remove(query)
+            self.watcher.remove_from_blocklist(destination, query)
             self.watcher.save_to_json()
             return f'Removed tag from blocklist: "{query}".\n{self._list_blocklisted_tags(destination)}'
         except KeyError:
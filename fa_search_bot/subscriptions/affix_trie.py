@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import collections
+import logging
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Any, Counter, Dict, FrozenSet, Iterable, Optional, Set
+
+    from fa_search_bot.subscriptions.query_parser import Query
+
+
+logger = logging.getLogger(__name__)
+
+# Key marking the affix which ends at a trie node. Every other key is a single character, so cannot clash.
+_END = ""
+
+
+class AffixTrie:
+    """
+    A trie over a set of prefixes (or suffixes, if reverse is set) which finds every affix matching any of a set of
+    words by walking each word once. As with PrefixQuery and SuffixQuery, an affix does not match a word which it is
+    the whole of.
+    """
+
+    def __init__(self, affixes: Iterable[str], reverse: bool = False) -> None:
+        self.affixes: FrozenSet[str] = frozenset(affixes)
+        self.reverse = reverse
+        self._root: Dict[str, Any] = {}
+        for affix in self.affixes:
+            node = self._root
+            for char in reversed(affix) if reverse else affix:
+                node = node.setdefault(char, {})
+            node[_END] = affix
+
+    def matches(self, words: Iterable[str]) -> FrozenSet[str]:
+        """
+        Returns the affixes which match at least one of the given words.
+        """
+        if not self.affixes:
+            return frozenset()
+        root = self._root
+        found: Set[str] = set()
+        for word in words:
+            node = root
+            for char in reversed(word) if self.reverse else word:
+                affix = node.get(_END)
+                if affix is not None:
+                    found.add(affix)
+                next_node: Optional[Dict[str, Any]] = node.get(char)
+                if next_node is None:
+                    break
+                node = next_node
+        return frozenset(found)
+
+
+class AffixRegistry:
+    """
+    Keeps count of the prefixes or suffixes used by every registered query, and provides an AffixTrie over all of
+    them. The trie is rebuilt lazily, the first time it is needed after the registered affixes change.
+    """
+
+    def __init__(self, kind: str, reverse: bool = False) -> None:
+        self.kind = kind
+        self.reverse = reverse
+        self._counts: Counter[str] = collections.Counter()
+        self._trie: Optional[AffixTrie] = None
+
+    @property
+    def trie(self) -> AffixTrie:
+        if self._trie is None:
+            self._trie = AffixTrie(self._counts, self.reverse)
+            logger.debug("Built %s trie for %s terms", self.kind, len(self._counts))
+        return self._trie
+
+    def add(self, affix: str) -> None:
+        if affix not in self._counts:
+            self._trie = None
+        self._counts[affix] += 1
+
+    def remove(self, affix: str) -> None:
+        if affix not in self._counts:
+            return
+        self._counts[affix] -= 1
+        if self._counts[affix] <= 0:
+            del self._counts[affix]
+            self._trie = None
+
+    def add_query(self, query: Query) -> None:
+        for term in query.affix_terms():
+            if term.kind == self.kind:
+                self.add(term.value)
+
+    def remove_query(self, query: Query) -> None:
+        for term in query.affix_terms():
+            if term.kind == self.kind:
+                self.remove(term.value)
+
+    def __contains__(self, affix: object) -> bool:
+        return affix in self._counts
+
+    def __len__(self) -> int:
+        return len(self._counts)
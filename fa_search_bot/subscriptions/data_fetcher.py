@@ -3,7 +3,7 @@ from __future__ import annotations
 import asyncio
 import logging
 from asyncio import QueueEmpty
-from typing import Optional, TYPE_CHECKING
+from typing import List, Optional, TYPE_CHECKING
 
 from prometheus_client import Counter, Histogram, Gauge
 
@@ -11,6 +11,7 @@ from fa_search_bot.sites.furaffinity.fa_export_api import PageNotFound, Cloudfla
 from fa_search_bot.sites.furaffinity.fa_submission import FASubmissionFull
 from fa_search_bot.sites.submission_id import SubmissionID
 from fa_search_bot.subscriptions.runnable import Runnable, ShutdownError
+from fa_search_bot.subscriptions.submission_trace import STAGE_FETCH_END, STAGE_FETCH_START, STAGE_MATCHED
 from fa_search_bot.subscriptions.utils import time_taken
 
 if TYPE_CHECKING:
@@ -74,55 +75,117 @@ sub_total_matches = Counter(
     "fasearchbot_datafetcher_sub_matches_total",
     "Total number of subscriptions matches",
 )
+histogram_batch_size = Histogram(
+    "fasearchbot_datafetcher_batch_size",
+    "Number of submission IDs the data fetcher took from the queue to fetch and match together",
+    buckets=[1, 2, 5, 10, 20, float("inf")]
+)
 
 
 class DataFetcher(Runnable):
     FETCH_CLOUDFLARE_BACKOFF = 60
     FETCH_EXCEPTION_BACKOFF = 20
+    # Up to this many submissions are fetched concurrently and then matched together, while the queue has a backlog of
+    # at least BATCH_QUEUE_THRESHOLD waiting
+    MAX_BATCH_SIZE = 20
+    BATCH_QUEUE_THRESHOLD = 50
 
     def __init__(self, watcher: "SubscriptionWatcher") -> None:
         super().__init__(watcher)
-        self.last_sub_id: Optional[SubmissionID] = None
+        # The submission IDs taken from the queue which have not yet been fully processed
+        self.last_sub_ids: List[SubmissionID] = []
 
     async def do_process(self) -> None:
         try:
             sub_id = await self.watcher.wait_pool.get_next_for_data_fetch()
         except QueueEmpty:
             with time_taken_queue_waiting.time():
-                await asyncio.sleep(self.QUEUE_BACKOFF)
+                await self._wait_for_work(self.watcher.wait_pool.wait_for_data_fetch())
+            return
+        self.last_sub_ids = [sub_id]
+        # When catching up on a backlog, take a micro-batch of IDs, to match against subscriptions all together
+        while (
+            len(self.last_sub_ids) < self.MAX_BATCH_SIZE
+            and self.watcher.wait_pool.qsize_fetch() >= self.BATCH_QUEUE_THRESHOLD
+        ):
+            self.last_sub_ids.append(await self.watcher.wait_pool.get_next_for_data_fetch())
+        histogram_batch_size.observe(len(self.last_sub_ids))
+        # Fetch data for the whole batch at once, so that a batch takes about as long as its slowest fetch
+        batch_ids = list(self.last_sub_ids)
+        batch_results = await self._fetch_batch(batch_ids)
+        fetched_ids = []
+        full_results = []
+        for sub_id, full_result in zip(batch_ids, batch_results):
+            if full_result is not None:
+                fetched_ids.append(sub_id)
+                full_results.append(full_result)
+        if not full_results:
             return
-        self.last_sub_id = sub_id
-        # Fetch data
+        # See which subscriptions match each submission
+        with time_taken_checking_matches.time():
+            matched_version = self.watcher.subscriptions.version
+            if len(full_results) == 1:
+                match_matrix = [self.watcher.check_subscriptions(full_results[0])]
+            else:
+                match_matrix = self.watcher.check_subscriptions_batch(full_results)
+        # Publish results
+        for sub_id, full_result, matching_subscriptions in zip(fetched_ids, full_results, match_matrix):
+            self.watcher.wait_pool.mark_stage(sub_id, STAGE_MATCHED)
+            logger.debug("Submission %s matches %s subscriptions", sub_id, len(matching_subscriptions))
+            if matching_subscriptions:
+                sub_matches.inc()
+                sub_total_matches.inc(len(matching_subscriptions))
+                with time_taken_publishing.time():
+                    await self.watcher.wait_pool.set_fetched_data(
+                        sub_id, full_result, matching_subscriptions, matched_version
+                    )
+            else:
+                with time_taken_publishing.time():
+                    await self.watcher.wait_pool.remove_state(sub_id)
+            self.last_sub_ids.remove(sub_id)
+
+    async def _fetch_batch(self, sub_ids: List[SubmissionID]) -> List[Optional[FASubmissionFull]]:
+        """
+        Fetches data for each submission in a batch concurrently. If any fetch fails, the rest are cancelled and waited
+        for before the error is raised, so that none of them carry on after the batch has been reverted.
+        """
+        tasks = [asyncio.ensure_future(self._fetch_batch_item(sub_id)) for sub_id in sub_ids]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.wait(tasks)
+        errors = [task.exception() for task in tasks if not task.cancelled()]
+        for error in errors:
+            if error is not None:
+                raise error
+        return [task.result() for task in tasks]
+
+    async def _fetch_batch_item(self, sub_id: SubmissionID) -> Optional[FASubmissionFull]:
         logger.debug("Got %s from queue, fetching data", sub_id)
         full_result = await self.fetch_data(sub_id)
         if full_result is None:
             counter_subs_missed.inc()
-            return
+            # Removed straight away, so that it is not reverted if another fetch in the batch fails
+            self.last_sub_ids.remove(sub_id)
+            return None
         counter_subs_found.inc()
-        # See if any subscriptions match the submission
-        with time_taken_checking_matches.time():
-            matching_subscriptions = self.watcher.check_subscriptions(full_result)
-        logger.debug("Submission %s matches %s subscriptions", sub_id, len(matching_subscriptions))
-        # Publish results
-        if matching_subscriptions:
-            sub_matches.inc()
-            sub_total_matches.inc(len(matching_subscriptions))
-            with time_taken_publishing.time():
-                await self.watcher.wait_pool.set_fetched_data(sub_id, full_result)
-        else:
-            with time_taken_publishing.time():
-                await self.watcher.wait_pool.remove_state(sub_id)
+        return full_result
 
     async def fetch_data(self, sub_id: SubmissionID) -> Optional[FASubmissionFull]:
         # Keep trying to fetch data, unless it is gone
         attempts = 0
+        self.watcher.wait_pool.mark_stage(sub_id, STAGE_FETCH_START)
         while self.running:
             try:
                 with time_taken_submission_api.time():
                     attempts += 1
+                    self.watcher.scaling_stats.fetch_attempts += 1
                     full_result = await self.watcher.api.get_full_submission(sub_id.submission_id)
                 logger.debug("Got full data for submission %s", sub_id.submission_id)
                 fetch_attempts_success.inc()
+                self.watcher.wait_pool.mark_stage(sub_id, STAGE_FETCH_END)
                 histogram_fetch_attempts.observe(attempts)
                 return full_result
             except PageNotFound:
@@ -139,6 +202,7 @@ class DataFetcher(Runnable):
                     self.FETCH_CLOUDFLARE_BACKOFF
                 )
                 fetch_attempts_cloudflare.inc()
+                self.watcher.scaling_stats.cloudflare_errors += 1
                 with time_taken_cloudflare_backoff.time():
                     await self._wait_while_running(self.FETCH_CLOUDFLARE_BACKOFF)
                 continue
@@ -156,6 +220,8 @@ class DataFetcher(Runnable):
         raise ShutdownError("Data fetcher has shutdown while trying to fetch data")
 
     async def revert_last_attempt(self) -> None:
-        if self.last_sub_id is None:
-            raise ValueError("Could not revert process, as no previous process has happened")
-        await self.watcher.wait_pool.revert_data_fetch(self.last_sub_id)
+        if not self.last_sub_ids:
+            raise ValueError("Could not revert process, as no unfinished process remains")
+        for sub_id in self.last_sub_ids:
+            await self.watcher.wait_pool.revert_data_fetch(sub_id)
+        self.last_sub_ids = []
@@ -1,8 +1,9 @@
+import collections
 import dataclasses
 import datetime
 import logging
-from asyncio import Queue, QueueEmpty
-from typing import Dict
+from asyncio import Event, Queue, QueueEmpty
+from typing import Deque, Dict, Tuple
 
 from prometheus_client import Gauge
 
@@ -40,33 +41,65 @@ class TooManyRefresh(Exception):
 
 
 class RefreshCounter:
+    """
+    Counts how many times each submission has been refreshed, forgetting submissions which have not been refreshed for
+    MAX_AGE.
+
+    Each time an entry is seen, it is appended to a queue along with the time it was seen, so the queue is ordered by
+    expiry. Cleaning pops expired items from the front of the queue, skipping those for entries which have been seen
+    again since, so each item is only popped once. The number of entries with each refresh count is also kept, so that
+    the maximum refresh count is known without scanning every entry.
+    """
     MAX_AGE = datetime.timedelta(minutes=5)
 
     def __init__(self, refresh_limit: int):
         self.refresh_limit = refresh_limit
         self._refresh_dict: Dict[SubmissionID, RefreshEntry] = {}
+        self._expiry_queue: Deque[Tuple[datetime.datetime, SubmissionID]] = collections.deque()
+        self._count_sizes: Dict[int, int] = collections.defaultdict(int)
+        self._max_count = 0
         refresh_counter_dict_size.set_function(lambda: len(self._refresh_dict))
-        refresh_counter_max_count.set_function(
-            lambda: max([e.refresh_count for e in self._refresh_dict.values()] + [0])
-        )
-
-    def _clean(self) -> None:
-        old_ids = []
-        for sub_id, entry in self._refresh_dict.items():
-            if entry.latest_seen < (datetime.datetime.now(datetime.timezone.utc) - self.MAX_AGE):
-                old_ids.append(sub_id)
-        for sub_id in old_ids:
-            del self._refresh_dict[sub_id]
+        refresh_counter_max_count.set_function(lambda: self._max_count)
+
+    def _clean(self, now: datetime.datetime) -> None:
+        oldest_allowed = now - self.MAX_AGE
+        while self._expiry_queue and self._expiry_queue[0][0] < oldest_allowed:
+            latest_seen, sub_id = self._expiry_queue.popleft()
+            entry = self._refresh_dict.get(sub_id)
+            # Skip items for entries which have been seen again since
+            if entry is not None and entry.latest_seen == latest_seen:
+                del self._refresh_dict[sub_id]
+                self._uncount(entry.refresh_count)
+
+    def _count(self, refresh_count: int) -> None:
+        self._count_sizes[refresh_count] += 1
+        self._max_count = max(self._max_count, refresh_count)
+
+    def _uncount(self, refresh_count: int) -> None:
+        self._count_sizes[refresh_count] -= 1
+        while self._max_count > 0 and self._count_sizes[self._max_count] == 0:
+            del self._count_sizes[self._max_count]
+            self._max_count -= 1
+
+    def max_count(self) -> int:
+        return self._max_count
 
     def add(self, sub_id: SubmissionID) -> None:
-        self._clean()
+        self._clean(datetime.datetime.now(datetime.timezone.utc))
         if entry := self._refresh_dict.get(sub_id):
             if entry.refresh_count > self.refresh_limit:
                 logger.warning("Submission %s has been refreshed too many times, raising exception", sub_id)
                 raise TooManyRefresh(f"Submission {sub_id} has been refreshed too many ({entry.refresh_count} > {self.refresh_limit}) times")
+            old_count = entry.refresh_count
             entry.observe()
-            return
-        self._refresh_dict[sub_id] = RefreshEntry()
+            # Counting the new refresh count first means the maximum never needs to be searched for here
+            self._count(entry.refresh_count)
+            self._uncount(old_count)
+        else:
+            entry = RefreshEntry()
+            self._refresh_dict[sub_id] = entry
+            self._count(entry.refresh_count)
+        self._expiry_queue.append((entry.latest_seen, sub_id))
 
 
 class FetchQueue:
@@ -75,6 +108,7 @@ class FetchQueue:
         self._new_queue: Queue[SubmissionID] = Queue()
         self._refresh_queue: Queue[SubmissionID] = Queue()
         self.refresh_counter = RefreshCounter(refresh_limit=100)
+        self._item_added = Event()
 
     def get_nowait(self) -> SubmissionID:
         try:
@@ -82,12 +116,22 @@ class FetchQueue:
         except QueueEmpty:
             return self._new_queue.get_nowait()
 
+    async def wait_for_item(self) -> None:
+        """
+        Waits until there is a submission ID in either queue.
+        """
+        while self.qsize() == 0:
+            self._item_added.clear()
+            await self._item_added.wait()
+
     async def put_new(self, sub_id: SubmissionID) -> None:
         await self._new_queue.put(sub_id)
+        self._item_added.set()
 
     async def put_refresh(self, sub_id: SubmissionID) -> None:
         self.refresh_counter.add(sub_id)
         await self._refresh_queue.put(sub_id)
+        self._item_added.set()
 
     def qsize(self) -> int:
         return self._refresh_queue.qsize() + self._new_queue.qsize()
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import dataclasses
+import logging
+from typing import TYPE_CHECKING
+
+from prometheus_client import Counter
+
+from fa_search_bot.subscriptions.runnable import Runnable
+from fa_search_bot.subscriptions.utils import time_taken
+
+if TYPE_CHECKING:
+    from typing import Tuple
+
+
+logger = logging.getLogger(__name__)
+
+time_taken_waiting = time_taken.labels(
+    task="waiting between scaling checks", runnable="FetcherScaler", task_type="waiting"
+)
+pool_changes = Counter(
+    "fasearchbot_fetcherscaler_pool_changes_total",
+    "Number of times the fetcher scaler has added or removed a fetcher from a pool, and why",
+    labelnames=["pool", "direction", "reason"],
+)
+
+POOL_DATA = "data_fetchers"
+POOL_MEDIA = "media_fetchers"
+
+REASON_BACKLOG = "backlog"
+REASON_IDLE = "idle"
+REASON_SLOWDOWN = "site_slowdown"
+REASON_CLOUDFLARE = "cloudflare_errors"
+REASON_UPLOAD_BACKLOG = "upload_backlog"
+
+
+@dataclasses.dataclass
+class ScalingStats:
+    """
+    Counts gathered by the data and media fetchers between each scaling check
+    """
+    fetch_attempts: int = 0
+    cloudflare_errors: int = 0
+    uploads: int = 0
+    upload_seconds: float = 0
+
+    def record_upload(self, seconds: float) -> None:
+        self.uploads += 1
+        self.upload_seconds += seconds
+
+    @property
+    def cloudflare_error_rate(self) -> float:
+        if self.fetch_attempts == 0:
+            return 0
+        return self.cloudflare_errors / self.fetch_attempts
+
+    @property
+    def mean_upload_seconds(self) -> float:
+        if self.uploads == 0:
+            return 0
+        return self.upload_seconds / self.uploads
+
+
+class FetcherScaler(Runnable):
+    """
+    Periodically resizes the data fetcher and media fetcher pools, within the configured bounds, by one fetcher at a
+    time.
+
+    Data fetchers are added while the fetch queue has a backlog, unless there is already a backlog of media to upload,
+    and removed when the fetch queue is empty. While FA is in a slowdown, or returning many cloudflare errors, data
+    fetchers are only removed, to go easier on the site.
+    Media fetchers are added while the backlog of media to upload would take too long to clear at the recent upload
+    latency, and removed when nothing is waiting for upload.
+    """
+    CHECK_INTERVAL = 30
+    # Add a data fetcher if there are more than this many submission IDs waiting per data fetcher
+    FETCH_BACKLOG_PER_FETCHER = 50
+    CLOUDFLARE_ERROR_RATE_LIMIT = 0.1
+    # Add a media fetcher if the upload backlog would take longer than this to clear with the current media fetchers
+    UPLOAD_BACKLOG_SECONDS = 60
+    # Without recent uploads to estimate latency from, add a media fetcher past this many uploads per media fetcher
+    UPLOAD_BACKLOG_PER_FETCHER = 10
+
+    async def do_process(self) -> None:
+        with time_taken_waiting.time():
+            await self._wait_while_running(self.CHECK_INTERVAL)
+        if not self.running:
+            return
+        stats = self.watcher.scaling_stats
+        self.watcher.scaling_stats = ScalingStats()
+        self.rescale(stats)
+
+    async def revert_last_attempt(self) -> None:
+        # Each check only looks at the latest state, so there is nothing to revert
+        pass
+
+    def rescale(self, stats: ScalingStats) -> None:
+        data_target, data_reason = self.target_data_fetchers(stats)
+        self._resize_pool(POOL_DATA, data_target, data_reason)
+        media_target, media_reason = self.target_media_fetchers(stats)
+        self._resize_pool(POOL_MEDIA, media_target, media_reason)
+
+    def target_data_fetchers(self, stats: ScalingStats) -> Tuple[int, str]:
+        current = len(self.watcher.data_fetchers)
+        lower, upper = self.watcher.config.data_fetcher_bounds
+        if self.watcher.api.slow_down_status:
+            return max(lower, current - 1), REASON_SLOWDOWN
+        if stats.cloudflare_error_rate > self.CLOUDFLARE_ERROR_RATE_LIMIT:
+            return max(lower, current - 1), REASON_CLOUDFLARE
+        queue_size = self.watcher.wait_pool.qsize_fetch()
+        if queue_size == 0:
+            return max(lower, current - 1), REASON_IDLE
+        # More data fetchers would only wait for the media fetchers, if the upload backlog is full
+        wait_pool = self.watcher.wait_pool
+        upload_full = wait_pool.qsize_waiting_for_upload() >= wait_pool.MAX_READY_FOR_UPLOAD
+        if queue_size > current * self.FETCH_BACKLOG_PER_FETCHER and not upload_full:
+            return min(upper, current + 1), REASON_BACKLOG
+        return current, REASON_BACKLOG
+
+    def target_media_fetchers(self, stats: ScalingStats) -> Tuple[int, str]:
+        current = len(self.watcher.media_fetchers)
+        lower, upper = self.watcher.config.media_fetcher_bounds
+        upload_size = self.watcher.wait_pool.qsize_upload()
+        if upload_size == 0:
+            return max(lower, current - 1), REASON_IDLE
+        if stats.uploads:
+            too_slow = upload_size * stats.mean_upload_seconds / current > self.UPLOAD_BACKLOG_SECONDS
+        else:
+            too_slow = upload_size > current * self.UPLOAD_BACKLOG_PER_FETCHER
+        if too_slow:
+            return min(upper, current + 1), REASON_UPLOAD_BACKLOG
+        return current, REASON_UPLOAD_BACKLOG
+
+    def _resize_pool(self, pool: str, target: int, reason: str) -> None:
+        fetchers = self.watcher.data_fetchers if pool == POOL_DATA else self.watcher.media_fetchers
+        current = len(fetchers)
+        if target == current:
+            return
+        direction = "up" if target > current else "down"
+        logger.info("Scaling %s %s from %s to %s, due to %s", pool, direction, current, target, reason)
+        pool_changes.labels(pool=pool, direction=direction, reason=reason).inc(abs(target - current))
+        while len(fetchers) < target:
+            if pool == POOL_DATA:
+                self.watcher.add_data_fetcher()
+            else:
+                self.watcher.add_media_fetcher()
+        while len(fetchers) > target:
+            if pool == POOL_DATA:
+                self.watcher.remove_data_fetcher()
+            else:
+                self.watcher.remove_media_fetcher()
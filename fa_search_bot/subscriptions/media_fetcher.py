@@ -1,7 +1,7 @@
 from __future__ import annotations
 
-import asyncio
 import logging
+import time
 from asyncio import QueueEmpty
 from typing import Optional, TYPE_CHECKING
 
@@ -51,7 +51,7 @@ class MediaFetcher(Runnable):
             full_data = await self.watcher.wait_pool.get_next_for_media_upload()
         except QueueEmpty:
             with time_taken_waiting.time():
-                await asyncio.sleep(self.QUEUE_BACKOFF)
+                await self._wait_for_work(self.watcher.wait_pool.wait_for_media_upload())
             return
         sendable = SendableFASubmission(full_data)
         sub_id = sendable.submission_id
@@ -68,9 +68,11 @@ class MediaFetcher(Runnable):
         cache_misses.inc()
         # Upload the file
         logger.debug("Uploading submission media: %s", sub_id)
+        upload_start = time.monotonic()
         try:
             with time_taken_uploading.time():
                 uploaded_media = await self.upload_sendable(sendable)
+            self.watcher.scaling_stats.record_upload(time.monotonic() - upload_start)
         except DownloadError as e:
             if e.exc.status != 404:
                 raise ValueError(
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import collections
+import logging
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Counter, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+    from fa_search_bot.subscriptions.query_parser import Query
+
+    Span = Tuple[int, int]
+
+
+logger = logging.getLogger(__name__)
+
+# Groups of characters which re.IGNORECASE treats as equal, even though their lowercase forms differ. The first
+# character of each group is the one the others are folded to.
+_CASE_EQUIVALENT_GROUPS = [
+    "i\u0131",  # i ı
+    "s\u017f",  # s ſ
+    "\u03bc\u00b5",  # μ µ
+    "\u03b9\u0345\u1fbe",  # ι (combining ypogegrammeni) ι
+    "\u0390\u1fd3",  # ΐ ΐ
+    "\u03b0\u1fe3",  # ΰ ΰ
+    "\u03b2\u03d0",  # β ϐ
+    "\u03b5\u03f5",  # ε ϵ
+    "\u03b8\u03d1",  # θ ϑ
+    "\u03ba\u03f0",  # κ ϰ
+    "\u03c0\u03d6",  # π ϖ
+    "\u03c1\u03f1",  # ρ ϱ
+    "\u03c3\u03c2",  # σ ς
+    "\u03c6\u03d5",  # φ ϕ
+    "\u0432\u1c80",  # в ᲀ
+    "\u0434\u1c81",  # д ᲁ
+    "\u043e\u1c82",  # о ᲂ
+    "\u0441\u1c83",  # с ᲃ
+    "\u0442\u1c84\u1c85",  # т ᲄ ᲅ
+    "\u044a\u1c86",  # ъ ᲆ
+    "\u0463\u1c87",  # ѣ ᲇ
+    "\ua64b\u1c88",  # ꙋ ᲈ
+    "\u1e61\u1e9b",  # ṡ ẛ
+    "\ufb06\ufb05",  # ﬆ ﬅ
+]
+_CASE_FOLD_TABLE = {ord(char): group[0] for group in _CASE_EQUIVALENT_GROUPS for char in group[1:]}
+
+
+def fold_case(text: str) -> Optional[str]:
+    """
+    Folds the case of a text, such that two texts match case-insensitively (in the way that re.IGNORECASE matches)
+    exactly when their folded forms are equal. Each character is folded in place, so positions in the folded text are
+    positions in the original text. Returns None for the rare texts where that is not possible, because lowercasing
+    them changes their length.
+    """
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        return None
+    return lowered.translate(_CASE_FOLD_TABLE)
+
+
+class PhraseHits:
+    """
+    The locations of every phrase of a PhraseAutomaton in a single text.
+    """
+
+    def __init__(self, phrases: FrozenSet[str], hits: Dict[str, List[Span]]) -> None:
+        self._phrases = phrases
+        self._hits = hits
+
+    def spans(self, phrase_key: Optional[str]) -> Optional[List[Span]]:
+        """
+        Returns the start and end positions of each match of the (case folded) phrase in the text, or None if the
+        phrase was not searched for, and so needs checking some other way.
+        """
+        if phrase_key not in self._phrases:
+            return None
+        return self._hits.get(phrase_key, [])
+
+
+class PhraseAutomaton:
+    """
+    An Aho-Corasick automaton over a set of case folded phrases, which finds every match of every phrase in a text with
+    a single scan of that text.
+    A match only counts where the phrase starts and ends at a word boundary: at either end of the text, or next to
+    whitespace or one of the boundary characters. Where a phrase's matches overlap, only those which a left-to-right
+    regex scan would find are kept.
+    """
+
+    def __init__(self, phrases: Iterable[str], boundary_chars: str) -> None:
+        self.phrases: FrozenSet[str] = frozenset(phrases)
+        self._boundary_chars = frozenset(boundary_chars)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._outputs: List[Tuple[Tuple[str, int], ...]] = [()]
+        for phrase in self.phrases:
+            self._insert(phrase)
+        self._build_fail_links()
+
+    def _insert(self, phrase: str) -> None:
+        state = 0
+        for char in phrase:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append(())
+            state = next_state
+        self._outputs[state] = ((phrase, len(phrase)),)
+
+    def _build_fail_links(self) -> None:
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail_state = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fail_state
+                self._outputs[next_state] += self._outputs[fail_state]
+
+    def _is_boundary(self, char: str) -> bool:
+        return char in self._boundary_chars or char.isspace()
+
+    def find(self, text: str) -> PhraseHits:
+        """
+        Finds the matches of every phrase in the text.
+        """
+        if not self.phrases:
+            return PhraseHits(self.phrases, {})
+        folded = fold_case(text)
+        if folded is None:
+            # Nothing was searched for, so every phrase gets checked directly against this text
+            return PhraseHits(frozenset(), {})
+        goto = self._goto
+        fail = self._fail
+        outputs = self._outputs
+        is_boundary = self._is_boundary
+        text_len = len(text)
+        hits: Dict[str, List[Span]] = {}
+        state = 0
+        for pos, char in enumerate(folded):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if not outputs[state]:
+                continue
+            end = pos + 1
+            if end < text_len and not is_boundary(text[end]):
+                continue
+            for phrase, phrase_len in outputs[state]:
+                start = end - phrase_len
+                if start > 0 and not is_boundary(text[start - 1]):
+                    continue
+                phrase_hits = hits.setdefault(phrase, [])
+                if phrase_hits and start < phrase_hits[-1][1]:
+                    continue
+                phrase_hits.append((start, end))
+        return PhraseHits(self.phrases, hits)
+
+
+class PhraseRegistry:
+    """
+    Keeps count of the phrases used by every registered query, and provides a PhraseAutomaton over all of them. The
+    automaton is rebuilt lazily, the first time it is needed after the registered phrases change.
+    """
+
+    def __init__(self, boundary_chars: str) -> None:
+        self._boundary_chars = boundary_chars
+        self._counts: Counter[str] = collections.Counter()
+        self._automaton: Optional[PhraseAutomaton] = None
+
+    @property
+    def automaton(self) -> PhraseAutomaton:
+        if self._automaton is None:
+            self._automaton = PhraseAutomaton(self._counts, self._boundary_chars)
+            logger.debug("Built phrase automaton for %s phrases", len(self._counts))
+        return self._automaton
+
+    def add(self, phrase_key: Optional[str]) -> None:
+        if phrase_key is None:
+            return
+        if phrase_key not in self._counts:
+            self._automaton = None
+        self._counts[phrase_key] += 1
+
+    def remove(self, phrase_key: Optional[str]) -> None:
+        if phrase_key is None or phrase_key not in self._counts:
+            return
+        self._counts[phrase_key] -= 1
+        if self._counts[phrase_key] <= 0:
+            del self._counts[phrase_key]
+            self._automaton = None
+
+    def add_query(self, query: Query) -> None:
+        for phrase_key in query.phrase_keys():
+            self.add(phrase_key)
+
+    def remove_query(self, query: Query) -> None:
+        for phrase_key in query.phrase_keys():
+            self.remove(phrase_key)
+
+    def __contains__(self, phrase_key: object) -> bool:
+        return phrase_key in self._counts
+
+    def __len__(self) -> int:
+        return len(self._counts)
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+from typing import TYPE_CHECKING
+
+from fa_search_bot.subscriptions.query_parser import GRAMMAR_VERSION, intern_query, parse_query, query_from_data
+
+if TYPE_CHECKING:
+    from typing import Dict, Iterable, List, Optional
+
+    from fa_search_bot.subscriptions.query_parser import Query
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCache:
+    """
+    An on-disk cache of parsed queries, keyed by query string, so that saved subscriptions and blocklists do not all
+    need parsing again at startup. The cache is only used if it was written with the current grammar version, so
+    changes to the parser invalidate it.
+    """
+
+    # Bump this whenever the layout of the cache file changes
+    CACHE_VERSION = 1
+
+    def __init__(self, filename: str, entries: Optional[Dict[str, List]] = None) -> None:
+        self.filename = filename
+        self.entries: Dict[str, List] = entries or {}
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, query_str: str) -> Query:
+        """
+        Returns the parsed query for the given string, from the cache if possible, or by parsing it otherwise.
+        Raises InvalidQueryException if the query cannot be parsed.
+        """
+        data = self.entries.get(query_str)
+        if data is not None:
+            try:
+                query = intern_query(query_from_data(data))
+                self.hits += 1
+                return query
+            except ValueError as e:
+                logger.warning("Invalid cached query data for query %s, parsing it instead", query_str, exc_info=e)
+        self.misses += 1
+        query = parse_query(query_str)
+        self.entries[query_str] = query.to_data()
+        return query
+
+    @classmethod
+    def load_from_file(cls, filename: str) -> "QueryCache":
+        try:
+            with open(filename, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            logger.info("No query cache exists, starting a blank one")
+            return cls(filename)
+        except ValueError as e:
+            logger.warning("Query cache could not be read, starting a blank one", exc_info=e)
+            return cls(filename)
+        if data.get("cache_version") != cls.CACHE_VERSION or data.get("grammar_version") != GRAMMAR_VERSION:
+            logger.info("Query cache is out of date, starting a blank one")
+            return cls(filename)
+        return cls(filename, data["queries"])
+
+    def save_to_file(self, query_strs: Iterable[str]) -> None:
+        """
+        Saves the cached queries for the given query strings, dropping any others, as they are no longer in use.
+        """
+        queries = {query_str: self.entries[query_str] for query_str in query_strs if query_str in self.entries}
+        data = {"cache_version": self.CACHE_VERSION, "grammar_version": GRAMMAR_VERSION, "queries": queries}
+        temp_filename = self.filename + ".temp"
+        with open(temp_filename, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(temp_filename, self.filename)
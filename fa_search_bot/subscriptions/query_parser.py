@@ -1,11 +1,15 @@
 from __future__ import annotations
 
+import bisect
+import contextlib
 import functools
+import itertools
 import logging
 import re
 import string
+import weakref
 from abc import ABC, abstractmethod
-from typing import TYPE_CHECKING, NewType
+from typing import TYPE_CHECKING, NamedTuple, NewType, cast
 
 import pyparsing
 from pyparsing import (
@@ -21,13 +25,38 @@ from pyparsing import (
 )
 
 from fa_search_bot.sites.furaffinity.fa_submission import Rating
+from fa_search_bot.subscriptions.affix_trie import AffixRegistry
+from fa_search_bot.subscriptions.phrase_automaton import PhraseRegistry, fold_case
+from fa_search_bot.subscriptions.wildcard import WildcardPattern
 
 if TYPE_CHECKING:
-    from typing import Any, Dict, List, Optional, Pattern, Sequence
+    from typing import (
+        Any,
+        Callable,
+        Dict,
+        FrozenSet,
+        Iterable,
+        Iterator,
+        List,
+        Match,
+        NoReturn,
+        Optional,
+        Pattern,
+        Sequence,
+        Set,
+        Tuple,
+        Type,
+        Union,
+    )
 
     from pyparsing import ParserElement, ParseResults
 
     from fa_search_bot.sites.furaffinity.fa_submission import FASubmissionFull
+    from fa_search_bot.subscriptions.affix_trie import AffixTrie
+    from fa_search_bot.subscriptions.phrase_automaton import PhraseAutomaton, PhraseHits
+
+    TextMatcher = Callable[["SubmissionText"], bool]
+    SubmissionMatcher = Callable[[FASubmissionFull], bool]
 
 
 logger = logging.getLogger(__name__)
@@ -47,6 +76,9 @@ not_punctuation_pattern = r"[^\s" + re.escape(punctuation) + "]+"
 boundary_pattern_start = r"(?:^|(?<=[\s" + re.escape(punctuation) + "]))"
 boundary_pattern_end = r"(?:(?=[\s" + re.escape(punctuation) + "])|$)"
 
+# Every phrase which registered queries search submission texts for, so they can all be found in a single pass
+phrase_registry = PhraseRegistry(punctuation)
+
 
 def _split_text_to_words(text: str) -> List[str]:
     return re.split(punctuation_pattern, text)
@@ -63,18 +95,327 @@ def _split_text_to_cleaned_words(text: str) -> List[str]:
 FieldLocation = NewType("FieldLocation", str)
 
 
+class IndexTerm(NamedTuple):
+    """
+    A term which can be looked up in a submission, used to index subscriptions by what they require a submission to
+    contain. The kind is one of the TERM_* constants, field is the Field class the term must be found in, (or None for
+    ratings) and value is the word, prefix, suffix, or Rating.
+    """
+    kind: str
+    field: Optional[Type["Field"]]
+    value: Any
+
+
+TERM_WORD = "word"
+TERM_PREFIX = "prefix"
+TERM_SUFFIX = "suffix"
+TERM_RATING = "rating"
+
+# Every prefix and suffix which registered queries look for, so they can be resolved together for each submission
+prefix_registry = AffixRegistry(TERM_PREFIX)
+suffix_registry = AffixRegistry(TERM_SUFFIX, reverse=True)
+
+
+# Rough relative costs of checking each type of query against a submission
+COST_RATING = 1
+COST_WORD = 2
+COST_AFFIX = 10
+COST_PHRASE = 20
+COST_REGEX = 30
+COST_EXCEPTION = 100
+
+
+def _index_word(word: str) -> str:
+    # Index keys are case folded, so that words which match case-insensitively share a key. They are folded from the
+    # lowercase word, as field words are lowercase, and lowercasing a dotted capital I makes it longer
+    lowered = word.lower()
+    if lowered.isascii():
+        return lowered
+    return fold_case(lowered) or lowered
+
+
+def _phrase_index_terms(phrase: str, field: "Field") -> Optional[Set[IndexTerm]]:
+    # Any match of a phrase (or of a word at a boundary) in a text must contain the phrase's longest word as a whole
+    # word in that text. Words with a dotted capital I are skipped, as re.IGNORECASE matches it to a plain i, which
+    # has a different index key
+    words = [_index_word(word) for word in _split_text_to_words(phrase) if word and fold_case(word) is not None]
+    if not words:
+        return None
+    return {IndexTerm(TERM_WORD, type(field), max(words, key=len))}
+
+
+def _has_no_punctuation(text: str) -> bool:
+    return re.fullmatch(not_punctuation_pattern, text) is not None
+
+
+def _sorted_words_have_prefix(sorted_words: List[str], prefix: str) -> bool:
+    # Words starting with the prefix sort together, straight after the prefix itself, which does not count
+    index = bisect.bisect_right(sorted_words, prefix)
+    return index < len(sorted_words) and sorted_words[index].startswith(prefix)
+
+
+class SubmissionText:
+    """
+    A lazily built view of the texts and words of a submission. Each field is only read, split and cleaned once, and
+    then shared by every query which is matched against the same submission. A view is built for each check of a
+    submission, and passed down to each query checked, so that it is freed along with the submission.
+    """
+
+    def __init__(self, sub: FASubmissionFull):
+        self.sub = sub
+        self._field_words: Dict[Type[Field], FrozenSet[str]] = {}
+        self._texts_dicts: Dict[Type[Field], Dict[FieldLocation, str]] = {}
+        self._texts: Dict[Type[Field], List[str]] = {}
+        self._index_words: Dict[Type[Field], FrozenSet[str]] = {}
+        self._split_words: Dict[FieldLocation, List[str]] = {}
+        self._phrase_automaton: Optional[PhraseAutomaton] = None
+        self._phrase_hits: Dict[FieldLocation, PhraseHits] = {}
+        self._sorted_words: Dict[Type[Field], List[str]] = {}
+        self._sorted_reversed_words: Dict[Type[Field], List[str]] = {}
+        self._affix_matches: Dict[str, Tuple[AffixTrie, Dict[Type[Field], FrozenSet[str]]]] = {}
+        self.memo: Optional[Dict[int, bool]] = None
+
+    @contextlib.contextmanager
+    def memoised(self) -> Iterator[None]:
+        """
+        While active, the result of each shared query node's compiled matcher is remembered, so that it is only
+        evaluated once for this submission, however many subscriptions and blocklists contain it.
+        """
+        previous_memo = self.memo
+        self.memo = {}
+        try:
+            yield
+        finally:
+            self.memo = previous_memo
+
+    def field_words(self, field: Field) -> FrozenSet[str]:
+        words = self._field_words.get(type(field))
+        if words is None:
+            words = self._field_words[type(field)] = frozenset(field.build_field_words(self))
+        return words
+
+    def texts_dict(self, field: Field) -> Dict[FieldLocation, str]:
+        texts_dict = self._texts_dicts.get(type(field))
+        if texts_dict is None:
+            texts_dict = self._texts_dicts[type(field)] = field.build_texts_dict(self)
+        return texts_dict
+
+    def texts(self, field: Field) -> List[str]:
+        texts = self._texts.get(type(field))
+        if texts is None:
+            texts = self._texts[type(field)] = list(self.texts_dict(field).values())
+        return texts
+
+    def split_words(self, location: FieldLocation, text: str) -> List[str]:
+        words = self._split_words.get(location)
+        if words is None:
+            words = self._split_words[location] = _split_text_to_cleaned_words(text)
+        return words
+
+    def index_words(self, field: Field) -> FrozenSet[str]:
+        """
+        Every word which an index term could match in the field, case folded in the same way as index terms. This is
+        the field words, along with the words of the raw texts, which phrases and match locations search within.
+        """
+        words = self._index_words.get(type(field))
+        if words is None:
+            word_set = set(self.field_words(field))
+            for location, text in self.texts_dict(field).items():
+                word_set.update(self.split_words(location, text))
+            word_set.discard("")
+            index_words = {_index_word(word) for word in word_set}
+            # A lowercased dotted capital I gains a combining dot, but phrases and match locations treat it as an i
+            index_words.update(_index_word(word.replace("i\u0307", "i")) for word in word_set if "\u0307" in word)
+            words = self._index_words[type(field)] = frozenset(index_words)
+        return words
+
+    def sorted_words(self, field: Field) -> List[str]:
+        words = self._sorted_words.get(type(field))
+        if words is None:
+            words = self._sorted_words[type(field)] = sorted(self.field_words(field))
+        return words
+
+    def sorted_reversed_words(self, field: Field) -> List[str]:
+        """
+        The field words, each reversed, in sorted order. Words ending in a suffix are then next to each other, as
+        words starting with a prefix are in sorted_words().
+        """
+        words = self._sorted_reversed_words.get(type(field))
+        if words is None:
+            words = self._sorted_reversed_words[type(field)] = sorted(word[::-1] for word in self.field_words(field))
+        return words
+
+    def _trie_matches(self, registry: AffixRegistry, trie: AffixTrie, field: Field) -> FrozenSet[str]:
+        cached_trie, trie_matches = self._affix_matches.get(registry.kind, (None, {}))
+        if cached_trie is not trie:
+            # The registered affixes have changed, so any earlier matches are out of date
+            trie_matches = {}
+            self._affix_matches[registry.kind] = (trie, trie_matches)
+        matches = trie_matches.get(type(field))
+        if matches is None:
+            matches = trie_matches[type(field)] = trie.matches(self.field_words(field))
+        return matches
+
+    def has_prefix(self, field: Field, prefix: str) -> bool:
+        """
+        Returns whether any word in the field starts with the (lowercase) prefix, without being the prefix itself.
+        Registered prefixes are read from the shared prefix trie's matches, others are found by bisecting the sorted
+        words.
+        """
+        trie = prefix_registry.trie
+        if prefix in trie.affixes:
+            return prefix in self._trie_matches(prefix_registry, trie, field)
+        return _sorted_words_have_prefix(self.sorted_words(field), prefix)
+
+    def has_suffix(self, field: Field, suffix: str) -> bool:
+        """
+        Returns whether any word in the field ends with the (lowercase) suffix, without being the suffix itself.
+        """
+        trie = suffix_registry.trie
+        if suffix in trie.affixes:
+            return suffix in self._trie_matches(suffix_registry, trie, field)
+        return _sorted_words_have_prefix(self.sorted_reversed_words(field), suffix[::-1])
+
+    def _location_phrase_hits(self, automaton: PhraseAutomaton, location: FieldLocation, text: str) -> PhraseHits:
+        if automaton is not self._phrase_automaton:
+            # The registered phrases have changed, so any earlier hits are out of date
+            self._phrase_automaton = automaton
+            self._phrase_hits = {}
+        hits = self._phrase_hits.get(location)
+        if hits is None:
+            hits = self._phrase_hits[location] = automaton.find(text)
+        return hits
+
+    def location_text(self, field: Field, location: FieldLocation) -> Optional[str]:
+        """
+        Returns the text at the given location, or None if the location is not part of the field.
+        """
+        return self.texts_dict(field).get(location)
+
+    def phrase_spans(
+        self, field: Field, phrase_key: Optional[str], regex: Pattern[str]
+    ) -> List[Tuple[FieldLocation, int, int]]:
+        """
+        Returns the location, start, and end of each match of a phrase in the texts of a field. Registered phrases are
+        read from the shared phrase automaton's hits, anything else is found by searching with the given regex.
+        """
+        return [
+            (location, start, end)
+            for location, text in self.texts_dict(field).items()
+            for start, end in self.location_phrase_spans(location, text, phrase_key, regex)
+        ]
+
+    def location_phrase_spans(
+        self, location: FieldLocation, text: str, phrase_key: Optional[str], regex: Pattern[str]
+    ) -> List[Tuple[int, int]]:
+        """
+        As phrase_spans(), but for the text at a single location.
+        """
+        automaton = phrase_registry.automaton
+        if phrase_key in automaton.phrases:
+            spans = self._location_phrase_hits(automaton, location, text).spans(phrase_key)
+            if spans is not None:
+                return spans
+        return [m.span() for m in regex.finditer(text)]
+
+    def has_phrase(self, field: Field, phrase_key: Optional[str], regex: Pattern[str]) -> bool:
+        """
+        Returns whether a phrase matches anywhere in the texts of a field, as phrase_spans() would find it.
+        """
+        automaton = phrase_registry.automaton
+        if phrase_key not in automaton.phrases:
+            return any(regex.search(text) for text in self.texts(field))
+        for location, text in self.texts_dict(field).items():
+            text_spans = self._location_phrase_hits(automaton, location, text).spans(phrase_key)
+            if text_spans is None:
+                if regex.search(text):
+                    return True
+            elif text_spans:
+                return True
+        return False
+
+
+def bit_indexes(bits: int) -> Iterator[int]:
+    """
+    Yields the index of each set bit in an int bitset, lowest first.
+    """
+    while bits:
+        lowest_bit = bits & -bits
+        yield lowest_bit.bit_length() - 1
+        bits ^= lowest_bit
+
+
+class SubmissionBatch:
+    """
+    A batch of submissions which queries can be checked against all at once. Each query is evaluated to an int bitset,
+    with bit i set if the query matches the i-th submission, so that And, Or and Not combine the results for the whole
+    batch with single bitwise operations. Words and ratings are looked up in term bitsets built once for the batch.
+    """
+
+    def __init__(self, subs: Sequence[FASubmissionFull]):
+        self.subs = list(subs)
+        self.texts = [SubmissionText(sub) for sub in self.subs]
+        self.all_bits = (1 << len(self.subs)) - 1
+        self._word_bits: Dict[Type[Field], Dict[str, int]] = {}
+        self._rating_bits: Optional[Dict[Rating, int]] = None
+        # The submissions each query node has been checked against so far, and which of those it matched. The query is
+        # kept too, so that its id cannot be reused by another query while the batch is in use
+        self._memo: Dict[int, Tuple[Query, int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.subs)
+
+    def word_bits(self, field: Field, word: str) -> int:
+        words_bits = self._word_bits.get(type(field))
+        if words_bits is None:
+            words_bits = self._word_bits[type(field)] = {}
+            for index, text in enumerate(self.texts):
+                bit = 1 << index
+                for field_word in text.field_words(field):
+                    words_bits[field_word] = words_bits.get(field_word, 0) | bit
+        return words_bits.get(word, 0)
+
+    def rating_bits(self, rating: Rating) -> int:
+        if self._rating_bits is None:
+            self._rating_bits = {}
+            for index, sub in enumerate(self.subs):
+                self._rating_bits[sub.rating] = self._rating_bits.get(sub.rating, 0) | (1 << index)
+        return self._rating_bits.get(rating, 0)
+
+    def matches(self, query: Query, mask: Optional[int] = None) -> int:
+        """
+        Returns the bitset of submissions which the query matches, out of those in the mask, or the whole batch if no
+        mask is given. Results are remembered for each query node, so shared sub-expressions are only checked once
+        against each submission.
+        """
+        if mask is None:
+            mask = self.all_bits
+        key = id(query)
+        _, checked, matched = self._memo.get(key, (query, 0, 0))
+        unchecked = mask & ~checked
+        if unchecked:
+            matched |= query.batch_matches(self, unchecked)
+            self._memo[key] = (query, checked | unchecked, matched)
+        return matched & mask
+
+
 class Field(ABC):
     @abstractmethod
-    def get_field_words(self, sub: FASubmissionFull) -> List[str]:
+    def build_field_words(self, text: SubmissionText) -> Iterable[str]:
         raise NotImplementedError
 
     @abstractmethod
-    def get_texts(self, sub: FASubmissionFull) -> List[str]:
+    def build_texts_dict(self, text: SubmissionText) -> Dict[FieldLocation, str]:
         raise NotImplementedError
 
-    @abstractmethod
+    def get_field_words(self, sub: FASubmissionFull) -> FrozenSet[str]:
+        return SubmissionText(sub).field_words(self)
+
+    def get_texts(self, sub: FASubmissionFull) -> List[str]:
+        return SubmissionText(sub).texts(self)
+
     def get_texts_dict(self, sub: FASubmissionFull) -> Dict[FieldLocation, str]:
-        raise NotImplementedError
+        return SubmissionText(sub).texts_dict(self)
 
     def __eq__(self, other: Any) -> bool:
         return isinstance(other, self.__class__)
@@ -84,76 +425,90 @@ class Field(ABC):
 
 
 class KeywordField(Field):
-    def get_field_words(self, sub: FASubmissionFull) -> List[str]:
-        return _clean_word_list(sub.keywords)
-
-    def get_texts(self, sub: FASubmissionFull) -> List[str]:
-        return sub.keywords
+    def build_field_words(self, text: SubmissionText) -> Iterable[str]:
+        return _clean_word_list(text.sub.keywords)
 
-    def get_texts_dict(self, sub: FASubmissionFull) -> Dict[FieldLocation, str]:
-        return {FieldLocation(f"keyword_{num}"): keyword for num, keyword in enumerate(sub.keywords)}
+    def build_texts_dict(self, text: SubmissionText) -> Dict[FieldLocation, str]:
+        return {FieldLocation(f"keyword_{num}"): keyword for num, keyword in enumerate(text.sub.keywords)}
 
 
 class TitleField(Field):
-    def get_field_words(self, sub: FASubmissionFull) -> List[str]:
-        return _split_text_to_cleaned_words(sub.title)
-
-    def get_texts(self, sub: FASubmissionFull) -> List[str]:
-        return [sub.title]
+    def build_field_words(self, text: SubmissionText) -> Iterable[str]:
+        return text.split_words(FieldLocation("title"), text.sub.title)
 
-    def get_texts_dict(self, sub: FASubmissionFull) -> Dict[FieldLocation, str]:
-        return {FieldLocation("title"): sub.title}
+    def build_texts_dict(self, text: SubmissionText) -> Dict[FieldLocation, str]:
+        return {FieldLocation("title"): text.sub.title}
 
 
 class DescriptionField(Field):
-    def get_field_words(self, sub: FASubmissionFull) -> List[str]:
-        return _split_text_to_cleaned_words(sub.description)
-
-    def get_texts(self, sub: FASubmissionFull) -> List[str]:
-        return [sub.description]
+    def build_field_words(self, text: SubmissionText) -> Iterable[str]:
+        return text.split_words(FieldLocation("description"), text.sub.description)
 
-    def get_texts_dict(self, sub: FASubmissionFull) -> Dict[FieldLocation, str]:
-        return {FieldLocation("description"): sub.description}
+    def build_texts_dict(self, text: SubmissionText) -> Dict[FieldLocation, str]:
+        return {FieldLocation("description"): text.sub.description}
 
 
 class ArtistField(Field):
-    def get_field_words(self, sub: FASubmissionFull) -> List[str]:
-        return [sub.author.name.lower(), sub.author.profile_name.lower()]
+    def build_field_words(self, text: SubmissionText) -> Iterable[str]:
+        return [text.sub.author.name.lower(), text.sub.author.profile_name.lower()]
 
-    def get_texts(self, sub: FASubmissionFull) -> List[str]:
-        return [sub.author.name, sub.author.profile_name]
-
-    def get_texts_dict(self, sub: FASubmissionFull) -> Dict[FieldLocation, str]:
+    def build_texts_dict(self, text: SubmissionText) -> Dict[FieldLocation, str]:
         return {
-            FieldLocation("name"): sub.author.name,
-            FieldLocation("profile_name"): sub.author.profile_name,
+            FieldLocation("name"): text.sub.author.name,
+            FieldLocation("profile_name"): text.sub.author.profile_name,
         }
 
 
 class AnyField(Field):
-    def get_field_words(self, sub: FASubmissionFull) -> List[str]:
-        return [
-            *TitleField().get_field_words(sub),
-            *DescriptionField().get_field_words(sub),
-            *KeywordField().get_field_words(sub),
-            *ArtistField().get_field_words(sub),
-        ]
+    def build_field_words(self, text: SubmissionText) -> Iterable[str]:
+        return frozenset().union(*(text.field_words(field) for field in SPECIFIC_FIELDS))
 
-    def get_texts(self, sub: FASubmissionFull) -> List[str]:
-        return [
-            *TitleField().get_texts(sub),
-            *DescriptionField().get_texts(sub),
-            *KeywordField().get_texts(sub),
-            *ArtistField().get_texts(sub),
-        ]
+    def build_texts_dict(self, text: SubmissionText) -> Dict[FieldLocation, str]:
+        texts_dict: Dict[FieldLocation, str] = {}
+        for field in SPECIFIC_FIELDS:
+            texts_dict.update(text.texts_dict(field))
+        return texts_dict
 
-    def get_texts_dict(self, sub: FASubmissionFull) -> Dict[FieldLocation, str]:
-        return {
-            **TitleField().get_texts_dict(sub),
-            **DescriptionField().get_texts_dict(sub),
-            **KeywordField().get_texts_dict(sub),
-            **ArtistField().get_texts_dict(sub),
-        }
+
+SPECIFIC_FIELDS = [TitleField(), DescriptionField(), KeywordField(), ArtistField()]
+
+FIELD_DATA_NAMES: Dict[Type[Field], str] = {
+    AnyField: "any",
+    TitleField: "title",
+    DescriptionField: "description",
+    KeywordField: "keyword",
+    ArtistField: "artist",
+}
+FIELDS_BY_DATA_NAME: Dict[str, Type[Field]] = {name: field_type for field_type, name in FIELD_DATA_NAMES.items()}
+
+
+def field_to_data(field: Field) -> str:
+    return FIELD_DATA_NAMES[type(field)]
+
+
+def field_from_data(data: str) -> Field:
+    return FIELDS_BY_DATA_NAME[data]()
+
+
+class SortedIntervals:
+    """
+    The start and end positions of a set of matches within one text, sorted by start position, so that a span can be
+    checked against all of them by bisecting, rather than by comparing it to each in turn.
+    """
+
+    def __init__(self, spans: Iterable[Tuple[int, int]]) -> None:
+        ordered = sorted(spans)
+        self.starts = [start for start, _ in ordered]
+        # The furthest end position of any interval up to and including each one
+        self.max_ends = list(itertools.accumulate((end for _, end in ordered), max))
+
+    def overlaps(self, start: int, end: int) -> bool:
+        # Intervals starting at or before the span overlap it if they end after it starts
+        index = bisect.bisect_right(self.starts, start)
+        if index and self.max_ends[index - 1] > start:
+            return True
+        # Otherwise, the first interval starting after the span overlaps it if it starts before the span ends
+        return index < len(self.starts) and self.starts[index] < end
 
 
 class MatchLocation:
@@ -170,8 +525,11 @@ class MatchLocation:
         else:
             return location.end_position > self.start_position
 
-    def overlaps_any(self, locations: List["MatchLocation"]) -> bool:
-        return any(self.overlaps(location) for location in locations)
+    def overlaps_any(self, locations: Iterable["MatchLocation"]) -> bool:
+        intervals = SortedIntervals(
+            (location.start_position, location.end_position) for location in locations if location.field == self.field
+        )
+        return intervals.overlaps(self.start_position, self.end_position)
 
     def __eq__(self, other: Any) -> bool:
         return (
@@ -188,24 +546,283 @@ class MatchLocation:
         return f"MatchLocation(FieldLocation({self.field}), {self.start_position}, {self.end_position})"
 
 
+def _group_word_queries(
+    sub_queries: Sequence["Query"],
+) -> Tuple[List[Tuple["Field", FrozenSet[str]]], List["Query"]]:
+    # Gathers plain word queries together by field, so they can be checked against the field's word set all at once
+    word_groups: Dict[Type[Field], Tuple[Field, Set[str]]] = {}
+    other_queries = []
+    for query in sub_queries:
+        if type(query) is WordQuery:
+            word_groups.setdefault(type(query.field), (query.field, set()))[1].add(query.word_lower)
+        else:
+            other_queries.append(query)
+    return [(field, frozenset(words)) for field, words in word_groups.values()], other_queries
+
+
+def _compile_any_word(field: "Field", words: Iterable[str]) -> TextMatcher:
+    word_set = frozenset(words)
+    if len(word_set) == 1:
+        (word,) = word_set
+        return lambda text: word in text.field_words(field)
+    return lambda text: not word_set.isdisjoint(text.field_words(field))
+
+
+def _compile_all_words(field: "Field", words: Iterable[str]) -> TextMatcher:
+    word_set = frozenset(words)
+    if len(word_set) == 1:
+        (word,) = word_set
+        return lambda text: word in text.field_words(field)
+    return lambda text: word_set.issubset(text.field_words(field))
+
+
+def _compile_any(matchers: List[TextMatcher]) -> TextMatcher:
+    if not matchers:
+        return lambda text: False
+    if len(matchers) == 1:
+        return matchers[0]
+    if len(matchers) == 2:
+        first, second = matchers
+        return lambda text: first(text) or second(text)
+    matcher_tuple = tuple(matchers)
+
+    def match_any(text: SubmissionText) -> bool:
+        for matcher in matcher_tuple:
+            if matcher(text):
+                return True
+        return False
+
+    return match_any
+
+
+def _compile_all(matchers: List[TextMatcher]) -> TextMatcher:
+    if not matchers:
+        return lambda text: True
+    if len(matchers) == 1:
+        return matchers[0]
+    if len(matchers) == 2:
+        first, second = matchers
+        return lambda text: first(text) and second(text)
+    matcher_tuple = tuple(matchers)
+
+    def match_all(text: SubmissionText) -> bool:
+        for matcher in matcher_tuple:
+            if not matcher(text):
+                return False
+        return True
+
+    return match_all
+
+
+def _memoise(query: "Query", matcher: TextMatcher) -> TextMatcher:
+    # Plain words and ratings are quicker to check again than to look up
+    if query.cost() <= COST_WORD:
+        return matcher
+    key = id(query)
+
+    def memoised(text: SubmissionText) -> bool:
+        memo = text.memo
+        if memo is None:
+            return matcher(text)
+        result = memo.get(key)
+        if result is None:
+            result = memo[key] = matcher(text)
+        return result
+
+    return memoised
+
+
+def compile_query(query: "Query") -> SubmissionMatcher:
+    """
+    Compiles a query into a single function which checks whether a submission matches it.
+    """
+    text_matcher = query.matcher()
+
+    def matches(sub: FASubmissionFull) -> bool:
+        return text_matcher(SubmissionText(sub))
+
+    return matches
+
+
 class Query(ABC):
-    @abstractmethod
+    _hash: Optional[int] = None
+    _matcher: Optional[TextMatcher] = None
+
     def matches_submission(self, sub: FASubmissionFull) -> bool:
+        return self.matches_text(SubmissionText(sub))
+
+    @abstractmethod
+    def matches_text(self, text: SubmissionText) -> bool:
+        """
+        Checks whether the submission matches this query, by walking the query tree.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def compile(self) -> TextMatcher:
+        """
+        Compiles this query into a single function which checks a SubmissionText, with its patterns and word sets
+        bound in, to avoid the overhead of walking the query tree for each submission.
+        """
         raise NotImplementedError
 
+    def matcher(self) -> TextMatcher:
+        """
+        Returns the compiled form of this query, built once per query node, which remembers its result while the
+        SubmissionText is memoised.
+        """
+        if self._matcher is None:
+            self._matcher = _memoise(self, self.compile())
+        return self._matcher
+
+    def batch_matches(self, batch: SubmissionBatch, mask: int) -> int:
+        """
+        Returns the bitset of submissions in the batch which this query matches, out of those in the mask. By default
+        the compiled matcher is checked against each of those submissions in turn.
+        """
+        matcher = self.matcher()
+        texts = batch.texts
+        matched = 0
+        for index in bit_indexes(mask):
+            if matcher(texts[index]):
+                matched |= 1 << index
+        return matched
+
+    @abstractmethod
+    def _structural_key(self) -> Tuple:
+        """
+        Returns a tuple of everything which this query's equality depends on, including its sub-queries.
+        """
+        raise NotImplementedError
+
+    def _structural_hash(self) -> int:
+        # Query nodes are not changed after creation, so the hash can be kept
+        if self._hash is None:
+            self._hash = hash(self._structural_key())
+        return self._hash
+
+    def intern_children(self, intern: Callable[[Query], Query]) -> None:
+        """
+        Replaces each sub-query with the result of intern() on it.
+        """
+        pass
 
-class LocationQuery(Query, ABC):
     @abstractmethod
+    def to_data(self) -> List:
+        """
+        Returns a compact, JSON serialisable form of this query, which query_from_data() turns back into an equal query.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def cost(self) -> int:
+        """
+        Returns a rough relative cost of checking this query against a submission, used to decide which queries to
+        check first.
+        """
+        raise NotImplementedError
+
+    def index_terms(self) -> Optional[Set[IndexTerm]]:
+        """
+        Returns a set of terms, at least one of which must be present in a submission for this query to match it.
+        Returns None if no such set can be determined, in which case the query has to be checked against every
+        submission.
+        """
+        return None
+
+    def phrase_keys(self) -> List[Optional[str]]:
+        """
+        Returns the case folded keys of the phrases which this query searches submission texts for, to register with
+        the phrase_registry. None is given for phrases which cannot be registered.
+        """
+        return []
+
+    def affix_terms(self) -> List[IndexTerm]:
+        """
+        Returns the prefix and suffix terms which this query looks for in submission words, to register with the
+        prefix_registry and suffix_registry.
+        """
+        return []
+
+    def wildcard_words(self) -> List[str]:
+        """
+        Returns the words with asterisks which this query searches for, so that check_wildcard_limit() can refuse new
+        queries with too many wildcards in a word.
+        """
+        return []
+
+
+class LocationQuery(Query, ABC):
     def match_locations(self, sub: FASubmissionFull) -> List[MatchLocation]:
+        return self.text_match_locations(SubmissionText(sub))
+
+    @abstractmethod
+    def text_match_locations(self, text: SubmissionText) -> List[MatchLocation]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def location_spans(self, text: SubmissionText, location: FieldLocation) -> List[Tuple[int, int]]:
+        """
+        Returns the start and end of each match within a single location of the submission, so that only the
+        locations which are needed have to be searched. Locations outside the query's field have no matches.
+        """
         raise NotImplementedError
 
+    def location_index_terms(self) -> Optional[Set[IndexTerm]]:
+        """
+        As index_terms(), but for terms which must be present for match_locations() to return any locations.
+        """
+        return None
+
+    def location_phrase_keys(self) -> List[Optional[str]]:
+        """
+        As phrase_keys(), but for the phrases which match_locations() searches for.
+        """
+        return []
+
 
 class OrQuery(Query):
     def __init__(self, sub_queries: Sequence["Query"]):
         self.sub_queries = sub_queries
 
-    def matches_submission(self, sub: FASubmissionFull) -> bool:
-        return any(q.matches_submission(sub) for q in self.sub_queries)
+    def matches_text(self, text: SubmissionText) -> bool:
+        return any(q.matches_text(text) for q in self.sub_queries)
+
+    def index_terms(self) -> Optional[Set[IndexTerm]]:
+        terms: Set[IndexTerm] = set()
+        for query in self.sub_queries:
+            query_terms = query.index_terms()
+            if query_terms is None:
+                return None
+            terms.update(query_terms)
+        return terms
+
+    def cost(self) -> int:
+        return sum(q.cost() for q in self.sub_queries)
+
+    def phrase_keys(self) -> List[Optional[str]]:
+        return [key for q in self.sub_queries for key in q.phrase_keys()]
+
+    def affix_terms(self) -> List[IndexTerm]:
+        return [term for q in self.sub_queries for term in q.affix_terms()]
+
+    def wildcard_words(self) -> List[str]:
+        return [word for q in self.sub_queries for word in q.wildcard_words()]
+
+    def compile(self) -> TextMatcher:
+        word_groups, other_queries = _group_word_queries(self.sub_queries)
+        matchers = [_compile_any_word(field, words) for field, words in word_groups]
+        matchers += [q.matcher() for q in other_queries]
+        return _compile_any(matchers)
+
+    def batch_matches(self, batch: SubmissionBatch, mask: int) -> int:
+        # Each sub-query only needs checking against the submissions which no earlier sub-query has matched
+        matched = 0
+        for query in self.sub_queries:
+            matched |= batch.matches(query, mask & ~matched)
+            if matched == mask:
+                break
+        return matched
 
     def __eq__(self, other: Any) -> bool:
         return (
@@ -214,6 +831,18 @@ class OrQuery(Query):
             and all(self.sub_queries[i] == other.sub_queries[i] for i in range(len(self.sub_queries)))
         )
 
+    def __hash__(self) -> int:
+        return self._structural_hash()
+
+    def _structural_key(self) -> Tuple:
+        return "OR", tuple(self.sub_queries)
+
+    def to_data(self) -> List:
+        return ["or", [q.to_data() for q in self.sub_queries]]
+
+    def intern_children(self, intern: Callable[[Query], Query]) -> None:
+        self.sub_queries = [intern(q) for q in self.sub_queries]
+
     def __repr__(self) -> str:
         return "OR(" + ", ".join(repr(q) for q in self.sub_queries) + ")"
 
@@ -227,16 +856,67 @@ class LocationOrQuery(OrQuery, LocationQuery):
         # Set it again, so we know sub_queries are LocationQuery objects, rather than just Query objects
         self.sub_queries: List["LocationQuery"] = sub_queries
 
-    def match_locations(self, sub: FASubmissionFull) -> List[MatchLocation]:
-        return list(set(match for q in self.sub_queries for match in q.match_locations(sub)))
+    def text_match_locations(self, text: SubmissionText) -> List[MatchLocation]:
+        return list(set(match for q in self.sub_queries for match in q.text_match_locations(text)))
+
+    def location_spans(self, text: SubmissionText, location: FieldLocation) -> List[Tuple[int, int]]:
+        return [span for q in self.sub_queries for span in q.location_spans(text, location)]
+
+    def location_index_terms(self) -> Optional[Set[IndexTerm]]:
+        terms: Set[IndexTerm] = set()
+        for query in self.sub_queries:
+            query_terms = query.location_index_terms()
+            if query_terms is None:
+                return None
+            terms.update(query_terms)
+        return terms
+
+    def location_phrase_keys(self) -> List[Optional[str]]:
+        return [key for q in self.sub_queries for key in q.location_phrase_keys()]
+
+    def to_data(self) -> List:
+        return ["location_or", [q.to_data() for q in self.sub_queries]]
 
 
 class AndQuery(Query):
     def __init__(self, sub_queries: List["Query"]):
         self.sub_queries = sub_queries
 
-    def matches_submission(self, sub: FASubmissionFull) -> bool:
-        return all(q.matches_submission(sub) for q in self.sub_queries)
+    def matches_text(self, text: SubmissionText) -> bool:
+        return all(q.matches_text(text) for q in self.sub_queries)
+
+    def index_terms(self) -> Optional[Set[IndexTerm]]:
+        options = [terms for terms in (q.index_terms() for q in self.sub_queries) if terms is not None]
+        if not options:
+            return None
+        # Any of the sub-queries will do, so pick the most selective. Ratings match a large share of submissions.
+        return min(options, key=lambda terms: (any(t.kind == TERM_RATING for t in terms), len(terms)))
+
+    def cost(self) -> int:
+        return sum(q.cost() for q in self.sub_queries)
+
+    def phrase_keys(self) -> List[Optional[str]]:
+        return [key for q in self.sub_queries for key in q.phrase_keys()]
+
+    def affix_terms(self) -> List[IndexTerm]:
+        return [term for q in self.sub_queries for term in q.affix_terms()]
+
+    def wildcard_words(self) -> List[str]:
+        return [word for q in self.sub_queries for word in q.wildcard_words()]
+
+    def compile(self) -> TextMatcher:
+        word_groups, other_queries = _group_word_queries(self.sub_queries)
+        matchers = [_compile_all_words(field, words) for field, words in word_groups]
+        matchers += [q.matcher() for q in other_queries]
+        return _compile_all(matchers)
+
+    def batch_matches(self, batch: SubmissionBatch, mask: int) -> int:
+        # Each sub-query only needs checking against the submissions which every earlier sub-query has matched
+        for query in self.sub_queries:
+            mask = batch.matches(query, mask)
+            if not mask:
+                break
+        return mask
 
     def __eq__(self, other: Any) -> bool:
         return (
@@ -245,6 +925,18 @@ class AndQuery(Query):
             and all(self.sub_queries[i] == other.sub_queries[i] for i in range(len(self.sub_queries)))
         )
 
+    def __hash__(self) -> int:
+        return self._structural_hash()
+
+    def _structural_key(self) -> Tuple:
+        return "AND", tuple(self.sub_queries)
+
+    def to_data(self) -> List:
+        return ["and", [q.to_data() for q in self.sub_queries]]
+
+    def intern_children(self, intern: Callable[[Query], Query]) -> None:
+        self.sub_queries = [intern(q) for q in self.sub_queries]
+
     def __repr__(self) -> str:
         return "AND(" + ", ".join(repr(q) for q in self.sub_queries) + ")"
 
@@ -256,12 +948,43 @@ class NotQuery(Query):
     def __init__(self, sub_query: "Query"):
         self.sub_query = sub_query
 
-    def matches_submission(self, sub: FASubmissionFull) -> bool:
-        return not self.sub_query.matches_submission(sub)
+    def matches_text(self, text: SubmissionText) -> bool:
+        return not self.sub_query.matches_text(text)
+
+    def cost(self) -> int:
+        return self.sub_query.cost()
+
+    def phrase_keys(self) -> List[Optional[str]]:
+        return self.sub_query.phrase_keys()
+
+    def affix_terms(self) -> List[IndexTerm]:
+        return self.sub_query.affix_terms()
+
+    def wildcard_words(self) -> List[str]:
+        return self.sub_query.wildcard_words()
+
+    def compile(self) -> TextMatcher:
+        sub_matcher = self.sub_query.matcher()
+        return lambda text: not sub_matcher(text)
+
+    def batch_matches(self, batch: SubmissionBatch, mask: int) -> int:
+        return mask & ~batch.matches(self.sub_query, mask)
 
     def __eq__(self, other: Any) -> bool:
         return isinstance(other, NotQuery) and self.sub_query == other.sub_query
 
+    def __hash__(self) -> int:
+        return self._structural_hash()
+
+    def _structural_key(self) -> Tuple:
+        return "NOT", self.sub_query
+
+    def to_data(self) -> List:
+        return ["not", self.sub_query.to_data()]
+
+    def intern_children(self, intern: Callable[[Query], Query]) -> None:
+        self.sub_query = intern(self.sub_query)
+
     def __repr__(self) -> str:
         return f"NOT({self.sub_query!r})"
 
@@ -273,12 +996,34 @@ class RatingQuery(Query):
     def __init__(self, rating: Rating):
         self.rating = rating
 
-    def matches_submission(self, sub: FASubmissionFull) -> bool:
-        return sub.rating == self.rating
+    def matches_text(self, text: SubmissionText) -> bool:
+        return text.sub.rating == self.rating
+
+    def index_terms(self) -> Optional[Set[IndexTerm]]:
+        return {IndexTerm(TERM_RATING, None, self.rating)}
+
+    def cost(self) -> int:
+        return COST_RATING
+
+    def compile(self) -> TextMatcher:
+        rating = self.rating
+        return lambda text: text.sub.rating == rating
+
+    def batch_matches(self, batch: SubmissionBatch, mask: int) -> int:
+        return mask & batch.rating_bits(self.rating)
 
     def __eq__(self, other: Any) -> bool:
         return isinstance(other, RatingQuery) and self.rating == other.rating
 
+    def __hash__(self) -> int:
+        return self._structural_hash()
+
+    def _structural_key(self) -> Tuple:
+        return "RATING", self.rating
+
+    def to_data(self) -> List:
+        return ["rating", self.rating.name]
+
     def __repr__(self) -> str:
         return f"RATING({self.rating})"
 
@@ -289,24 +1034,62 @@ class RatingQuery(Query):
 class WordQuery(LocationQuery):
     def __init__(self, word: str, field: Optional["Field"] = None):
         self.word = word
+        self.word_lower = word.lower()
+        self.phrase_key = fold_case(word) or None
         if field is None:
             field = AnyField()
         self.field = field
 
-    def matches_submission(self, sub: FASubmissionFull) -> bool:
-        return self.word.lower() in self.field.get_field_words(sub)
+    @functools.cached_property
+    def word_regex(self) -> Pattern[str]:
+        # Only needed to find locations in text the phrase automaton cannot search, so compiled on first use
+        return re.compile(boundary_pattern_start + re.escape(self.word) + boundary_pattern_end, re.I)
 
-    def match_locations(self, sub: FASubmissionFull) -> List[MatchLocation]:
-        regex = re.compile(boundary_pattern_start + re.escape(self.word) + boundary_pattern_end, re.I)
+    def matches_text(self, text: SubmissionText) -> bool:
+        return self.word_lower in text.field_words(self.field)
+
+    def text_match_locations(self, text: SubmissionText) -> List[MatchLocation]:
         return [
-            MatchLocation(location, m.start(), m.end())
-            for location, text in self.field.get_texts_dict(sub).items()
-            for m in regex.finditer(text)
+            MatchLocation(location, start, end)
+            for location, start, end in text.phrase_spans(self.field, self.phrase_key, self.word_regex)
         ]
 
+    def location_spans(self, text: SubmissionText, location: FieldLocation) -> List[Tuple[int, int]]:
+        field_text = text.location_text(self.field, location)
+        if field_text is None:
+            return []
+        return text.location_phrase_spans(location, field_text, self.phrase_key, self.word_regex)
+
+    def index_terms(self) -> Optional[Set[IndexTerm]]:
+        return {IndexTerm(TERM_WORD, type(self.field), _index_word(self.word))}
+
+    def location_index_terms(self) -> Optional[Set[IndexTerm]]:
+        return _phrase_index_terms(self.word, self.field)
+
+    def location_phrase_keys(self) -> List[Optional[str]]:
+        return [self.phrase_key]
+
+    def cost(self) -> int:
+        return COST_WORD
+
+    def compile(self) -> TextMatcher:
+        return _compile_any_word(self.field, {self.word_lower})
+
+    def batch_matches(self, batch: SubmissionBatch, mask: int) -> int:
+        return mask & batch.word_bits(self.field, self.word_lower)
+
     def __eq__(self, other: Any) -> bool:
         return isinstance(other, WordQuery) and self.word == other.word and self.field == other.field
 
+    def __hash__(self) -> int:
+        return self._structural_hash()
+
+    def _structural_key(self) -> Tuple:
+        return "WORD", self.word, type(self.field)
+
+    def to_data(self) -> List:
+        return ["word", self.word, field_to_data(self.field)]
+
     def __repr__(self) -> str:
         if self.field == AnyField():
             return f"WORD({self.word})"
@@ -321,30 +1104,69 @@ class WordQuery(LocationQuery):
 class PrefixQuery(LocationQuery):
     def __init__(self, prefix: str, field: Optional["Field"] = None):
         self.prefix = prefix
+        self.prefix_lower = prefix.lower()
         if field is None:
             field = AnyField()
         self.field = field
 
-    def matches_submission(self, sub: FASubmissionFull) -> bool:
-        return any(
-            word.startswith(self.prefix.lower()) and word != self.prefix.lower()
-            for word in self.field.get_field_words(sub)
-        )
+    def matches_text(self, text: SubmissionText) -> bool:
+        return text.has_prefix(self.field, self.prefix_lower)
 
-    def match_locations(self, sub: FASubmissionFull) -> List[MatchLocation]:
-        regex = re.compile(
+    @functools.cached_property
+    def location_regex(self) -> Pattern[str]:
+        return re.compile(
             boundary_pattern_start + re.escape(self.prefix) + not_punctuation_pattern + boundary_pattern_end,
             re.I,
         )
+
+    def text_match_locations(self, text: SubmissionText) -> List[MatchLocation]:
+        regex = self.location_regex
         return [
             MatchLocation(location, m.start(), m.end())
-            for location, text in self.field.get_texts_dict(sub).items()
-            for m in regex.finditer(text)
+            for location, field_text in text.texts_dict(self.field).items()
+            for m in regex.finditer(field_text)
         ]
 
+    def location_spans(self, text: SubmissionText, location: FieldLocation) -> List[Tuple[int, int]]:
+        field_text = text.location_text(self.field, location)
+        if field_text is None:
+            return []
+        return [m.span() for m in self.location_regex.finditer(field_text)]
+
+    def index_terms(self) -> Optional[Set[IndexTerm]]:
+        if not self.prefix:
+            return None
+        return {IndexTerm(TERM_PREFIX, type(self.field), _index_word(self.prefix))}
+
+    def location_index_terms(self) -> Optional[Set[IndexTerm]]:
+        # Match locations treat a dotted capital I as an i, which has a different index key
+        if not _has_no_punctuation(self.prefix) or fold_case(self.prefix) is None:
+            return None
+        return self.index_terms()
+
+    def affix_terms(self) -> List[IndexTerm]:
+        return [IndexTerm(TERM_PREFIX, type(self.field), self.prefix_lower)]
+
+    def cost(self) -> int:
+        return COST_AFFIX
+
+    def compile(self) -> TextMatcher:
+        prefix = self.prefix_lower
+        field = self.field
+        return lambda text: text.has_prefix(field, prefix)
+
     def __eq__(self, other: Any) -> bool:
         return isinstance(other, PrefixQuery) and self.prefix == other.prefix and self.field == other.field
 
+    def __hash__(self) -> int:
+        return self._structural_hash()
+
+    def _structural_key(self) -> Tuple:
+        return "PREFIX", self.prefix, type(self.field)
+
+    def to_data(self) -> List:
+        return ["prefix", self.prefix, field_to_data(self.field)]
+
     def __repr__(self) -> str:
         if self.field == AnyField():
             return f"PREFIX({self.prefix})"
@@ -359,30 +1181,69 @@ class PrefixQuery(LocationQuery):
 class SuffixQuery(LocationQuery):
     def __init__(self, suffix: str, field: Optional["Field"] = None):
         self.suffix = suffix
+        self.suffix_lower = suffix.lower()
         if field is None:
             field = AnyField()
         self.field = field
 
-    def matches_submission(self, sub: FASubmissionFull) -> bool:
-        return any(
-            word.endswith(self.suffix.lower()) and word != self.suffix.lower()
-            for word in self.field.get_field_words(sub)
-        )
+    def matches_text(self, text: SubmissionText) -> bool:
+        return text.has_suffix(self.field, self.suffix_lower)
 
-    def match_locations(self, sub: FASubmissionFull) -> List[MatchLocation]:
-        regex = re.compile(
+    @functools.cached_property
+    def location_regex(self) -> Pattern[str]:
+        return re.compile(
             boundary_pattern_start + not_punctuation_pattern + re.escape(self.suffix) + boundary_pattern_end,
             re.I,
         )
+
+    def text_match_locations(self, text: SubmissionText) -> List[MatchLocation]:
+        regex = self.location_regex
         return [
             MatchLocation(location, m.start(), m.end())
-            for location, text in self.field.get_texts_dict(sub).items()
-            for m in regex.finditer(text)
+            for location, field_text in text.texts_dict(self.field).items()
+            for m in regex.finditer(field_text)
         ]
 
+    def location_spans(self, text: SubmissionText, location: FieldLocation) -> List[Tuple[int, int]]:
+        field_text = text.location_text(self.field, location)
+        if field_text is None:
+            return []
+        return [m.span() for m in self.location_regex.finditer(field_text)]
+
+    def index_terms(self) -> Optional[Set[IndexTerm]]:
+        if not self.suffix:
+            return None
+        return {IndexTerm(TERM_SUFFIX, type(self.field), _index_word(self.suffix))}
+
+    def location_index_terms(self) -> Optional[Set[IndexTerm]]:
+        # Match locations treat a dotted capital I as an i, which has a different index key
+        if not _has_no_punctuation(self.suffix) or fold_case(self.suffix) is None:
+            return None
+        return self.index_terms()
+
+    def affix_terms(self) -> List[IndexTerm]:
+        return [IndexTerm(TERM_SUFFIX, type(self.field), self.suffix_lower)]
+
+    def cost(self) -> int:
+        return COST_AFFIX
+
+    def compile(self) -> TextMatcher:
+        suffix = self.suffix_lower
+        field = self.field
+        return lambda text: text.has_suffix(field, suffix)
+
     def __eq__(self, other: Any) -> bool:
         return isinstance(other, SuffixQuery) and self.suffix == other.suffix and self.field == other.field
 
+    def __hash__(self) -> int:
+        return self._structural_hash()
+
+    def _structural_key(self) -> Tuple:
+        return "SUFFIX", self.suffix, type(self.field)
+
+    def to_data(self) -> List:
+        return ["suffix", self.suffix, field_to_data(self.field)]
+
     def __repr__(self) -> str:
         if self.field == AnyField():
             return f"SUFFIX({self.suffix})"
@@ -395,29 +1256,75 @@ class SuffixQuery(LocationQuery):
 
 
 class RegexQuery(LocationQuery):
-    def __init__(self, pattern: Pattern[str], field: Optional["Field"] = None):
+    def __init__(
+        self,
+        pattern: Pattern[str],
+        field: Optional["Field"] = None,
+        wildcard: Optional[Tuple[str, WildcardPattern]] = None,
+    ):
         self.pattern = pattern
         if field is None:
             field = AnyField()
         self.field = field
+        # For queries of words with asterisks, the word, and the matcher which finds the same matches as the pattern
+        # without backtracking
+        self.wildcard = wildcard
 
-    def matches_submission(self, sub: FASubmissionFull) -> bool:
-        return any(self.pattern.search(word) for word in self.field.get_field_words(sub))
+    def search(self, text: str) -> bool:
+        if self.wildcard is not None:
+            return self.wildcard[1].search(text)
+        return self.pattern.search(text) is not None
 
-    def match_locations(self, sub: FASubmissionFull) -> List[MatchLocation]:
+    def spans(self, text: str) -> List[Tuple[int, int]]:
+        if self.wildcard is not None:
+            return self.wildcard[1].spans(text)
+        return [m.span() for m in self.pattern.finditer(text)]
+
+    def matches_text(self, text: SubmissionText) -> bool:
+        return any(self.search(word) for word in text.field_words(self.field))
+
+    def text_match_locations(self, text: SubmissionText) -> List[MatchLocation]:
         return [
-            MatchLocation(location, m.start(), m.end())
-            for location, text in self.field.get_texts_dict(sub).items()
-            for m in self.pattern.finditer(text)
+            MatchLocation(location, start, end)
+            for location, field_text in text.texts_dict(self.field).items()
+            for start, end in self.spans(field_text)
         ]
 
+    def location_spans(self, text: SubmissionText, location: FieldLocation) -> List[Tuple[int, int]]:
+        field_text = text.location_text(self.field, location)
+        if field_text is None:
+            return []
+        return self.spans(field_text)
+
     @classmethod
     def from_string_with_asterisks(cls, word: str, field: Optional["Field"] = None) -> "RegexQuery":
         word_split = re.split(r"\*+", word)
         parts = [re.escape(part) for part in word_split]
         regex = boundary_pattern_start + not_punctuation_pattern.join(parts) + boundary_pattern_end
         pattern = re.compile(regex, re.I)
-        return RegexQuery(pattern, field)
+        if len(word_split) < 2:
+            return RegexQuery(pattern, field)
+        return RegexQuery(pattern, field, (word, WildcardPattern(word_split, punctuation, pattern)))
+
+    def wildcard_words(self) -> List[str]:
+        if self.wildcard is None:
+            return []
+        return [self.wildcard[0]]
+
+    def cost(self) -> int:
+        return COST_REGEX
+
+    def compile(self) -> TextMatcher:
+        regex_search = self.pattern.search
+        field = self.field
+        if self.wildcard is None:
+            return lambda text: any(regex_search(word) for word in text.field_words(field))
+        # Most words are short enough for the regex, so the wildcard matcher is only called for the longer ones
+        wildcard_search = self.wildcard[1].search
+        max_length = self.wildcard[1].regex_max_length
+        return lambda text: any(
+            regex_search(word) if len(word) <= max_length else wildcard_search(word) for word in text.field_words(field)
+        )
 
     def __eq__(self, other: Any) -> bool:
         return (
@@ -426,6 +1333,17 @@ class RegexQuery(LocationQuery):
             and self.field == other.field
         )
 
+    def __hash__(self) -> int:
+        return self._structural_hash()
+
+    def _structural_key(self) -> Tuple:
+        return "REGEX", self.pattern.pattern, type(self.field)
+
+    def to_data(self) -> List:
+        if self.wildcard is not None:
+            return ["wildcard", self.wildcard[0], field_to_data(self.field)]
+        return ["regex", self.pattern.pattern, self.pattern.flags, field_to_data(self.field)]
+
     def __repr__(self) -> str:
         if self.field == AnyField():
             return f"REGEX({self.pattern.pattern})"
@@ -440,24 +1358,64 @@ class RegexQuery(LocationQuery):
 class PhraseQuery(LocationQuery):
     def __init__(self, phrase: str, field: Optional["Field"] = None):
         self.phrase = phrase
-        self.phrase_regex = re.compile(boundary_pattern_start + re.escape(self.phrase) + boundary_pattern_end, re.I)
+        # Empty phrases match at every boundary, so are left to the regex
+        self.phrase_key = fold_case(phrase) or None
         if field is None:
             field = AnyField()
         self.field = field
 
-    def matches_submission(self, sub: FASubmissionFull) -> bool:
-        return any(self.phrase_regex.search(text) for text in self.field.get_texts(sub))
+    @functools.cached_property
+    def phrase_regex(self) -> Pattern[str]:
+        return re.compile(boundary_pattern_start + re.escape(self.phrase) + boundary_pattern_end, re.I)
 
-    def match_locations(self, sub: FASubmissionFull) -> List[MatchLocation]:
+    def matches_text(self, text: SubmissionText) -> bool:
+        return text.has_phrase(self.field, self.phrase_key, self.phrase_regex)
+
+    def text_match_locations(self, text: SubmissionText) -> List[MatchLocation]:
         return [
-            MatchLocation(location, m.start(), m.end())
-            for location, text in self.field.get_texts_dict(sub).items()
-            for m in self.phrase_regex.finditer(text)
+            MatchLocation(location, start, end)
+            for location, start, end in text.phrase_spans(self.field, self.phrase_key, self.phrase_regex)
         ]
 
+    def location_spans(self, text: SubmissionText, location: FieldLocation) -> List[Tuple[int, int]]:
+        field_text = text.location_text(self.field, location)
+        if field_text is None:
+            return []
+        return text.location_phrase_spans(location, field_text, self.phrase_key, self.phrase_regex)
+
+    def index_terms(self) -> Optional[Set[IndexTerm]]:
+        return _phrase_index_terms(self.phrase, self.field)
+
+    def location_index_terms(self) -> Optional[Set[IndexTerm]]:
+        return _phrase_index_terms(self.phrase, self.field)
+
+    def phrase_keys(self) -> List[Optional[str]]:
+        return [self.phrase_key]
+
+    def location_phrase_keys(self) -> List[Optional[str]]:
+        return [self.phrase_key]
+
+    def cost(self) -> int:
+        return COST_PHRASE
+
+    def compile(self) -> TextMatcher:
+        phrase_key = self.phrase_key
+        regex = self.phrase_regex
+        field = self.field
+        return lambda text: text.has_phrase(field, phrase_key, regex)
+
     def __eq__(self, other: Any) -> bool:
         return isinstance(other, PhraseQuery) and self.phrase == other.phrase and self.field == other.field
 
+    def __hash__(self) -> int:
+        return self._structural_hash()
+
+    def _structural_key(self) -> Tuple:
+        return "PHRASE", self.phrase, type(self.field)
+
+    def to_data(self) -> List:
+        return ["phrase", self.phrase, field_to_data(self.field)]
+
     def __repr__(self) -> str:
         if self.field == AnyField():
             return f"PHRASE({self.phrase})"
@@ -474,14 +1432,53 @@ class ExceptionQuery(Query):
         self.word = word
         self.exception = exception
 
-    def matches_submission(self, sub: FASubmissionFull) -> bool:
-        word_locations = self.word.match_locations(sub)
-        exception_locations = self.exception.match_locations(sub)
-        return any(not location.overlaps_any(exception_locations) for location in word_locations)
+    def matches_text(self, text: SubmissionText) -> bool:
+        # Exception matches are only searched for in the locations where the word matched, and only until a match of
+        # the word is found which no exception overlaps
+        exception_intervals: Dict[FieldLocation, SortedIntervals] = {}
+        for location in self.word.text_match_locations(text):
+            intervals = exception_intervals.get(location.field)
+            if intervals is None:
+                intervals = exception_intervals[location.field] = SortedIntervals(
+                    self.exception.location_spans(text, location.field)
+                )
+            if not intervals.overlaps(location.start_position, location.end_position):
+                return True
+        return False
+
+    def index_terms(self) -> Optional[Set[IndexTerm]]:
+        return self.word.location_index_terms()
+
+    def phrase_keys(self) -> List[Optional[str]]:
+        return self.word.location_phrase_keys() + self.exception.location_phrase_keys()
+
+    def wildcard_words(self) -> List[str]:
+        return self.word.wildcard_words() + self.exception.wildcard_words()
+
+    def cost(self) -> int:
+        return COST_EXCEPTION
+
+    def compile(self) -> TextMatcher:
+        # Exceptions need match locations, so are not worth flattening further
+        return self.matches_text
 
     def __eq__(self, other: Any) -> bool:
         return isinstance(other, ExceptionQuery) and self.word == other.word and self.exception == other.exception
 
+    def __hash__(self) -> int:
+        return self._structural_hash()
+
+    def _structural_key(self) -> Tuple:
+        return "EXCEPTION", self.word, self.exception
+
+    def to_data(self) -> List:
+        return ["exception", self.word.to_data(), self.exception.to_data()]
+
+    def intern_children(self, intern: Callable[[Query], Query]) -> None:
+        # Interned queries are equal to the originals, so are location queries too
+        self.word = cast(LocationQuery, intern(self.word))
+        self.exception = cast(LocationQuery, intern(self.exception))
+
     def __repr__(self) -> str:
         return f"EXCEPTION({self.word!r}, {self.exception!r})"
 
@@ -493,10 +1490,21 @@ class InvalidQueryException(Exception):
     pass
 
 
+# Bump this whenever the grammar, or the queries it is parsed into, change. This invalidates cached parse results.
+GRAMMAR_VERSION = 2
+# The most runs of asterisks allowed in a single word of a new query, to bound the work needed to match it
+MAX_WILDCARDS = 10
+PARSE_CACHE_SIZE = 4096
+
+
+# Characters which can make up an unquoted word in a query
+word_chars = printables.replace("(", "").replace(")", "").replace(":", "").replace('"', "")
+
+
 @functools.lru_cache()
 def query_parser() -> ParserElement:
     # Creating the grammar
-    valid_chars = printables.replace("(", "").replace(")", "").replace(":", "").replace('"', "")
+    valid_chars = word_chars
     expr = Forward().setName("expression")
 
     quotes = QuotedString('"', "\\").setName("quoted string").setResultsName("quotes")
@@ -567,8 +1575,18 @@ def query_parser() -> ParserElement:
     return expr
 
 
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
 def parse_query(query_str: str) -> "Query":
+    # Parsed queries are interned and never modified, so repeated query strings can safely share the result
     logger.debug("Parsing query: %s", query_str)
+    return intern_query(QueryStringParser(query_str).parse())
+
+
+def parse_query_pyparsing(query_str: str) -> "Query":
+    """
+    Parses a query using the pyparsing grammar. This is much slower than parse_query(), but is kept as the reference
+    definition of the query grammar, which the hand-written parser is checked against.
+    """
     expr = query_parser()
     # Parsing input
     try:
@@ -577,7 +1595,7 @@ def parse_query(query_str: str) -> "Query":
         logger.warning("Failed to parse query %s.", query_str, exc_info=e)
         raise InvalidQueryException(f"ParseException was thrown: {e}")
     # Turning into query
-    return parse_expression(parsed)
+    return intern_query(parse_expression(parsed))
 
 
 def parse_expression(parsed: ParseResults) -> "Query":
@@ -646,10 +1664,14 @@ def parse_rating_field(field_value: ParseResults) -> "Query":
     if field_value.quotes:
         logger.warning("Rating field cannot be a quote")
         raise InvalidQueryException("Rating field cannot be a quote")
-    rating = rating_dict.get(field_value.word)
+    return parse_rating(field_value.word)
+
+
+def parse_rating(rating_str: str) -> "Query":
+    rating = rating_dict.get(rating_str)
     if rating is None:
-        logger.warning("Unrecognised rating field value: %s", field_value.word)
-        raise InvalidQueryException(f"Unrecognised rating field value: {field_value.word}")
+        logger.warning("Unrecognised rating field value: %s", rating_str)
+        raise InvalidQueryException(f"Unrecognised rating field value: {rating_str}")
     return RatingQuery(rating)
 
 
@@ -666,6 +1688,20 @@ def parse_field_name(field_name: str) -> "Field":
     raise InvalidQueryException(f"Unrecognised field name: {field_name}")
 
 
+def check_wildcard_limit(query: "Query") -> None:
+    """
+    Raises InvalidQueryException if any word in the query has more than MAX_WILDCARDS runs of asterisks. This is only
+    checked for queries users are adding, so that saved queries from before the limit still load.
+    """
+    for word in query.wildcard_words():
+        wildcard_count = len(re.findall(r"\*+", word))
+        if wildcard_count > MAX_WILDCARDS:
+            logger.warning("Word query (%s) has too many wildcards", word)
+            raise InvalidQueryException(
+                f'Word query ("{word}") has {wildcard_count} wildcards, but at most {MAX_WILDCARDS} are allowed'
+            )
+
+
 def parse_word(word: str, field: Optional["Field"] = None) -> "LocationQuery":
     if word.startswith("*") and "*" not in word[1:]:
         return SuffixQuery(word[1:], field)
@@ -693,7 +1729,7 @@ def parse_exception(parsed: ParseResults, field: Optional["Field"]) -> "Location
             elements.append(parse_word(elem.word, field))
             continue
         logger.error("Unrecognised exception query element: %s", parsed)
-        raise ParseException(f"Unrecognised exception query element: {parsed}")
+        raise InvalidQueryException(f"Unrecognised exception query element: {parsed}")
     return LocationOrQuery(elements)
 
 
@@ -701,3 +1737,370 @@ def parse_word_with_exception(parsed: ParseResults, field: Optional["Field"] = N
     word = parse_word(parsed.exception_word, field)
     exc = parse_exception(parsed.exception, field)
     return ExceptionQuery(word, exc)
+
+
+# Characters which pyparsing skips between tokens
+_whitespace_chars = " \n\t\r"
+# Characters which may not directly precede or follow a keyword, as with pyparsing's Keyword
+_keyword_chars = set((string.ascii_letters + string.digits + "_$").upper())
+_word_pattern = re.compile("[" + re.escape(word_chars) + "]+")
+_quote_pattern = re.compile(r'"(?:\\.|[^"\n\r\\])*"')
+# The escapes which pyparsing's QuotedString unescapes. Its numeric escape pattern is built in an f-string, so the
+# repeat counts are read as literal digits, and this mirrors that, so that quoted phrases are parsed identically.
+_quote_escape_pattern = re.compile(r"\\(?:([tnfr])|([0-7]3|0|x[0-9a-fA-F]2|u[0-9a-fA-F]4)|(.))")
+_quote_whitespace_escapes = {"t": "\t", "n": "\n", "f": "\f", "r": "\r"}
+
+
+def _unescape_quote_match(match: Match) -> str:
+    if match.group(1):
+        return _quote_whitespace_escapes[match.group(1)]
+    numeric = match.group(2)
+    if numeric:
+        if numeric == "0":
+            return "\0"
+        if numeric[0] in "xu":
+            return chr(int(numeric[1:], 16))
+        return numeric
+    return match.group(3)
+
+
+class QueryStringParser:
+    """
+    A hand-written tokenizer and recursive descent parser for the query grammar. This accepts the same query strings,
+    and builds the same queries, as the pyparsing grammar in query_parser(), which remains the reference definition of
+    the grammar. Where that grammar tries alternatives in turn, so does this parser, backtracking to the same position.
+
+    Elements are only turned into queries once their grammar alternative has fully matched, so that any
+    InvalidQueryException raised is for the same parse pyparsing would have made.
+    """
+
+    def __init__(self, query_str: str) -> None:
+        # pyparsing expands tabs before parsing, which can affect quoted phrases
+        self.text = query_str.expandtabs()
+        self.pos = 0
+
+    def parse(self) -> "Query":
+        query = self._expression()
+        self._skip_whitespace()
+        if self.pos != len(self.text):
+            self._fail("end of text")
+        return query
+
+    def _fail(self, expected: str) -> NoReturn:
+        found = repr(self.text[self.pos]) if self.pos < len(self.text) else "end of text"
+        logger.warning("Failed to parse query %s, expected %s at char %s", self.text, expected, self.pos)
+        raise InvalidQueryException(f"Expected {expected}, found {found} (at char {self.pos})")
+
+    # Tokens
+
+    def _skip_whitespace(self) -> None:
+        text = self.text
+        pos = self.pos
+        while pos < len(text) and text[pos] in _whitespace_chars:
+            pos += 1
+        self.pos = pos
+
+    def _literal(self, char: str) -> bool:
+        self._skip_whitespace()
+        if self.text.startswith(char, self.pos):
+            self.pos += 1
+            return True
+        return False
+
+    def _keyword(self, *keywords: str) -> Optional[str]:
+        self._skip_whitespace()
+        text = self.text
+        pos = self.pos
+        if pos > 0 and text[pos - 1].upper() in _keyword_chars:
+            return None
+        for keyword in keywords:
+            end = pos + len(keyword)
+            if text[pos:end].upper() != keyword.upper():
+                continue
+            if end < len(text) and text[end].upper() in _keyword_chars:
+                continue
+            self.pos = end
+            return keyword
+        return None
+
+    def _word(self) -> Optional[str]:
+        self._skip_whitespace()
+        match = _word_pattern.match(self.text, self.pos)
+        if match is None:
+            return None
+        self.pos = match.end()
+        return match.group()
+
+    def _quotes(self) -> Optional[str]:
+        self._skip_whitespace()
+        if not self.text.startswith('"', self.pos):
+            return None
+        match = _quote_pattern.match(self.text, self.pos)
+        if match is None:
+            return None
+        self.pos = match.end()
+        phrase = match.group()[1:-1]
+        if "\\" in phrase:
+            phrase = _quote_escape_pattern.sub(_unescape_quote_match, phrase)
+        return phrase
+
+    # Grammar
+
+    def _expression(self) -> "Query":
+        query = self._full_element()
+        if query is None:
+            self._fail("expression")
+        while True:
+            start = self.pos
+            connector = self._keyword("or", "and")
+            next_query = self._full_element()
+            if next_query is None:
+                self.pos = start
+                return query
+            if connector == "or":
+                query = OrQuery([query, next_query])
+            else:
+                query = AndQuery([query, next_query])
+
+    def _full_element(self) -> Optional["Query"]:
+        negated = self._literal("!") or self._literal("-") or self._keyword("not") is not None
+        query = self._element()
+        if query is None or not negated:
+            return query
+        return NotQuery(query)
+
+    def _element(self) -> Optional["Query"]:
+        phrase = self._quotes()
+        if phrase is not None:
+            if not phrase:
+                logger.warning("Unrecognised query element: empty quotes")
+                raise InvalidQueryException("I do not recognise this element: empty quotes")
+            return parse_quotes(phrase)
+        if self._literal("("):
+            query = self._expression()
+            if not self._literal(")"):
+                self._fail("')'")
+            return query
+        start = self.pos
+        field_query = self._field()
+        if field_query is not None:
+            return field_query
+        self.pos = start
+        word_with_exception = self._word_with_exception()
+        if word_with_exception is not None:
+            return self._word_with_exception_query(*word_with_exception, None)
+        self.pos = start
+        word = self._word()
+        if word is None:
+            return None
+        return parse_word(word)
+
+    def _field(self) -> Optional["Query"]:
+        start = self.pos
+        field_name = self._word() if self._literal("@") else None
+        if field_name is None:
+            self.pos = start
+            field_name = self._word()
+            if field_name is None or not self._literal(":"):
+                return None
+        # Field values are either quotes, a bracketed or bare word with exception, or a word
+        phrase = self._quotes()
+        word_with_exception = None
+        word = None
+        if phrase is None:
+            value_start = self.pos
+            if self._literal("("):
+                word_with_exception = self._word_with_exception()
+                if word_with_exception is not None and not self._literal(")"):
+                    word_with_exception = None
+            if word_with_exception is None:
+                self.pos = value_start
+                word_with_exception = self._word_with_exception()
+            if word_with_exception is None:
+                self.pos = value_start
+                word = self._word()
+                if word is None:
+                    return None
+        if field_name.lower() == "rating":
+            if phrase:
+                logger.warning("Rating field cannot be a quote")
+                raise InvalidQueryException("Rating field cannot be a quote")
+            return parse_rating(word or "")
+        field = parse_field_name(field_name)
+        if phrase:
+            return parse_quotes(phrase, field)
+        if word_with_exception is not None:
+            return self._word_with_exception_query(*word_with_exception, field)
+        if word:
+            return parse_word(word, field)
+        logger.warning("Unrecognised query field value: empty quotes")
+        raise InvalidQueryException("Unrecognised field value: empty quotes")
+
+    def _word_with_exception(self) -> Optional[Tuple[str, List[Tuple[bool, str]]]]:
+        word = self._word()
+        if word is None or self._keyword("except", "ignore") is None:
+            return None
+        exception = self._exception()
+        if exception is None:
+            return None
+        return word, exception
+
+    def _exception(self) -> Optional[List[Tuple[bool, str]]]:
+        element = self._exception_element()
+        if element is not None:
+            return [element]
+        if not self._literal("("):
+            return None
+        element = self._exception_element()
+        if element is None:
+            return None
+        elements = [element]
+        while True:
+            start = self.pos
+            self._keyword("or")
+            element = self._exception_element()
+            if element is None:
+                self.pos = start
+                break
+            elements.append(element)
+        if not self._literal(")"):
+            return None
+        return elements
+
+    def _exception_element(self) -> Optional[Tuple[bool, str]]:
+        # Exception elements are kept as (is_phrase, text) until the whole exception has matched
+        phrase = self._quotes()
+        if phrase is not None:
+            return True, phrase
+        word = self._word()
+        if word is not None:
+            return False, word
+        return None
+
+    @staticmethod
+    def _word_with_exception_query(word: str, exception: List[Tuple[bool, str]], field: Optional["Field"]) -> "Query":
+        word_query = parse_word(word, field)
+        elements = []
+        for is_phrase, text in exception:
+            if not text:
+                logger.error("Unrecognised exception query element: empty quotes")
+                raise InvalidQueryException("Unrecognised exception query element: empty quotes")
+            elements.append(parse_quotes(text, field) if is_phrase else parse_word(text, field))
+        return ExceptionQuery(word_query, LocationOrQuery(elements))
+
+
+def optimise_query(query: "Query") -> "Query":
+    """
+    Rewrites a parsed query into an equivalent one which is quicker to check. Nested AND and OR queries are flattened,
+    duplicate sub-queries are removed, double negatives are cancelled, and sub-queries are ordered cheapest first, so
+    that short-circuiting skips the expensive ones where possible. The result is interned.
+    """
+    return intern_query(_optimise(query))
+
+
+def _optimise(query: "Query") -> "Query":
+    if isinstance(query, (AndQuery, OrQuery)) and not isinstance(query, LocationOrQuery):
+        return _optimise_connector(query)
+    if isinstance(query, NotQuery):
+        sub_query = _optimise(query.sub_query)
+        if isinstance(sub_query, NotQuery):
+            return sub_query.sub_query
+        return NotQuery(sub_query)
+    return query
+
+
+def _optimise_connector(query: Union[AndQuery, OrQuery]) -> "Query":
+    query_type = type(query)
+    sub_queries: List[Query] = []
+    for sub_query in query.sub_queries:
+        sub_query = _optimise(sub_query)
+        # Flatten sub-queries of the same connector into this one
+        flattened = sub_query.sub_queries if type(sub_query) is query_type else [sub_query]
+        for flat_query in flattened:
+            if flat_query not in sub_queries:
+                sub_queries.append(flat_query)
+    if len(sub_queries) == 1:
+        return sub_queries[0]
+    sub_queries.sort(key=lambda q: q.cost())
+    return query_type(sub_queries)
+
+
+# Every interned query node, by its type and structure. Nodes are dropped once no query uses them.
+_interned_queries: weakref.WeakValueDictionary[Tuple, Query] = weakref.WeakValueDictionary()
+
+
+def intern_query(query: "Query") -> "Query":
+    """
+    Returns the shared instance of the given query, so that equal sub-expressions in different subscriptions and
+    blocklists are the same object. Each is then compiled once, and checked once per memoised submission.
+    """
+    key = (type(query), query._structural_key())
+    interned = _interned_queries.get(key)
+    if interned is not None:
+        return interned
+    query.intern_children(intern_query)
+    # Key on the interned sub-queries, so the originals are not kept alive
+    _interned_queries[(type(query), query._structural_key())] = query
+    return query
+
+
+def register_query(query: "Query") -> None:
+    """
+    Registers the phrases, prefixes, and suffixes of a query, so that they are found in each submission along with
+    those of every other registered query.
+    """
+    phrase_registry.add_query(query)
+    prefix_registry.add_query(query)
+    suffix_registry.add_query(query)
+
+
+def unregister_query(query: "Query") -> None:
+    phrase_registry.remove_query(query)
+    prefix_registry.remove_query(query)
+    suffix_registry.remove_query(query)
+
+
+def query_from_data(data: List) -> "Query":
+    """
+    Builds a query from the form given by Query.to_data(). Raises ValueError if the data is not a valid query.
+    """
+    try:
+        return _query_from_data(data)
+    except (KeyError, IndexError, TypeError, ValueError, re.error) as e:
+        raise ValueError(f"Invalid query data: {data!r}") from e
+
+
+def _query_from_data(data: List) -> "Query":
+    kind = data[0]
+    if kind == "or":
+        return OrQuery([_query_from_data(q) for q in data[1]])
+    if kind == "location_or":
+        return LocationOrQuery([_location_query_from_data(q) for q in data[1]])
+    if kind == "and":
+        return AndQuery([_query_from_data(q) for q in data[1]])
+    if kind == "not":
+        return NotQuery(_query_from_data(data[1]))
+    if kind == "rating":
+        return RatingQuery(Rating[data[1]])
+    if kind == "exception":
+        return ExceptionQuery(_location_query_from_data(data[1]), _location_query_from_data(data[2]))
+    return _location_query_from_data(data)
+
+
+def _location_query_from_data(data: List) -> "LocationQuery":
+    kind = data[0]
+    if kind == "location_or":
+        return LocationOrQuery([_location_query_from_data(q) for q in data[1]])
+    if kind == "word":
+        return WordQuery(data[1], field_from_data(data[2]))
+    if kind == "prefix":
+        return PrefixQuery(data[1], field_from_data(data[2]))
+    if kind == "suffix":
+        return SuffixQuery(data[1], field_from_data(data[2]))
+    if kind == "phrase":
+        return PhraseQuery(data[1], field_from_data(data[2]))
+    if kind == "regex":
+        return RegexQuery(re.compile(data[1], data[2]), field_from_data(data[3]))
+    if kind == "wildcard":
+        return RegexQuery.from_string_with_asterisks(data[1], field_from_data(data[2]))
+    raise ValueError(f"Unrecognised query data type: {kind}")
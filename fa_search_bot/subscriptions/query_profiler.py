@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import dataclasses
+import functools
+import heapq
+import json
+import logging
+import os
+import random
+from typing import TYPE_CHECKING
+
+from prometheus_client import Counter, Gauge
+
+if TYPE_CHECKING:
+    from typing import Dict, List, Optional, Set, Tuple
+
+    from fa_search_bot.subscriptions.query_parser import Query
+
+
+logger = logging.getLogger(__name__)
+
+KIND_SUBSCRIPTION = "subscription"
+KIND_BLOCKLIST = "blocklist"
+
+sampled_submissions = Counter(
+    "fasearchbot_queryprofiler_sampled_submissions_total",
+    "Number of submissions which had the time taken to check each query against them recorded",
+)
+gauge_top_query_seconds = Gauge(
+    "fasearchbot_queryprofiler_top_query_sampled_seconds",
+    "Total sampled time (in seconds) spent checking the most expensive queries, by rank",
+    labelnames=["rank"],
+)
+gauge_top_query_mean_seconds = Gauge(
+    "fasearchbot_queryprofiler_top_query_mean_seconds",
+    "Mean time (in seconds) taken to check the most expensive queries against a submission, by rank",
+    labelnames=["rank"],
+)
+gauge_top_query_hit_ratio = Gauge(
+    "fasearchbot_queryprofiler_top_query_hit_ratio",
+    "Share of sampled checks of the most expensive queries which matched, by rank",
+    labelnames=["rank"],
+)
+
+
+@dataclasses.dataclass
+class QueryStats:
+    kind: str
+    destination: int
+    query_str: str
+    query: Query
+    checks: int = 0
+    hits: int = 0
+    total_seconds: float = 0
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.total_seconds / self.checks if self.checks else 0
+
+    @property
+    def hit_ratio(self) -> float:
+        return self.hits / self.checks if self.checks else 0
+
+    def to_json(self) -> Dict:
+        return {
+            "kind": self.kind,
+            "destination": self.destination,
+            "query": self.query_str,
+            "parsed": repr(self.query),
+            "checks": self.checks,
+            "hits": self.hits,
+            "hit_ratio": self.hit_ratio,
+            "total_seconds": self.total_seconds,
+            "mean_seconds": self.mean_seconds,
+        }
+
+
+class QueryProfiler:
+    """
+    Records how long each subscription and blocklist query takes to check, and how often it matches, for a random
+    sample of submissions. Only sampled submissions are timed, so the overhead is kept low by a low sample rate, and is
+    nothing while the sample rate is zero. The most expensive queries are exposed as prometheus metrics by rank, and
+    saved to a report file, with their parsed form. Stats of queries which have since been removed are dropped by
+    prune().
+    """
+
+    TOP_N = 10
+    # The report file is rewritten after this many submissions have been sampled
+    REPORT_EVERY = 100
+
+    def __init__(self, sample_rate: float, report_filename: Optional[str] = None) -> None:
+        self.sample_rate = sample_rate
+        self.report_filename = report_filename
+        self.stats: Dict[Tuple[str, int, str], QueryStats] = {}
+        self.sample_count = 0
+        for rank in range(1, self.TOP_N + 1):
+            gauge_top_query_seconds.labels(rank=str(rank)).set_function(
+                functools.partial(self._ranked_value, rank, "total_seconds")
+            )
+            gauge_top_query_mean_seconds.labels(rank=str(rank)).set_function(
+                functools.partial(self._ranked_value, rank, "mean_seconds")
+            )
+            gauge_top_query_hit_ratio.labels(rank=str(rank)).set_function(
+                functools.partial(self._ranked_value, rank, "hit_ratio")
+            )
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def should_sample(self) -> bool:
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def record(
+        self, kind: str, destination: int, query_str: str, query: Query, seconds: float, matched: bool
+    ) -> None:
+        key = (kind, destination, query_str)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = QueryStats(kind, destination, query_str, query)
+        # The query object may have been replaced, if the subscription or blocklist was changed
+        stats.query = query
+        stats.checks += 1
+        stats.hits += matched
+        stats.total_seconds += seconds
+
+    def prune(self, live_keys: Set[Tuple[str, int, str]]) -> None:
+        """
+        Drops the stats of every query not in live_keys, which are the (kind, destination, query string) of each query
+        which can still be checked.
+        """
+        self.stats = {key: stats for key, stats in self.stats.items() if key in live_keys}
+
+    def finish_sample(self) -> None:
+        self.sample_count += 1
+        sampled_submissions.inc()
+        if self.report_filename is not None and self.sample_count % self.REPORT_EVERY == 0:
+            try:
+                self.save_report()
+            except OSError as e:
+                logger.warning("Failed to save query profile report", exc_info=e)
+
+    def top_queries(self, count: Optional[int] = None) -> List[QueryStats]:
+        """
+        Returns the stats of the queries which have taken the most sampled time in total, most expensive first.
+        """
+        if count is None:
+            count = self.TOP_N
+        return heapq.nlargest(count, self.stats.values(), key=lambda stats: stats.total_seconds)
+
+    def _ranked_value(self, rank: int, attribute: str) -> float:
+        # Returns the given attribute of the stats of the query at the given rank, for the gauges
+        top = self.top_queries(rank)
+        if len(top) < rank:
+            return 0
+        value: float = getattr(top[rank - 1], attribute)
+        return value
+
+    def save_report(self, count: int = 100) -> None:
+        if self.report_filename is None:
+            raise ValueError("Query profiler has no report file to save to")
+        data = {
+            "sample_rate": self.sample_rate,
+            "sampled_submissions": self.sample_count,
+            "queries": [stats.to_json() for stats in self.top_queries(count)],
+        }
+        temp_filename = self.report_filename + ".temp"
+        with open(temp_filename, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_filename, self.report_filename)
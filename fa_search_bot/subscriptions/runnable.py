@@ -12,6 +12,8 @@ from prometheus_client import Gauge, Counter
 from fa_search_bot.subscriptions.utils import time_taken
 
 if TYPE_CHECKING:
+    from typing import Awaitable
+
     from fa_search_bot.subscriptions.subscription_watcher import SubscriptionWatcher
 
 
@@ -41,12 +43,13 @@ class ShutdownError(RuntimeError):
 
 
 class Runnable(ABC):
-    QUEUE_BACKOFF = 0.5
     SECONDS_PER_HEARTBEAT = 60
 
     def __init__(self, watcher: "SubscriptionWatcher"):
         self.watcher = watcher
         self.running = False
+        # Set when the runnable is asked to stop, to interrupt any waits
+        self._stop_event = asyncio.Event()
         self.heartbeat_expiry = datetime.datetime.now()
         self.class_name = self.__class__.__name__
         self.time_taken_updating_heartbeat = time_taken.labels(
@@ -56,11 +59,15 @@ class Runnable(ABC):
         self.runnable_processed_count = total_processed_count.labels(runnable=self.class_name)
 
     async def run(self) -> None:
-        # Start the subscription task
-        self.running = True
+        # Start the subscription task, unless it was asked to stop before it started
+        self.running = not self._stop_event.is_set()
         while self.running:
             try:
                 await self.do_process()
+            except ShutdownError:
+                # Stopped partway through processing, such as when shut down or scaled down, so hand back the work
+                logger.debug("Runnable task %s was stopped while processing, reverting", self.class_name)
+                await self.revert_last_attempt()
             except Exception as e:
                 logger.error("Runnable task %s has failed (will restart) with exception:", self.class_name, exc_info=e)
                 # Revert the failed attempt, so it may be attempted again
@@ -84,6 +91,7 @@ class Runnable(ABC):
 
     def stop(self) -> None:
         self.running = False
+        self._stop_event.set()
 
     def update_processed_metrics(self) -> None:
         self.runnable_latest_processed.set_to_current_time()
@@ -96,9 +104,26 @@ class Runnable(ABC):
             logger.debug("Heartbeat from %s", self.class_name)
             self.heartbeat_expiry = datetime.datetime.now() + datetime.timedelta(seconds=self.SECONDS_PER_HEARTBEAT)
 
+    async def _wait_for_work(self, waiter: Awaitable[None]) -> None:
+        """
+        Waits until the given waiter finishes, which should be when there is work ready for this runnable, or until the
+        runnable is stopped, whichever comes first.
+        """
+        wait_task = asyncio.ensure_future(waiter)
+        stop_task = asyncio.ensure_future(self._stop_event.wait())
+        try:
+            await asyncio.wait([wait_task, stop_task], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            wait_task.cancel()
+            stop_task.cancel()
+
     async def _wait_while_running(self, seconds: float) -> None:
-        sleep_end = datetime.datetime.now() + datetime.timedelta(seconds=seconds)
-        while datetime.datetime.now() < sleep_end:
-            if not self.running:
-                break
-            await asyncio.sleep(0.1)
+        """
+        Waits for the given number of seconds, but returns as soon as the runnable is stopped.
+        """
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._stop_event.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
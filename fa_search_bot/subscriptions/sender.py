@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import asyncio
 import collections
 import datetime
 import logging
@@ -36,6 +35,10 @@ sub_blocked = Counter(
     "fasearchbot_subscriptionsender_dest_blocked_total",
     "Number of times a destination has turned out to have blocked or deleted the bot without pausing subs first",
 )
+sub_rematches = Counter(
+    "fasearchbot_subscriptionsender_rematches_total",
+    "Number of submissions which had to be checked against subscriptions again, as they had changed since fetching",
+)
 flood_waits_requested = Summary(
     "fasearchbot_subscriptionsender_flood_waits_requested",
     "Summary of the number and duration of flood waits which have been requested by Telegram",
@@ -72,7 +75,7 @@ class Sender(Runnable):
             next_state = await self.watcher.wait_pool.pop_next_ready_to_send()
         if not next_state:
             with time_taken_waiting.time():
-                await asyncio.sleep(self.QUEUE_BACKOFF)
+                await self._wait_for_work(self.watcher.wait_pool.wait_for_ready_to_send())
             return
         self.last_state = next_state
         logger.debug("Got submission ready to send: %s", next_state.sub_id)
@@ -85,11 +88,15 @@ class Sender(Runnable):
         # Update latest ids with the submission we just checked, and save config
         with time_taken_saving_config.time():
             self.watcher.update_latest_id(next_state.sub_id)
+        await self.watcher.wait_pool.finish_sending(next_state)
 
     async def _send_updates(self, state: SubmissionCheckState) -> None:
         sendable = SendableFASubmission(state.full_data)
-        # Get subscriptions list again, because it might have changed since DataFetcher checked
-        subscriptions = self.watcher.check_subscriptions(state.full_data)
+        subscriptions = state.matching_subscriptions
+        if subscriptions is None or state.matched_version != self.watcher.subscriptions.version:
+            # Subscriptions or blocklists have changed since DataFetcher checked, so check again
+            sub_rematches.inc()
+            subscriptions = self.watcher.check_subscriptions(state.full_data)
         # Map which subscriptions require this submission at each destination
         destination_map: Dict[int, List[Subscription]] = collections.defaultdict(lambda: [])
         for sub in subscriptions:
@@ -118,12 +125,12 @@ class Sender(Runnable):
             sub_updates.inc()
             try:
                 await self._send_subscription_update(sendable, state, chat, prefix)
-                state.sent_to.append(chat)
+                await self.watcher.wait_pool.set_sent_to(state, chat)
                 return
             except (UserIsBlockedError, InputUserDeactivatedError, ChannelPrivateError, PeerIdInvalidError):
                 sub_blocked.inc()
                 logger.info("Destination %s is blocked or deleted, pausing subscriptions", chat)
-                all_subs = [sub for sub in self.watcher.subscriptions if sub.destination == chat]
+                all_subs = self.watcher.subscriptions.for_destination(chat)
                 for sub in all_subs:
                     sub.paused = True
                 return
@@ -194,13 +201,13 @@ class Sender(Runnable):
         """
         if self.last_state is None:
             raise ValueError("Can't revert last attempt, as last attempt did not exist")
-        self.watcher.wait_pool.return_populated_state(self.last_state)
+        await self.watcher.wait_pool.return_populated_state(self.last_state)
 
     async def _flood_wait(self, seconds: int) -> None:
         start_time = datetime.datetime.now(tz=datetime.timezone.utc)
         end_time = start_time + datetime.timedelta(seconds=seconds)
         remaining_time = end_time - datetime.datetime.now(tz=datetime.timezone.utc)
-        while remaining_time > datetime.timedelta(seconds=0):
+        while remaining_time > datetime.timedelta(seconds=0) and self.running:
             logger.warning("Waiting for flood warning to expire. %s seconds remain", remaining_time.total_seconds())
             sleep_batch = min(remaining_time, self.WAIT_BETWEEN_FLOOD_LOGS)
             await self._wait_while_running(sleep_batch.total_seconds())
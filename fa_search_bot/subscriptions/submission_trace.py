@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import dataclasses
+import datetime
+import json
+import logging
+import random
+import time
+from typing import TYPE_CHECKING
+
+from prometheus_client import Counter, Histogram
+
+if TYPE_CHECKING:
+    from typing import Dict, List, Optional, Tuple
+
+    from fa_search_bot.sites.submission_id import SubmissionID
+
+
+logger = logging.getLogger(__name__)
+
+STAGE_GATHERED = "gathered"
+STAGE_FETCH_START = "fetch_start"
+STAGE_FETCH_END = "fetch_end"
+STAGE_MATCHED = "matched"
+STAGE_UPLOAD_START = "upload_start"
+STAGE_UPLOAD_END = "upload_end"
+STAGE_REVERTED = "reverted"
+STAGE_SENT = "sent"
+
+LATENCY_BUCKETS = [0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, float("inf")]
+
+histogram_stage_seconds = Histogram(
+    "fasearchbot_submissiontrace_stage_seconds",
+    "Time (in seconds) from the previous step of the subscription pipeline to each step, for each submission",
+    labelnames=["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+histogram_total_lag = Histogram(
+    "fasearchbot_submissiontrace_total_lag_seconds",
+    "Time (in seconds) from a submission being posted on FA to it being sent to each destination",
+    buckets=LATENCY_BUCKETS,
+)
+histogram_pipeline_seconds = Histogram(
+    "fasearchbot_submissiontrace_pipeline_seconds",
+    "Time (in seconds) from a submission ID being gathered to it being sent to each destination",
+    buckets=LATENCY_BUCKETS,
+)
+outlier_traces = Counter(
+    "fasearchbot_submissiontrace_outliers_total",
+    "Number of submissions which took longer than the outlier threshold from being posted to being sent",
+)
+
+
+@dataclasses.dataclass
+class SubmissionTrace:
+    """
+    Timestamps of each step a submission takes through the subscription pipeline, from its ID being gathered, to it
+    being sent to each destination. As each step is marked, the time since the previous step is observed in a histogram
+    for that stage, and each send observes the total lag since the submission was posted.
+
+    Once a submission has been sent, its trace is logged if the lag was an outlier. As a backlog can make every
+    submission an outlier, only a sample of outlier traces are logged.
+    """
+
+    # Submissions which take longer than this from being posted to being sent are outliers
+    OUTLIER_SECONDS = 600
+    OUTLIER_LOG_SAMPLE_RATE = 0.1
+
+    steps: List[Tuple[str, float]] = dataclasses.field(default_factory=list)
+
+    def mark(self, stage: str) -> None:
+        now = time.time()
+        if self.steps:
+            histogram_stage_seconds.labels(stage=stage).observe(max(0.0, now - self.steps[-1][1]))
+        self.steps.append((stage, now))
+
+    def mark_sent(self, posted_at: Optional[datetime.datetime]) -> None:
+        self.mark(STAGE_SENT)
+        sent_at = self.steps[-1][1]
+        if posted_at is not None:
+            histogram_total_lag.observe(max(0.0, sent_at - posted_at.timestamp()))
+        gathered_at = self.first_time(STAGE_GATHERED)
+        if gathered_at is not None:
+            histogram_pipeline_seconds.observe(sent_at - gathered_at)
+
+    def first_time(self, stage: str) -> Optional[float]:
+        return next((timestamp for step, timestamp in self.steps if step == stage), None)
+
+    def finish(self, sub_id: SubmissionID, posted_at: Optional[datetime.datetime]) -> None:
+        """
+        Logs the trace of a submission which has finished sending, if it is a sampled outlier.
+        """
+        sent_at = self.first_time(STAGE_SENT)
+        if posted_at is None or sent_at is None:
+            return
+        lag = sent_at - posted_at.timestamp()
+        if lag <= self.OUTLIER_SECONDS:
+            return
+        outlier_traces.inc()
+        if random.random() >= self.OUTLIER_LOG_SAMPLE_RATE:
+            return
+        logger.info("Slow submission trace: %s", json.dumps(self.to_json(sub_id, posted_at)))
+
+    def to_json(self, sub_id: SubmissionID, posted_at: datetime.datetime) -> Dict:
+        posted_timestamp = posted_at.timestamp()
+        return {
+            "sub_id": sub_id.to_inline_code(),
+            "posted_at": posted_at.isoformat(),
+            "steps": [
+                {"stage": stage, "seconds_since_posted": round(timestamp - posted_timestamp, 3)}
+                for stage, timestamp in self.steps
+            ],
+        }
@@ -1,21 +1,50 @@
 from __future__ import annotations
 
 import datetime
-from typing import Optional, Dict, Any
+from typing import TYPE_CHECKING, Any, Dict, Optional
 
 import dateutil.parser
 
-from fa_search_bot.subscriptions.query_parser import parse_query, Query, AndQuery
 from fa_search_bot.sites.furaffinity.fa_submission import FASubmissionFull
+from fa_search_bot.subscriptions.query_parser import (
+    AndQuery,
+    Query,
+    SubmissionText,
+    optimise_query,
+    parse_query,
+)
+
+if TYPE_CHECKING:
+    from fa_search_bot.subscriptions.query_cache import QueryCache
+    from fa_search_bot.subscriptions.query_parser import TextMatcher
+    from fa_search_bot.subscriptions.subscription_set import SubscriptionSet
 
 
 class Subscription:
-    def __init__(self, query_str: str, destination: int):
+    def __init__(self, query_str: str, destination: int, query: Optional[Query] = None):
         self.query_str = query_str
         self.destination = destination
         self.latest_update = None  # type: Optional[datetime.datetime]
-        self.query = parse_query(query_str)
-        self.paused = False
+        # The parsed query can be passed in, if it is already known
+        if query is None:
+            query = parse_query(query_str)
+        self.query = optimise_query(query)
+        self.matcher: TextMatcher = self.query.matcher()
+        self._paused = False
+        # The set this subscription is stored in, which needs to know when it is paused or resumed
+        self.subscription_set: Optional[SubscriptionSet] = None
+
+    @property
+    def paused(self) -> bool:
+        return self._paused
+
+    @paused.setter
+    def paused(self, value: bool) -> None:
+        if value == self._paused:
+            return
+        self._paused = value
+        if self.subscription_set is not None:
+            self.subscription_set.on_pause_changed(self)
 
     def matches_result(self, result: FASubmissionFull, blocklist_query: Query) -> bool:
         if self.paused:
@@ -23,6 +52,17 @@ class Subscription:
         full_query = AndQuery([self.query, blocklist_query])
         return full_query.matches_submission(result)
 
+    def matches_query(self, result: FASubmissionFull, text: Optional[SubmissionText] = None) -> bool:
+        """
+        Checks whether the submission matches this subscription's query, without checking any blocklist. The text view
+        of the submission can be passed in, if it is shared with other checks of the same submission.
+        """
+        if self.paused:
+            return False
+        if text is None:
+            text = SubmissionText(result)
+        return self.matcher(text)
+
     def to_json(self) -> Dict:
         latest_update_str = None
         if self.latest_update is not None:
@@ -44,9 +84,12 @@ class Subscription:
         return new_sub
 
     @classmethod
-    def from_json_new_format(cls, saved_sub: Dict, dest_id: int) -> "Subscription":
+    def from_json_new_format(
+        cls, saved_sub: Dict, dest_id: int, query_cache: Optional[QueryCache] = None
+    ) -> "Subscription":
         query = saved_sub["query"]
-        new_sub = cls(query, dest_id)
+        parsed_query = query_cache.parse(query) if query_cache is not None else None
+        new_sub = cls(query, dest_id, parsed_query)
         new_sub.latest_update = None
         if saved_sub["latest_update"] is not None:
             new_sub.latest_update = dateutil.parser.parse(saved_sub["latest_update"])
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import collections
+import logging
+from typing import TYPE_CHECKING
+
+from fa_search_bot.subscriptions.query_parser import (
+    SPECIFIC_FIELDS,
+    TERM_PREFIX,
+    TERM_RATING,
+    TERM_SUFFIX,
+    TERM_WORD,
+    AnyField,
+    IndexTerm,
+    SubmissionText,
+)
+
+if TYPE_CHECKING:
+    from typing import Counter, Dict, FrozenSet, Iterable, Optional, Set
+
+    from fa_search_bot.sites.furaffinity.fa_submission import FASubmissionFull
+    from fa_search_bot.subscriptions.subscription import Subscription
+
+
+logger = logging.getLogger(__name__)
+
+INDEXED_FIELDS = [*SPECIFIC_FIELDS, AnyField()]
+
+
+class SubscriptionIndex:
+    """
+    An inverted index of subscriptions, by the terms their queries require a submission to contain. Given a
+    submission, it can quickly find the subscriptions which could possibly match it, so that only those need their
+    full query checked.
+    Subscriptions whose queries have no required terms (such as negated queries) are kept aside and are always
+    candidates.
+    """
+
+    def __init__(self) -> None:
+        self._terms: Dict[str, Dict[IndexTerm, Set[Subscription]]] = {
+            TERM_WORD: collections.defaultdict(set),
+            TERM_PREFIX: collections.defaultdict(set),
+            TERM_SUFFIX: collections.defaultdict(set),
+            TERM_RATING: collections.defaultdict(set),
+        }
+        self._prefix_lengths: Counter[int] = collections.Counter()
+        self._suffix_lengths: Counter[int] = collections.Counter()
+        self._unindexed: Set[Subscription] = set()
+        self._sub_terms: Dict[Subscription, Optional[FrozenSet[IndexTerm]]] = {}
+
+    def add(self, subscription: Subscription) -> None:
+        if subscription in self._sub_terms:
+            self.remove(subscription)
+        terms = subscription.query.index_terms()
+        if terms is None:
+            self._sub_terms[subscription] = None
+            self._unindexed.add(subscription)
+            return
+        self._sub_terms[subscription] = frozenset(terms)
+        for term in terms:
+            self._terms[term.kind][term].add(subscription)
+            if term.kind == TERM_PREFIX:
+                self._prefix_lengths[len(term.value)] += 1
+            if term.kind == TERM_SUFFIX:
+                self._suffix_lengths[len(term.value)] += 1
+
+    def remove(self, subscription: Subscription) -> None:
+        if subscription not in self._sub_terms:
+            return
+        terms = self._sub_terms.pop(subscription)
+        if terms is None:
+            self._unindexed.discard(subscription)
+            return
+        for term in terms:
+            term_subs = self._terms[term.kind][term]
+            term_subs.discard(subscription)
+            if not term_subs:
+                del self._terms[term.kind][term]
+            if term.kind == TERM_PREFIX:
+                self._decrement_length(self._prefix_lengths, len(term.value))
+            if term.kind == TERM_SUFFIX:
+                self._decrement_length(self._suffix_lengths, len(term.value))
+
+    @staticmethod
+    def _decrement_length(lengths: Counter[int], length: int) -> None:
+        lengths[length] -= 1
+        if lengths[length] <= 0:
+            del lengths[length]
+
+    def clear(self) -> None:
+        for term_dict in self._terms.values():
+            term_dict.clear()
+        self._prefix_lengths.clear()
+        self._suffix_lengths.clear()
+        self._unindexed.clear()
+        self._sub_terms.clear()
+
+    def __len__(self) -> int:
+        return len(self._sub_terms)
+
+    def candidates(self, sub: FASubmissionFull, text: Optional[SubmissionText] = None) -> Set[Subscription]:
+        """
+        Returns every indexed subscription which could match the given submission. This is a superset of the
+        subscriptions which do match it. The text view of the submission can be passed in, to share it with the checks
+        of the candidates.
+        """
+        result = set(self._unindexed)
+        words = self._terms[TERM_WORD]
+        prefixes = self._terms[TERM_PREFIX]
+        suffixes = self._terms[TERM_SUFFIX]
+        prefix_lengths = list(self._prefix_lengths)
+        suffix_lengths = list(self._suffix_lengths)
+        if text is None:
+            text = SubmissionText(sub)
+        for field in INDEXED_FIELDS:
+            field_type = type(field)
+            for word in text.index_words(field):
+                self._update_from(result, words.get(IndexTerm(TERM_WORD, field_type, word)))
+                word_len = len(word)
+                for length in prefix_lengths:
+                    if word_len > length:
+                        self._update_from(result, prefixes.get(IndexTerm(TERM_PREFIX, field_type, word[:length])))
+                for length in suffix_lengths:
+                    if word_len > length:
+                        self._update_from(result, suffixes.get(IndexTerm(TERM_SUFFIX, field_type, word[-length:])))
+        self._update_from(result, self._terms[TERM_RATING].get(IndexTerm(TERM_RATING, None, sub.rating)))
+        return result
+
+    @staticmethod
+    def _update_from(result: Set[Subscription], subs: Optional[Iterable[Subscription]]) -> None:
+        if subs:
+            result.update(subs)
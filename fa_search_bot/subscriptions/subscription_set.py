@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import itertools
+from collections.abc import MutableSet
+from typing import TYPE_CHECKING
+
+from fa_search_bot.subscriptions.query_parser import register_query, unregister_query
+from fa_search_bot.subscriptions.subscription_index import SubscriptionIndex
+
+if TYPE_CHECKING:
+    from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+    from fa_search_bot.sites.furaffinity.fa_submission import FASubmissionFull
+    from fa_search_bot.subscriptions.query_parser import SubmissionText
+    from fa_search_bot.subscriptions.subscription import Subscription
+
+# Versions are shared between all sets, so that replacing a set with a new one also gives a new version
+_versions = itertools.count()
+
+
+class SubscriptionSet(MutableSet):
+    """
+    A set of subscriptions, which keeps a SubscriptionIndex of the active subscriptions up to date as subscriptions are
+    added, removed, paused, and resumed. Each subscription's query is also registered with the shared phrase and
+    wildcard matchers.
+
+    Subscriptions are also indexed by destination, and then by casefolded query string, and the number of active
+    subscriptions in each destination is counted as they change, so that a chat's subscriptions can be listed, looked
+    up, and counted without going through every subscription.
+
+    The version changes whenever a subscription is added, removed, paused, or resumed, or mark_changed() is called, so
+    that match results can be reused for as long as the version has not changed.
+    """
+
+    def __init__(self, subscriptions: Optional[Iterable[Subscription]] = None) -> None:
+        self._subscriptions: Dict[Subscription, Subscription] = {}
+        self.index = SubscriptionIndex()
+        self._by_destination: Dict[int, Dict[str, Subscription]] = {}
+        # Only destinations with at least one active subscription are kept in here
+        self._active_counts: Dict[int, int] = {}
+        self._active_count = 0
+        self.version = next(_versions)
+        for subscription in subscriptions or []:
+            self.add(subscription)
+
+    def __contains__(self, subscription: object) -> bool:
+        return subscription in self._subscriptions
+
+    def __iter__(self) -> Iterator[Subscription]:
+        return iter(self._subscriptions)
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def add(self, subscription: Subscription) -> None:
+        if subscription in self._subscriptions:
+            return
+        self._subscriptions[subscription] = subscription
+        self.mark_changed()
+        subscription.subscription_set = self
+        self._by_destination.setdefault(subscription.destination, {})[subscription.query_str.casefold()] = subscription
+        register_query(subscription.query)
+        if not subscription.paused:
+            self.index.add(subscription)
+            self._count_active(subscription.destination, 1)
+
+    def discard(self, subscription: Subscription) -> None:
+        stored = self._subscriptions.pop(subscription, None)
+        if stored is None:
+            return
+        self.mark_changed()
+        self.index.remove(stored)
+        unregister_query(stored.query)
+        destination_subs = self._by_destination[stored.destination]
+        del destination_subs[stored.query_str.casefold()]
+        if not destination_subs:
+            del self._by_destination[stored.destination]
+        if not stored.paused:
+            self._count_active(stored.destination, -1)
+        if stored.subscription_set is self:
+            stored.subscription_set = None
+
+    def clear(self) -> None:
+        """
+        Removes every subscription, unregistering their queries from the shared phrase and wildcard matchers.
+        """
+        for stored in self._subscriptions:
+            unregister_query(stored.query)
+            if stored.subscription_set is self:
+                stored.subscription_set = None
+        self._subscriptions.clear()
+        self.index.clear()
+        self._by_destination.clear()
+        self._active_counts.clear()
+        self._active_count = 0
+        self.mark_changed()
+
+    def get(self, subscription: Subscription) -> Optional[Subscription]:
+        """
+        Returns the stored subscription which is equal to the given one, if there is one.
+        """
+        return self._subscriptions.get(subscription)
+
+    def get_by_query(self, destination: int, query_str: str) -> Optional[Subscription]:
+        """
+        Returns the subscription in the destination with the given query, ignoring case, if there is one. This does not
+        need the query to be parsed, unlike building a Subscription to look up.
+        """
+        return self._by_destination.get(destination, {}).get(query_str.casefold())
+
+    def for_destination(self, destination: int) -> List[Subscription]:
+        """
+        Returns a new list of the subscriptions posting to the given destination.
+        """
+        return list(self._by_destination.get(destination, {}).values())
+
+    def count_active(self, destination: Optional[int] = None) -> int:
+        """
+        Returns the number of subscriptions which are not paused, either in total, or in the given destination.
+        """
+        if destination is None:
+            return self._active_count
+        return self._active_counts.get(destination, 0)
+
+    def count_paused(self, destination: Optional[int] = None) -> int:
+        """
+        Returns the number of paused subscriptions, either in total, or in the given destination.
+        """
+        if destination is None:
+            return len(self._subscriptions) - self._active_count
+        return len(self._by_destination.get(destination, {})) - self.count_active(destination)
+
+    def count_destinations(self, active_only: bool = False) -> int:
+        """
+        Returns the number of destinations with subscriptions, or only those with active subscriptions.
+        """
+        if active_only:
+            return len(self._active_counts)
+        return len(self._by_destination)
+
+    def _count_active(self, destination: int, change: int) -> None:
+        self._active_count += change
+        count = self._active_counts.get(destination, 0) + change
+        if count:
+            self._active_counts[destination] = count
+        else:
+            del self._active_counts[destination]
+
+    def mark_changed(self) -> None:
+        """
+        Gives the set a new version, for changes which could change which subscriptions match a submission, such as a
+        blocklist changing.
+        """
+        self.version = next(_versions)
+
+    def copy(self) -> Set[Subscription]:
+        return set(self._subscriptions)
+
+    def on_pause_changed(self, subscription: Subscription) -> None:
+        if self._subscriptions.get(subscription) is not subscription:
+            return
+        self.mark_changed()
+        if subscription.paused:
+            self.index.remove(subscription)
+            self._count_active(subscription.destination, -1)
+        else:
+            self.index.add(subscription)
+            self._count_active(subscription.destination, 1)
+
+    def candidates(self, sub: FASubmissionFull, text: Optional[SubmissionText] = None) -> Set[Subscription]:
+        """
+        Returns the active subscriptions which could match the given submission.
+        """
+        return self.index.candidates(sub, text)
+
+    def __repr__(self) -> str:
+        return f"SubscriptionSet({list(self._subscriptions)!r})"
@@ -6,30 +6,50 @@ import datetime
 import json
 import logging
 import os
+import time
 from asyncio import Task
 from typing import TYPE_CHECKING
 
 from prometheus_client import Gauge
 
 from fa_search_bot.config import SubscriptionWatcherConfig
-from fa_search_bot.subscriptions.runnable import ShutdownError
-from fa_search_bot.subscriptions.query_parser import parse_query, Query, AndQuery, NotQuery
 from fa_search_bot.sites.submission_id import SubmissionID
 from fa_search_bot.subscriptions.data_fetcher import DataFetcher
+from fa_search_bot.subscriptions.fetcher_scaler import FetcherScaler, ScalingStats
 from fa_search_bot.subscriptions.media_fetcher import MediaFetcher
+from fa_search_bot.subscriptions.query_cache import QueryCache
+from fa_search_bot.subscriptions.query_parser import (
+    AndQuery,
+    InvalidQueryException,
+    NotQuery,
+    Query,
+    SubmissionBatch,
+    SubmissionText,
+    bit_indexes,
+    optimise_query,
+    parse_query,
+    register_query,
+    unregister_query,
+)
+from fa_search_bot.subscriptions.query_profiler import KIND_BLOCKLIST, KIND_SUBSCRIPTION, QueryProfiler
+from fa_search_bot.subscriptions.runnable import ShutdownError
 from fa_search_bot.subscriptions.sender import Sender
 from fa_search_bot.subscriptions.sub_id_gatherer import SubIDGatherer
 from fa_search_bot.subscriptions.subscription import Subscription
+from fa_search_bot.subscriptions.subscription_set import SubscriptionSet
 from fa_search_bot.subscriptions.wait_pool import WaitPool
+from fa_search_bot.subscriptions.wait_pool_journal import WaitPoolJournal
 
 if TYPE_CHECKING:
-    from typing import Deque, Dict, List, Optional, Set
+    from typing import Deque, Dict, Iterable, List, Optional, Sequence, Set
 
     from telethon import TelegramClient
 
     from fa_search_bot.sites.furaffinity.fa_export_api import FAExportAPI
     from fa_search_bot.sites.furaffinity.fa_submission import FASubmissionFull
     from fa_search_bot.submission_cache import SubmissionCache
+    from fa_search_bot.subscriptions.query_parser import TextMatcher
+    from fa_search_bot.subscriptions.runnable import Runnable
 
 logger = logging.getLogger(__name__)
 gauge_sub = Gauge("fasearchbot_fasubwatcher_subscription_count", "Total number of subscriptions")
@@ -98,6 +118,9 @@ class SubscriptionWatcher:
     BACK_OFF = 20
     FILENAME = "subscriptions.json"
     FILENAME_TEMP = "subscriptions.temp.json"
+    QUERY_CACHE_FILENAME = "subscriptions_query_cache.json"
+    QUERY_PROFILE_FILENAME = "subscriptions_query_profile.json"
+    WAIT_POOL_JOURNAL_FILENAME = "subscriptions_wait_pool_journal.jsonl"
 
     def __init__(
             self,
@@ -113,9 +136,14 @@ class SubscriptionWatcher:
 
         # Initialise stored data structures
         self.latest_ids: Deque[str] = collections.deque(maxlen=15)
-        self.subscriptions: Set[Subscription] = set()
+        self._subscriptions = SubscriptionSet()
         self.blocklists: Dict[int, Set[str]] = dict()
         self.blocklist_query_cache: Dict[str, Query] = dict()
+        self.destination_blocklist_queries: Dict[int, Optional[Query]] = dict()
+        self.destination_blocklist_matchers: Dict[int, Optional[TextMatcher]] = dict()
+        self.query_profiler = QueryProfiler(config.query_profile_sample_rate, self.QUERY_PROFILE_FILENAME)
+        # The version of the subscription set which the query profiler's stats were last pruned for
+        self._query_profile_version: Optional[int] = None
 
         # Initialise sharing data structures
         self.wait_pool = WaitPool()
@@ -125,52 +153,99 @@ class SubscriptionWatcher:
         self.data_fetchers: List[DataFetcher] = []
         self.media_fetchers: List[MediaFetcher] = []
         self.sender: Optional[Sender] = None
+        self.fetcher_scaler: Optional[FetcherScaler] = None
+        self.scaling_stats = ScalingStats()
         self.sub_tasks: List[Task] = []
 
         # Initialise gauges and prometheus metrics
         self.latest_observed_submission: Optional[datetime.datetime] = None
         gauge_sub.set_function(lambda: len(self.subscriptions))
-        gauge_subs_active.set_function(lambda: len([s for s in self.subscriptions if not s.paused]))
-        gauge_sub_destinations.set_function(lambda: len(set(s.destination for s in self.subscriptions)))
-        gauge_sub_active_destinations.set_function(
-            lambda: len(set(s.destination for s in self.subscriptions if not s.paused))
-        )
+        gauge_subs_active.set_function(lambda: self.subscriptions.count_active())
+        gauge_sub_destinations.set_function(lambda: self.subscriptions.count_destinations())
+        gauge_sub_active_destinations.set_function(lambda: self.subscriptions.count_destinations(active_only=True))
         gauge_sub_blocks.set_function(lambda: sum(len(blocks) for blocks in self.blocklists.values()))
         gauge_wait_pool_size.set_function(lambda: self.wait_pool.size())
         gauge_fetch_queue_new_size.set_function(lambda: self.wait_pool.qsize_fetch_new())
         gauge_fetch_queue_refresh_size.set_function(lambda: self.wait_pool.qsize_fetch_refresh())
         gauge_upload_queue_size.set_function(lambda: self.wait_pool.qsize_upload())
         gauge_running_data_fetcher_count.set_function(lambda: len([f for f in self.data_fetchers if f.running]))
-        gauge_expected_data_fetcher_count.set(self.config.num_data_fetchers)
         gauge_running_media_fetcher_count.set_function(lambda: len([f for f in self.media_fetchers if f.running]))
-        gauge_expected_media_fetcher_count.set(self.config.num_media_fetchers)
         gauge_running_task_count.set_function(lambda: len([t for t in self.sub_tasks if not t.done()]))
-        gauge_expected_task_count.set(2 + self.config.num_data_fetchers + self.config.num_media_fetchers)
+        self._update_expected_gauges(self.config.num_data_fetchers, self.config.num_media_fetchers)
+
+    def _update_expected_gauges(self, num_data_fetchers: int, num_media_fetchers: int) -> None:
+        gauge_expected_data_fetcher_count.set(num_data_fetchers)
+        gauge_expected_media_fetcher_count.set(num_media_fetchers)
+        num_scalers = 1 if self.config.autoscaling_enabled else 0
+        gauge_expected_task_count.set(2 + num_data_fetchers + num_media_fetchers + num_scalers)
+
+    @property
+    def subscriptions(self) -> SubscriptionSet:
+        return self._subscriptions
+
+    @subscriptions.setter
+    def subscriptions(self, subscriptions: Iterable[Subscription]) -> None:
+        new_subscriptions = SubscriptionSet(subscriptions)
+        # The old set's queries would otherwise stay registered with the shared phrase and wildcard matchers
+        self._subscriptions.clear()
+        self._subscriptions = new_subscriptions
 
     def start_tasks(self) -> None:
         if self.sub_tasks:
             raise RuntimeError("Already running")
-        event_loop = asyncio.get_event_loop()
         # Start the submission ID gatherer
         self.sub_id_gatherer = SubIDGatherer(self)
-        sub_id_gatherer_task = event_loop.create_task(self.sub_id_gatherer.run())
-        self.sub_tasks.append(sub_id_gatherer_task)
+        self._start_runnable(self.sub_id_gatherer)
         # Start the data fetchers
         for _ in range(self.config.num_data_fetchers):
-            data_fetcher = DataFetcher(self)
-            self.data_fetchers.append(data_fetcher)
-            data_fetcher_task = event_loop.create_task(data_fetcher.run())
-            self.sub_tasks.append(data_fetcher_task)
+            self.add_data_fetcher()
         # Start the media fetchers
         for _ in range(self.config.num_media_fetchers):
-            media_fetcher = MediaFetcher(self)
-            self.media_fetchers.append(media_fetcher)
-            media_fetcher_task = event_loop.create_task(media_fetcher.run())
-            self.sub_tasks.append(media_fetcher_task)
+            self.add_media_fetcher()
         # Start the submission sender
         self.sender = Sender(self)
-        task_sender = event_loop.create_task(self.sender.run())
-        self.sub_tasks.append(task_sender)
+        self._start_runnable(self.sender)
+        # Start the fetcher scaler, if the fetcher pools can be resized
+        if self.config.autoscaling_enabled:
+            self.scaling_stats = ScalingStats()
+            self.fetcher_scaler = FetcherScaler(self)
+            self._start_runnable(self.fetcher_scaler)
+
+    def _start_runnable(self, runnable: Runnable) -> None:
+        event_loop = asyncio.get_event_loop()
+        # Forget tasks of fetchers which have been removed and have since finished
+        self.sub_tasks = [task for task in self.sub_tasks if not task.done()]
+        self.sub_tasks.append(event_loop.create_task(runnable.run()))
+
+    def add_data_fetcher(self) -> None:
+        data_fetcher = DataFetcher(self)
+        self.data_fetchers.append(data_fetcher)
+        self._start_runnable(data_fetcher)
+        self._update_expected_gauges(len(self.data_fetchers), len(self.media_fetchers))
+
+    def remove_data_fetcher(self) -> None:
+        """
+        Asks the most recently added data fetcher to stop. It finishes its current submissions, unless it is backing
+        off, in which case they are returned to the queue
+        """
+        data_fetcher = self.data_fetchers.pop()
+        data_fetcher.stop()
+        self._update_expected_gauges(len(self.data_fetchers), len(self.media_fetchers))
+
+    def add_media_fetcher(self) -> None:
+        media_fetcher = MediaFetcher(self)
+        self.media_fetchers.append(media_fetcher)
+        self._start_runnable(media_fetcher)
+        self._update_expected_gauges(len(self.data_fetchers), len(self.media_fetchers))
+
+    def remove_media_fetcher(self) -> None:
+        """
+        Asks the most recently added media fetcher to stop. It finishes its current upload, unless it is backing off,
+        in which case the submission is returned to be fetched again
+        """
+        media_fetcher = self.media_fetchers.pop()
+        media_fetcher.stop()
+        self._update_expected_gauges(len(self.data_fetchers), len(self.media_fetchers))
 
     def stop_tasks(self) -> None:
         # Ask runnables to stop
@@ -184,6 +259,9 @@ class SubscriptionWatcher:
         for media_fetcher in self.media_fetchers:
             logger.debug("Stopping media fetcher")
             media_fetcher.stop()
+        if self.fetcher_scaler:
+            logger.debug("Stopping fetcher scaler")
+            self.fetcher_scaler.stop()
         if self.sender:
             logger.debug("Stopping sender")
             self.sender.stop()
@@ -202,6 +280,14 @@ class SubscriptionWatcher:
         # Clean up fetchers
         self.data_fetchers.clear()
         self.media_fetchers.clear()
+        if self.wait_pool.journal is not None:
+            self.wait_pool.journal.close()
+        if self.query_profiler.enabled:
+            self._prune_query_profile()
+            try:
+                self.query_profiler.save_report()
+            except OSError as e:
+                logger.warning("Failed to save query profile report", exc_info=e)
         logger.info("Subscription watcher shutdown complete")
 
     def update_latest_observed(self, post_datetime: datetime.datetime) -> None:
@@ -215,50 +301,202 @@ class SubscriptionWatcher:
 
     def get_blocklist_query(self, blocklist_str: str) -> Query:
         if blocklist_str not in self.blocklist_query_cache:
-            self.blocklist_query_cache[blocklist_str] = parse_query(blocklist_str)
+            self.blocklist_query_cache[blocklist_str] = optimise_query(parse_query(blocklist_str))
         return self.blocklist_query_cache[blocklist_str]
 
+    def get_destination_blocklist_query(self, destination: int) -> Optional[Query]:
+        """
+        Returns the combined query which a submission must match to not be blocked in the given destination, or None
+        if the destination has no blocklist. This is built once, and rebuilt only when the blocklist changes.
+        """
+        if destination not in self.destination_blocklist_queries:
+            blocklist = self.blocklists.get(destination)
+            blocklist_query = None
+            if blocklist:
+                blocklist_query = optimise_query(
+                    AndQuery([NotQuery(self.get_blocklist_query(block)) for block in blocklist])
+                )
+                register_query(blocklist_query)
+            self.destination_blocklist_queries[destination] = blocklist_query
+            self.destination_blocklist_matchers[destination] = (
+                None if blocklist_query is None else blocklist_query.matcher()
+            )
+        return self.destination_blocklist_queries[destination]
+
+    def get_destination_blocklist_matcher(self, destination: int) -> Optional[TextMatcher]:
+        """
+        Returns the compiled form of get_destination_blocklist_query(), which checks a SubmissionText
+        """
+        if destination not in self.destination_blocklist_matchers:
+            self.get_destination_blocklist_query(destination)
+        return self.destination_blocklist_matchers[destination]
+
+    def _blocklist_changed(self, destination: int) -> None:
+        self.subscriptions.mark_changed()
+        blocklist_query = self.destination_blocklist_queries.pop(destination, None)
+        if blocklist_query is not None:
+            unregister_query(blocklist_query)
+        self.destination_blocklist_matchers.pop(destination, None)
+
     def add_to_blocklist(self, destination: int, tag: str) -> None:
         # Ensure blocklist query can be parsed without error
-        self.blocklist_query_cache[tag] = parse_query(tag)
+        self.blocklist_query_cache[tag] = optimise_query(parse_query(tag))
         # Add to blocklists
         if destination in self.blocklists:
             self.blocklists[destination].add(tag)
         else:
             self.blocklists[destination] = {tag}
+        self._blocklist_changed(destination)
+
+    def remove_from_blocklist(self, destination: int, tag: str) -> None:
+        """
+        Removes a tag from a destination's blocklist, raising KeyError if it is not in that blocklist
+        """
+        self.blocklists.get(destination, set()).remove(tag)
+        self._blocklist_changed(destination)
 
     def check_subscriptions(self, full_result: FASubmissionFull) -> List[Subscription]:
-        # Copy subscriptions, to avoid "changed size during iteration" issues
-        subscriptions = self.subscriptions.copy()
-        # Check which subscriptions match
+        # Only check the subscriptions which the index says could match. This is a new set, so avoids "changed size
+        # during iteration" issues
+        text = SubmissionText(full_result)
+        subscriptions = self.subscriptions.candidates(full_result, text)
+        if self.query_profiler.should_sample():
+            return self._check_subscriptions_profiled(full_result, text, subscriptions)
+        # Check which subscriptions match, checking each destination's blocklist at most once, and only if needed.
+        # Shared query nodes are memoised, so each distinct sub-expression is only checked once for this submission.
         matching_subscriptions = []
+        destination_allowed: Dict[int, bool] = {}
+        with text.memoised():
+            for subscription in subscriptions:
+                if not subscription.matches_query(full_result, text):
+                    continue
+                destination = subscription.destination
+                if destination not in destination_allowed:
+                    blocklist_matcher = self.get_destination_blocklist_matcher(destination)
+                    destination_allowed[destination] = blocklist_matcher is None or blocklist_matcher(text)
+                if destination_allowed[destination]:
+                    matching_subscriptions.append(subscription)
+        return matching_subscriptions
+
+    def _check_subscriptions_profiled(
+        self, full_result: FASubmissionFull, text: SubmissionText, subscriptions: Iterable[Subscription]
+    ) -> List[Subscription]:
+        """
+        As check_subscriptions(), but records the time taken to check each subscription query, and each blocklisted
+        query. Results are not memoised, so that each query is timed as if it were the only one checked.
+        """
+        profiler = self.query_profiler
+        # Subscriptions and blocklists only change along with the version of the subscription set
+        if self._query_profile_version != self.subscriptions.version:
+            self._prune_query_profile()
+        matching_subscriptions = []
+        destination_allowed: Dict[int, bool] = {}
         for subscription in subscriptions:
-            blocklist = self.blocklists.get(subscription.destination, set())
-            blocklist_query = AndQuery(
-                [NotQuery(self.get_blocklist_query(block)) for block in blocklist]
+            if subscription.paused:
+                continue
+            destination = subscription.destination
+            start_time = time.perf_counter()
+            matched = subscription.matches_query(full_result, text)
+            profiler.record(
+                KIND_SUBSCRIPTION,
+                destination,
+                subscription.query_str,
+                subscription.query,
+                time.perf_counter() - start_time,
+                matched,
             )
-            if subscription.matches_result(full_result, blocklist_query):
+            if not matched:
+                continue
+            if destination not in destination_allowed:
+                # Each blocked query is timed separately, to find which are expensive. Allowed only if none match
+                allowed = True
+                for block in self.blocklists.get(destination, set()):
+                    block_query = self.get_blocklist_query(block)
+                    start_time = time.perf_counter()
+                    blocked = block_query.matcher()(text)
+                    profiler.record(
+                        KIND_BLOCKLIST, destination, block, block_query, time.perf_counter() - start_time, blocked
+                    )
+                    allowed = allowed and not blocked
+                destination_allowed[destination] = allowed
+            if destination_allowed[destination]:
                 matching_subscriptions.append(subscription)
+        profiler.finish_sample()
         return matching_subscriptions
 
+    def _prune_query_profile(self) -> None:
+        """
+        Drops the query profiler's stats for subscriptions and blocklisted queries which have been removed.
+        """
+        live_keys = {(KIND_SUBSCRIPTION, sub.destination, sub.query_str) for sub in self.subscriptions}
+        live_keys.update(
+            (KIND_BLOCKLIST, destination, block) for destination, blocks in self.blocklists.items() for block in blocks
+        )
+        self.query_profiler.prune(live_keys)
+        self._query_profile_version = self.subscriptions.version
+
+    def check_subscriptions_batch(self, full_results: Sequence[FASubmissionFull]) -> List[List[Subscription]]:
+        """
+        Checks a batch of submissions against the subscriptions all at once, returning the match matrix: the list of
+        matching subscriptions for each submission, in the same order as the submissions given. Each subscription's
+        query is evaluated once for the whole batch, against only those submissions the index says it could match.
+        """
+        batch = SubmissionBatch(full_results)
+        match_matrix: List[List[Subscription]] = [[] for _ in full_results]
+        candidate_bits: Dict[Subscription, int] = {}
+        for index, full_result in enumerate(full_results):
+            text = batch.texts[index]
+            subscriptions = self.subscriptions.candidates(full_result, text)
+            # Sampled submissions are checked separately, so that each query can be timed
+            if self.query_profiler.should_sample():
+                match_matrix[index] = self._check_subscriptions_profiled(full_result, text, subscriptions)
+                continue
+            bit = 1 << index
+            for subscription in subscriptions:
+                candidate_bits[subscription] = candidate_bits.get(subscription, 0) | bit
+        for subscription, bits in candidate_bits.items():
+            if subscription.paused:
+                continue
+            matched = batch.matches(subscription.query, bits)
+            if not matched:
+                continue
+            # The batch remembers which submissions each blocklist has been checked against, so it is only checked
+            # against each submission once per destination
+            blocklist_query = self.get_destination_blocklist_query(subscription.destination)
+            if blocklist_query is not None:
+                matched = batch.matches(blocklist_query, matched)
+            for index in bit_indexes(matched):
+                match_matrix[index].append(subscription)
+        return match_matrix
+
     def migrate_chat(self, old_chat_id: int, new_chat_id: int) -> None:
         # Migrate blocklist
         if old_chat_id in self.blocklists:
             for query in self.blocklists[old_chat_id]:
                 self.add_to_blocklist(new_chat_id, query)
         # Migrate subscriptions
-        for subscription in self.subscriptions.copy():
-            if subscription.destination == old_chat_id:
-                # Remove and re-add subscription, as chat id will change the hash
-                self.subscriptions.remove(subscription)
-                subscription.destination = new_chat_id
-                self.subscriptions.add(subscription)
+        for subscription in self.subscriptions.for_destination(old_chat_id):
+            # Remove and re-add subscription, as chat id will change the hash
+            self.subscriptions.remove(subscription)
+            subscription.destination = new_chat_id
+            self.subscriptions.add(subscription)
         # Remove old blocklist
         if old_chat_id in self.blocklists:
             del self.blocklists[old_chat_id]
+        self._blocklist_changed(old_chat_id)
         # Save
         self.save_to_json()
 
+    def _load_blocklist_queries(self, blocklist: Set[str], query_cache: QueryCache) -> None:
+        for block in blocklist:
+            if block in self.blocklist_query_cache:
+                continue
+            try:
+                self.blocklist_query_cache[block] = optimise_query(query_cache.parse(block))
+            except InvalidQueryException as e:
+                # Leave it to be parsed when it is first used, as before
+                logger.warning("Failed to parse saved blocklist query: %s", block, exc_info=e)
+
     def save_to_json(self) -> None:
         logger.debug("Saving subscription data in new format")
         destination_dict: Dict[str, Dict[str, List]] = collections.defaultdict(
@@ -291,8 +529,33 @@ class SubscriptionWatcher:
                 data = json.loads(raw_data)
         except FileNotFoundError:
             logger.info("No subscription config exists, creating a blank one")
-            return cls(config, api, client, submission_cache)
-        return cls.load_from_json_new_format(data, config, api, client, submission_cache)
+            new_watcher = cls(config, api, client, submission_cache)
+            new_watcher.restore_wait_pool()
+            return new_watcher
+        query_cache = QueryCache.load_from_file(cls.QUERY_CACHE_FILENAME)
+        new_watcher = cls.load_from_json_new_format(data, config, api, client, submission_cache, query_cache)
+        logger.info("Loaded %s queries from the query cache, and parsed %s", query_cache.hits, query_cache.misses)
+        query_strs = {subscription.query_str for subscription in new_watcher.subscriptions}
+        query_strs.update(block for blocklist in new_watcher.blocklists.values() for block in blocklist)
+        if query_cache.misses or set(query_cache.entries) != query_strs:
+            try:
+                query_cache.save_to_file(query_strs)
+            except OSError as e:
+                logger.warning("Failed to save query cache", exc_info=e)
+        new_watcher.restore_wait_pool()
+        return new_watcher
+
+    def restore_wait_pool(self) -> None:
+        """
+        Restores the submissions which were in progress when the bot last stopped, from the wait pool journal, and
+        starts journalling the wait pool again.
+        """
+        journal = WaitPoolJournal(self.WAIT_POOL_JOURNAL_FILENAME)
+        event_loop = asyncio.get_event_loop()
+        try:
+            event_loop.run_until_complete(self.wait_pool.restore_from_journal(journal))
+        except OSError as e:
+            logger.warning("Failed to restore the wait pool journal, continuing without it", exc_info=e)
 
     @classmethod
     def load_from_json_new_format(
@@ -302,6 +565,7 @@ class SubscriptionWatcher:
         api: FAExportAPI,
         client: TelegramClient,
         submission_cache: SubmissionCache,
+        query_cache: Optional[QueryCache] = None,
     ) -> "SubscriptionWatcher":
         logger.debug("Loading subscription config from file in new format")
         new_watcher = cls(config, api, client, submission_cache)
@@ -311,9 +575,11 @@ class SubscriptionWatcher:
         for dest, value in data["destinations"].items():
             dest_id = int(dest)
             for subscription in value["subscriptions"]:
-                subscriptions.add(Subscription.from_json_new_format(subscription, dest_id))
+                subscriptions.add(Subscription.from_json_new_format(subscription, dest_id, query_cache))
             if value["blocks"]:
                 new_watcher.blocklists[dest_id] = set(block["query"] for block in value["blocks"])
+                if query_cache is not None:
+                    new_watcher._load_blocklist_queries(new_watcher.blocklists[dest_id], query_cache)
         logger.debug(f"Loaded {len(subscriptions)} subscriptions")
         new_watcher.subscriptions = subscriptions
         return new_watcher
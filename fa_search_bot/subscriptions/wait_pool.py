@@ -1,10 +1,13 @@
 from __future__ import annotations
 
 import dataclasses
+import heapq
+import itertools
 import logging
-from asyncio import Lock, QueueEmpty, Event
-from typing import Optional, Dict, Union
+from asyncio import Condition, Lock, QueueEmpty
+from typing import Optional, Dict, Union, List, Set, Tuple, TYPE_CHECKING
 
+from prometheus_client import Counter, Gauge
 from telethon.tl.types import TypeInputPeer
 
 from fa_search_bot.sites.furaffinity.fa_submission import FASubmissionFull
@@ -12,9 +15,31 @@ from fa_search_bot.sites.sendable import UploadedMedia
 from fa_search_bot.sites.sent_submission import SentSubmission
 from fa_search_bot.sites.submission_id import SubmissionID
 from fa_search_bot.subscriptions.fetch_queue import FetchQueue
+from fa_search_bot.subscriptions.submission_trace import (
+    STAGE_GATHERED,
+    STAGE_REVERTED,
+    STAGE_UPLOAD_END,
+    STAGE_UPLOAD_START,
+    SubmissionTrace,
+)
+
+if TYPE_CHECKING:
+    from typing import Callable
+
+    from fa_search_bot.subscriptions.subscription import Subscription
+    from fa_search_bot.subscriptions.wait_pool_journal import WaitPoolJournal
 
 logger = logging.getLogger(__name__)
 
+fetchers_blocked = Gauge(
+    "fasearchbot_waitpool_fetchers_blocked_on_upload_capacity",
+    "Number of data fetchers currently waiting for space in the media upload backlog to publish fetched data",
+)
+fetcher_blocks = Counter(
+    "fasearchbot_waitpool_fetcher_blocked_on_upload_capacity_total",
+    "Number of times a data fetcher has had to wait for space in the media upload backlog to publish fetched data",
+)
+
 
 @dataclasses.dataclass
 class SubmissionCheckState:
@@ -24,6 +49,10 @@ class SubmissionCheckState:
     cache_entry: Optional[SentSubmission] = None
     uploaded_media: Optional[UploadedMedia] = None
     sent_to: list[Union[int, TypeInputPeer]] = dataclasses.field(default_factory=list)
+    # The subscriptions which matched when the data was fetched, and the version of the subscription set at the time
+    matching_subscriptions: Optional[List[Subscription]] = None
+    matched_version: Optional[int] = None
+    trace: SubmissionTrace = dataclasses.field(default_factory=SubmissionTrace, compare=False, repr=False)
 
     def key(self) -> int:
         return int(self.sub_id.submission_id)
@@ -34,12 +63,30 @@ class SubmissionCheckState:
     def is_ready_to_send(self) -> bool:
         return self.uploaded_media is not None or self.cache_entry is not None
 
+    def is_waiting_for_media_upload(self) -> bool:
+        return self.is_ready_for_media_upload() and not self.media_uploading
+
 
 class WaitPool:
     """
     WaitPool governs the overall progress of the subscription watcher. New IDs are added here, and then populated by the
     data fetchers and media watchers.
     The sender is watching for the next item in the pool which is ready to send
+
+    States are kept in two heaps, ordered by submission ID: one of every state, as the sender only sends the lowest
+    submission once it is ready, and one of the states waiting for a media fetcher to start uploading them. Entries are
+    not removed from the heaps when states change, but are skipped when they reach the top of the heap, if they no
+    longer apply. The numbers of states ready for media upload, and of those waiting for upload to start, are counted
+    as states change, rather than counted up.
+
+    Media fetchers and the sender can wait for work, rather than polling, as each state change notifies conditions
+    which share the pool's lock. Data fetchers likewise wait on a condition for capacity to publish fetched data, as
+    only MAX_READY_FOR_UPLOAD states may wait for media upload to start. A slot is freed when upload starts, or the
+    state is reverted or removed.
+
+    If the pool has a journal, each change is recorded there, so that states can be restored after a restart. Records
+    are written out once the lock is released. States popped to be sent stay in the journal until the sender has
+    finished sending them.
     """
 
     MAX_READY_FOR_UPLOAD = 100  # Maximum number of submissions which should be ready for media upload, to prevent data being too stale by the time it comes to upload, especially if catching up on backlog
@@ -48,87 +95,318 @@ class WaitPool:
         self.submission_state: Dict[SubmissionID, SubmissionCheckState] = {}
         self.fetch_data_queue: FetchQueue = FetchQueue()
         self._lock = Lock()
-        self._media_uploading_event = Event()
+        self._upload_condition = Condition(self._lock)
+        self._send_condition = Condition(self._lock)
+        self._capacity_condition = Condition(self._lock)
+        # Heap entries are (key, insertion order, submission ID), so that submission IDs never need comparing
+        self._entry_order = itertools.count()
+        self._state_heap: List[Tuple[int, int, SubmissionID]] = []
+        self._upload_heap: List[Tuple[int, int, SubmissionID]] = []
+        self._ready_for_upload_count = 0
+        self._waiting_for_upload_count = 0
+        self.journal: Optional[WaitPoolJournal] = None
+        # States which the sender has taken, but not finished sending
+        self._sending: Dict[SubmissionID, SubmissionCheckState] = {}
+        # Submission IDs restored from the journal, which the submission ID gatherer may add again
+        self._restored: Set[SubmissionID] = set()
+
+    def _push(self, heap: List[Tuple[int, int, SubmissionID]], state: SubmissionCheckState) -> None:
+        heapq.heappush(heap, (state.key(), next(self._entry_order), state.sub_id))
+
+    def _add_state(self, state: SubmissionCheckState) -> None:
+        self.submission_state[state.sub_id] = state
+        self._push(self._state_heap, state)
+        self._state_changed(False, False, state)
+        # Stale entries build up when states are removed and added again, so the heap is rebuilt when mostly stale
+        if len(self._state_heap) > 2 * len(self.submission_state) + 100:
+            self._state_heap = self._compacted(self._state_heap)
+
+    def _compacted(self, heap: List[Tuple[int, int, SubmissionID]]) -> List[Tuple[int, int, SubmissionID]]:
+        compacted = []
+        seen = set()
+        for entry in heap:
+            if entry[2] in self.submission_state and entry[2] not in seen:
+                seen.add(entry[2])
+                compacted.append(entry)
+        heapq.heapify(compacted)
+        return compacted
+
+    def _discard_state(self, sub_id: SubmissionID) -> None:
+        state = self.submission_state.pop(sub_id)
+        if state.is_ready_for_media_upload():
+            self._ready_for_upload_count -= 1
+        if state.is_waiting_for_media_upload():
+            self._waiting_for_upload_count -= 1
+            self._capacity_condition.notify_all()
+        # The next lowest state may be ready to send
+        self._send_condition.notify_all()
+
+    def _state_changed(
+        self,
+        was_ready_for_upload: bool,
+        was_waiting_for_upload: bool,
+        state: SubmissionCheckState,
+    ) -> None:
+        # Updates the counts and upload heap, after a state which was or was not ready for media upload, and waiting for
+        # upload to start, has changed. States which were not in the pool before were neither
+        is_ready_for_upload = state.is_ready_for_media_upload()
+        is_waiting_for_upload = state.is_waiting_for_media_upload()
+        if is_waiting_for_upload and not was_waiting_for_upload:
+            self._push(self._upload_heap, state)
+            self._upload_condition.notify_all()
+        if was_waiting_for_upload and not is_waiting_for_upload:
+            self._capacity_condition.notify_all()
+        if state.is_ready_to_send():
+            self._send_condition.notify_all()
+        self._ready_for_upload_count += int(is_ready_for_upload) - int(was_ready_for_upload)
+        self._waiting_for_upload_count += int(is_waiting_for_upload) - int(was_waiting_for_upload)
+
+    def _is_waiting_for_upload(self, sub_id: SubmissionID) -> bool:
+        state = self.submission_state.get(sub_id)
+        return state is not None and state.is_waiting_for_media_upload()
+
+    def _has_upload_capacity(self, sub_id: SubmissionID) -> bool:
+        # There is no need to wait for capacity once the state is gone
+        return self._waiting_for_upload_count < self.MAX_READY_FOR_UPLOAD or sub_id not in self.submission_state
+
+    def _next_for_upload(self) -> Optional[SubmissionID]:
+        while self._upload_heap and not self._is_waiting_for_upload(self._upload_heap[0][2]):
+            heapq.heappop(self._upload_heap)
+        if not self._upload_heap:
+            return None
+        return self._upload_heap[0][2]
+
+    def _next_state(self) -> Optional[SubmissionCheckState]:
+        while self._state_heap and self._state_heap[0][2] not in self.submission_state:
+            heapq.heappop(self._state_heap)
+        if not self._state_heap:
+            return None
+        return self.submission_state[self._state_heap[0][2]]
+
+    def _is_next_ready_to_send(self) -> bool:
+        next_state = self._next_state()
+        return next_state is not None and next_state.is_ready_to_send()
+
+    def _record(self, write: Callable[[WaitPoolJournal], None]) -> None:
+        if self.journal is None:
+            return
+        write(self.journal)
+        if self.journal.needs_compacting(len(self.submission_state) + len(self._sending)):
+            self.journal.compact(self._states_in_progress())
+
+    def _flush_journal(self) -> None:
+        # Called after releasing the lock, so that other tasks can carry on while records are written
+        if self.journal is None:
+            return
+        try:
+            self.journal.flush()
+        except OSError as e:
+            logger.warning("Failed to write to the wait pool journal", exc_info=e)
+
+    def _states_in_progress(self) -> List[SubmissionCheckState]:
+        return list(self.submission_state.values()) + list(self._sending.values())
+
+    async def restore_from_journal(self, journal: WaitPoolJournal) -> None:
+        """
+        Restores the states recorded in the journal, queueing those without data to be fetched, and then records any
+        further changes in the journal. This should be called before the pool is used.
+        """
+        async with self._lock:
+            states = journal.load()
+            for state in states:
+                if state.sub_id in self.submission_state:
+                    self._discard_state(state.sub_id)
+                self._add_state(state)
+                self._restored.add(state.sub_id)
+                if state.full_data is None:
+                    await self.fetch_data_queue.put_new(state.sub_id)
+            journal.compact(self._states_in_progress())
+        # Nothing else runs until this returns, so no changes can be missed before the journal is set
+        journal.flush()
+        self.journal = journal
+        logger.info("Restored %s submissions from the wait pool journal", len(states))
 
     async def add_sub_id(self, sub_id: SubmissionID) -> None:
         async with self._lock:
+            if sub_id in self._restored:
+                # Already restored from the journal, with its progress so far
+                self._restored.discard(sub_id)
+                return
+            if sub_id in self.submission_state:
+                self._discard_state(sub_id)
             state = SubmissionCheckState(sub_id)
-            self.submission_state[sub_id] = state
+            state.trace.mark(STAGE_GATHERED)
+            self._add_state(state)
+            self._record(lambda journal: journal.record_added(sub_id))
             await self.fetch_data_queue.put_new(sub_id)
+        self._flush_journal()
 
     async def get_next_for_data_fetch(self) -> SubmissionID:
         return self.fetch_data_queue.get_nowait()
 
-    async def set_fetched_data(self, sub_id: SubmissionID, full_data: FASubmissionFull) -> None:
-        while len(self.states_ready_for_media_upload()) > self.MAX_READY_FOR_UPLOAD:
-            logger.debug("Waiting for media uploads to get below submission count limit")
-            await self._media_uploading_event.wait()
-        async with self._lock:
+    def mark_stage(self, sub_id: SubmissionID, stage: str) -> None:
+        """
+        Marks a step in the trace of a submission in the pool, for those steps which do not otherwise change its state.
+        """
+        state = self.submission_state.get(sub_id)
+        if state is not None:
+            state.trace.mark(stage)
+
+    async def wait_for_data_fetch(self) -> None:
+        """
+        Waits until there is a submission ID to fetch data for.
+        """
+        await self.fetch_data_queue.wait_for_item()
+
+    async def set_fetched_data(
+        self,
+        sub_id: SubmissionID,
+        full_data: FASubmissionFull,
+        matching_subscriptions: Optional[List[Subscription]] = None,
+        matched_version: Optional[int] = None,
+    ) -> None:
+        async with self._capacity_condition:
+            if not self._has_upload_capacity(sub_id):
+                logger.debug("Waiting for media uploads to get below submission count limit")
+                fetcher_blocks.inc()
+                with fetchers_blocked.track_inprogress():
+                    await self._capacity_condition.wait_for(lambda: self._has_upload_capacity(sub_id))
             if sub_id not in self.submission_state:
                 return
-            self.submission_state[sub_id].full_data = full_data
+            state = self.submission_state[sub_id]
+            was_ready, was_waiting = state.is_ready_for_media_upload(), state.is_waiting_for_media_upload()
+            state.full_data = full_data
+            state.matching_subscriptions = matching_subscriptions
+            state.matched_version = matched_version
+            self._state_changed(was_ready, was_waiting, state)
+            self._record(lambda journal: journal.record_fetched(sub_id, full_data))
+        self._flush_journal()
 
     async def revert_data_fetch(self, sub_id: SubmissionID) -> None:
         # This reverts a submission back to before any data was fetched about it, and re-queues it for data fetch
         async with self._lock:
             if sub_id not in self.submission_state:
-                self.submission_state[sub_id] = SubmissionCheckState(sub_id)
-            self.submission_state[sub_id].full_data = None
-            self.submission_state[sub_id].media_uploading = False
-            self.submission_state[sub_id].cache_entry = None
-            self.submission_state[sub_id].uploaded_media = None
+                self._add_state(SubmissionCheckState(sub_id))
+            state = self.submission_state[sub_id]
+            was_ready, was_waiting = state.is_ready_for_media_upload(), state.is_waiting_for_media_upload()
+            state.full_data = None
+            state.matching_subscriptions = None
+            state.matched_version = None
+            state.media_uploading = False
+            state.cache_entry = None
+            state.uploaded_media = None
+            state.trace.mark(STAGE_REVERTED)
+            self._state_changed(was_ready, was_waiting, state)
+            self._record(lambda journal: journal.record_reverted(sub_id))
             await self.fetch_data_queue.put_refresh(sub_id)
+        self._flush_journal()
 
     def states_ready_for_media_upload(self) -> list[SubmissionCheckState]:
         return [s for s in self.submission_state.values() if s.is_ready_for_media_upload()]
 
     async def get_next_for_media_upload(self) -> FASubmissionFull:
         async with self._lock:
-            submission_states = self.states_ready_for_media_upload()
-            if not submission_states:
+            if self._next_for_upload() is None:
                 raise QueueEmpty()
-            next_state = min(submission_states, key=lambda state: state.key())
+            _, _, sub_id = heapq.heappop(self._upload_heap)
+            next_state = self.submission_state[sub_id]
             next_state.media_uploading = True
-            self._media_uploading_event.set()
-            self._media_uploading_event.clear()
+            next_state.trace.mark(STAGE_UPLOAD_START)
+            self._state_changed(True, True, next_state)
             return next_state.full_data
 
+    async def wait_for_media_upload(self) -> None:
+        """
+        Waits until there is a submission ready for media upload, which no media fetcher has started uploading.
+        """
+        async with self._upload_condition:
+            await self._upload_condition.wait_for(lambda: self._next_for_upload() is not None)
+
     async def set_cached(self, sub_id: SubmissionID, cache_entry: SentSubmission) -> None:
         async with self._lock:
             if sub_id not in self.submission_state:
                 return
-            self.submission_state[sub_id].cache_entry = cache_entry
+            state = self.submission_state[sub_id]
+            was_ready, was_waiting = state.is_ready_for_media_upload(), state.is_waiting_for_media_upload()
+            state.cache_entry = cache_entry
+            state.trace.mark(STAGE_UPLOAD_END)
+            self._state_changed(was_ready, was_waiting, state)
+            self._record(lambda journal: journal.record_cached(sub_id, cache_entry))
+        self._flush_journal()
 
     async def set_uploaded(self, sub_id: SubmissionID, uploaded: UploadedMedia) -> None:
         async with self._lock:
             if sub_id not in self.submission_state:
                 return
-            self.submission_state[sub_id].uploaded_media = uploaded
+            state = self.submission_state[sub_id]
+            was_ready, was_waiting = state.is_ready_for_media_upload(), state.is_waiting_for_media_upload()
+            state.uploaded_media = uploaded
+            state.trace.mark(STAGE_UPLOAD_END)
+            self._state_changed(was_ready, was_waiting, state)
+            self._record(lambda journal: journal.record_uploaded(sub_id, uploaded))
+        self._flush_journal()
 
     async def remove_state(self, sub_id: SubmissionID) -> None:
         async with self._lock:
             if sub_id not in self.submission_state:
                 raise ValueError("This state cannot be removed because it is not in the wait pool")
-            del self.submission_state[sub_id]
+            self._discard_state(sub_id)
+            self._record(lambda journal: journal.record_removed(sub_id))
+        self._flush_journal()
 
     async def pop_next_ready_to_send(self) -> Optional[SubmissionCheckState]:
         async with self._lock:
-            submission_states = self.submission_state.values()
-            if not submission_states:
+            next_state = self._next_state()
+            if next_state is None or not next_state.is_ready_to_send():
                 return None
-            next_state = min(submission_states, key=lambda state: state.key())
-            if not next_state.is_ready_to_send():
-                return None
-            del self.submission_state[next_state.sub_id]
+            heapq.heappop(self._state_heap)
+            self._discard_state(next_state.sub_id)
+            self._sending[next_state.sub_id] = next_state
             return next_state
 
+    async def wait_for_ready_to_send(self) -> None:
+        """
+        Waits until the lowest submission in the pool is ready to send.
+        """
+        async with self._send_condition:
+            await self._send_condition.wait_for(self._is_next_ready_to_send)
+
+    async def set_sent_to(self, state: SubmissionCheckState, destination: Union[int, TypeInputPeer]) -> None:
+        """
+        Records that a state taken by the sender has been sent to the given destination, so it is not sent there again.
+        """
+        async with self._lock:
+            state.sent_to.append(destination)
+            state.trace.mark_sent(None if state.full_data is None else state.full_data.posted_at)
+            if isinstance(destination, int):
+                self._record(lambda journal: journal.record_sent(state.sub_id, destination))
+        self._flush_journal()
+
+    async def finish_sending(self, state: SubmissionCheckState) -> None:
+        """
+        Marks a state taken by the sender as fully sent, so that it is not restored after a restart.
+        """
+        async with self._lock:
+            self._sending.pop(state.sub_id, None)
+            state.trace.finish(state.sub_id, None if state.full_data is None else state.full_data.posted_at)
+            # The sender may have reverted the submission back into the pool, if its media needs uploading again
+            if state.sub_id not in self.submission_state:
+                self._record(lambda journal: journal.record_removed(state.sub_id))
+        self._flush_journal()
+
     async def return_populated_state(self, state: SubmissionCheckState) -> None:
         async with self._lock:
-            self.submission_state[state.sub_id] = state
+            self._sending.pop(state.sub_id, None)
+            if state.sub_id in self.submission_state:
+                self._discard_state(state.sub_id)
+            self._add_state(state)
 
     def size(self) -> int:
         return len(self.submission_state)
 
+    def qsize_fetch(self) -> int:
+        return self.fetch_data_queue.qsize()
+
     def qsize_fetch_new(self) -> int:
         return self.fetch_data_queue.qsize_new()
 
@@ -136,4 +414,7 @@ class WaitPool:
         return self.fetch_data_queue.qsize_refresh()
 
     def qsize_upload(self) -> int:
-        return len([s for s in self.submission_state.values() if s.is_ready_for_media_upload()])
+        return self._ready_for_upload_count
+
+    def qsize_waiting_for_upload(self) -> int:
+        return self._waiting_for_upload_count
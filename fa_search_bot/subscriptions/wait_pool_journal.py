@@ -0,0 +1,366 @@
+from __future__ import annotations
+
+import base64
+import dataclasses
+import datetime
+import json
+import logging
+import os
+from typing import TYPE_CHECKING
+
+import dateutil.parser
+from prometheus_client import Counter
+from telethon.extensions import BinaryReader
+
+from fa_search_bot.sites.furaffinity.fa_submission import FASubmissionFull, FAUserShort, Rating
+from fa_search_bot.sites.sendable import CaptionSettings, SendSettings, UploadedMedia
+from fa_search_bot.sites.sent_submission import SentSubmission
+from fa_search_bot.sites.submission_id import SubmissionID
+from fa_search_bot.subscriptions.wait_pool import SubmissionCheckState
+
+if TYPE_CHECKING:
+    from typing import IO, Dict, Iterable, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+journal_records = Counter(
+    "fasearchbot_waitpooljournal_records_total",
+    "Number of records written to the wait pool journal, by type of record",
+    labelnames=["record_type"],
+)
+journal_compactions = Counter(
+    "fasearchbot_waitpooljournal_compactions_total",
+    "Number of times the wait pool journal has been rewritten with only the states currently in progress",
+)
+
+RECORD_ADDED = "added"
+RECORD_FETCHED = "fetched"
+RECORD_CACHED = "cached"
+RECORD_UPLOADED = "uploaded"
+RECORD_SENT = "sent"
+RECORD_REVERTED = "reverted"
+RECORD_REMOVED = "removed"
+RECORD_STATE = "state"
+
+
+class WaitPoolJournal:
+    """
+    An append-only log of the changes made to the states in the wait pool, with one JSON record per line, so that
+    submissions in progress can be restored after a restart. Restored submissions keep their fetched data, cache
+    entries, recently uploaded media, and the destinations they have already been sent to. Telegram's references to
+    uploaded files expire, so media uploaded more than UPLOADED_MEDIA_MAX_AGE ago is uploaded again instead.
+
+    Records are buffered as the wait pool changes, and written out by flush() once the wait pool has released its lock,
+    so that other tasks are not kept waiting on file writes. Only the last line can be cut short by a crash, and
+    unreadable lines are skipped when the journal is replayed. The journal is rewritten with a snapshot of each state in
+    progress on startup, and whenever it grows much larger than the number of states in progress.
+    """
+
+    # Bump this whenever the layout of journal records changes
+    JOURNAL_VERSION = 1
+    # The journal is compacted once it has this many records, and more than COMPACT_RATIO records per state
+    COMPACT_MIN_RECORDS = 1000
+    COMPACT_RATIO = 10
+    UPLOADED_MEDIA_MAX_AGE = datetime.timedelta(hours=1)
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.record_count = 0
+        self._file: Optional[IO[str]] = None
+        # Whether records are being kept, from the first snapshot until the journal is closed
+        self._open = False
+        # Lines waiting to be written by the next flush, and the snapshot to rewrite the journal with first, if any
+        self._buffer: List[str] = []
+        self._snapshot: Optional[List[str]] = None
+        # When the media of each state with uploaded media was uploaded, to be kept in snapshots
+        self._uploaded_at: Dict[SubmissionID, datetime.datetime] = {}
+
+    def load(self) -> List[SubmissionCheckState]:
+        """
+        Replays the journal, and returns the states which were in progress when it was last written.
+        """
+        states: Dict[SubmissionID, SubmissionCheckState] = {}
+        uploaded_at: Dict[SubmissionID, datetime.datetime] = {}
+        try:
+            with open(self.filename, "r") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            logger.info("No wait pool journal exists, starting with an empty wait pool")
+            return []
+        if not lines or _load_line(lines[0]) != {"journal_version": self.JOURNAL_VERSION}:
+            logger.warning("Wait pool journal is out of date or unreadable, starting with an empty wait pool")
+            return []
+        for line_num, line in enumerate(lines[1:], 2):
+            record = _load_line(line)
+            if record is None:
+                logger.warning("Skipping unreadable line %s of the wait pool journal", line_num)
+                continue
+            try:
+                _apply_record(states, uploaded_at, record)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning("Skipping invalid record on line %s of the wait pool journal", line_num, exc_info=e)
+        self._uploaded_at = {}
+        expired_count = 0
+        oldest_upload = datetime.datetime.now(datetime.timezone.utc) - self.UPLOADED_MEDIA_MAX_AGE
+        for state in states.values():
+            if state.uploaded_media is None:
+                continue
+            state_uploaded_at = uploaded_at.get(state.sub_id)
+            if state_uploaded_at is None or state_uploaded_at < oldest_upload:
+                # Leave it to be uploaded again
+                state.uploaded_media = None
+                expired_count += 1
+            else:
+                self._uploaded_at[state.sub_id] = state_uploaded_at
+        if expired_count:
+            logger.info("Discarded expired uploaded media for %s submissions in the wait pool journal", expired_count)
+        return list(states.values())
+
+    def compact(self, states: Iterable[SubmissionCheckState]) -> None:
+        """
+        Takes a snapshot of each of the given states, for the next flush to rewrite the journal with, in place of any
+        records not yet written, and starts keeping records after it.
+        """
+        snapshot = [_dump_line({"journal_version": self.JOURNAL_VERSION})]
+        for state in states:
+            snapshot.append(_dump_line(_state_to_record(state, self._uploaded_at.get(state.sub_id))))
+        self._snapshot = snapshot
+        self._buffer = []
+        self.record_count = len(snapshot) - 1
+        self._open = True
+
+    def flush(self) -> None:
+        """
+        Writes out the snapshot and records buffered since the last flush. Raises OSError if they cannot be written.
+        """
+        snapshot, self._snapshot = self._snapshot, None
+        lines, self._buffer = self._buffer, []
+        if snapshot is not None:
+            self._close_file()
+            temp_filename = self.filename + ".temp"
+            with open(temp_filename, "w") as f:
+                f.writelines(snapshot)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_filename, self.filename)
+            journal_compactions.inc()
+            self._file = open(self.filename, "a")
+        if lines and self._file is not None:
+            self._file.writelines(lines)
+            self._file.flush()
+
+    def needs_compacting(self, num_states: int) -> bool:
+        return self.record_count >= max(self.COMPACT_MIN_RECORDS, self.COMPACT_RATIO * num_states)
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        except OSError as e:
+            logger.warning("Failed to write the last records to the wait pool journal", exc_info=e)
+        self._open = False
+        self._close_file()
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def record_added(self, sub_id: SubmissionID) -> None:
+        self._write({"type": RECORD_ADDED, "id": sub_id.to_inline_code()})
+
+    def record_fetched(self, sub_id: SubmissionID, full_data: FASubmissionFull) -> None:
+        self._write({"type": RECORD_FETCHED, "id": sub_id.to_inline_code(), "data": _submission_to_data(full_data)})
+
+    def record_cached(self, sub_id: SubmissionID, cache_entry: SentSubmission) -> None:
+        self._write({"type": RECORD_CACHED, "id": sub_id.to_inline_code(), "data": _cache_entry_to_data(cache_entry)})
+
+    def record_uploaded(self, sub_id: SubmissionID, uploaded: UploadedMedia) -> None:
+        uploaded_at = datetime.datetime.now(datetime.timezone.utc)
+        self._uploaded_at[sub_id] = uploaded_at
+        self._write(
+            {
+                "type": RECORD_UPLOADED,
+                "id": sub_id.to_inline_code(),
+                "data": _uploaded_to_data(uploaded),
+                "uploaded_at": uploaded_at.isoformat(),
+            }
+        )
+
+    def record_sent(self, sub_id: SubmissionID, destination: int) -> None:
+        self._write({"type": RECORD_SENT, "id": sub_id.to_inline_code(), "destination": destination})
+
+    def record_reverted(self, sub_id: SubmissionID) -> None:
+        self._uploaded_at.pop(sub_id, None)
+        self._write({"type": RECORD_REVERTED, "id": sub_id.to_inline_code()})
+
+    def record_removed(self, sub_id: SubmissionID) -> None:
+        self._uploaded_at.pop(sub_id, None)
+        self._write({"type": RECORD_REMOVED, "id": sub_id.to_inline_code()})
+
+    def _write(self, record: Dict) -> None:
+        if not self._open:
+            return
+        try:
+            self._buffer.append(_dump_line(record))
+        except (TypeError, ValueError) as e:
+            logger.warning("Failed to write %s record to wait pool journal", record["type"], exc_info=e)
+            return
+        self.record_count += 1
+        journal_records.labels(record_type=record["type"]).inc()
+
+
+def _dump_line(record: Dict) -> str:
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+
+def _load_line(line: str) -> Optional[Dict]:
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(record, dict):
+        return None
+    return record
+
+
+def _apply_record(
+    states: Dict[SubmissionID, SubmissionCheckState],
+    uploaded_at: Dict[SubmissionID, datetime.datetime],
+    record: Dict,
+) -> None:
+    record_type = record["type"]
+    sub_id = SubmissionID.from_inline_code(record["id"])
+    if record_type == RECORD_ADDED:
+        states.pop(sub_id, None)
+        states[sub_id] = SubmissionCheckState(sub_id)
+        return
+    if record_type == RECORD_STATE:
+        states[sub_id] = _state_from_record(record)
+        # Journals written before upload times were recorded have none, so their uploads are treated as expired
+        _set_uploaded_at(uploaded_at, sub_id, record.get("uploaded_at"))
+        return
+    if record_type == RECORD_REVERTED:
+        # Matches WaitPool.revert_data_fetch, which keeps the destinations already sent to
+        reverted = states.setdefault(sub_id, SubmissionCheckState(sub_id))
+        reverted.full_data = None
+        reverted.cache_entry = None
+        reverted.uploaded_media = None
+        return
+    if record_type == RECORD_REMOVED:
+        states.pop(sub_id, None)
+        return
+    state = states.get(sub_id)
+    if state is None:
+        return
+    if record_type == RECORD_FETCHED:
+        state.full_data = _submission_from_data(record["data"])
+    elif record_type == RECORD_CACHED:
+        state.cache_entry = _cache_entry_from_data(record["data"])
+    elif record_type == RECORD_UPLOADED:
+        state.uploaded_media = _uploaded_from_data(record["data"])
+        _set_uploaded_at(uploaded_at, sub_id, record.get("uploaded_at"))
+    elif record_type == RECORD_SENT:
+        if record["destination"] not in state.sent_to:
+            state.sent_to.append(record["destination"])
+    else:
+        raise ValueError(f"Unrecognised wait pool journal record type: {record_type}")
+
+
+def _set_uploaded_at(
+    uploaded_at: Dict[SubmissionID, datetime.datetime],
+    sub_id: SubmissionID,
+    timestamp: Optional[str],
+) -> None:
+    if timestamp is None:
+        uploaded_at.pop(sub_id, None)
+    else:
+        uploaded_at[sub_id] = dateutil.parser.parse(timestamp)
+
+
+def _state_to_record(state: SubmissionCheckState, uploaded_at: Optional[datetime.datetime]) -> Dict:
+    return {
+        "type": RECORD_STATE,
+        "id": state.sub_id.to_inline_code(),
+        "full_data": None if state.full_data is None else _submission_to_data(state.full_data),
+        "cache_entry": None if state.cache_entry is None else _cache_entry_to_data(state.cache_entry),
+        "uploaded_media": None if state.uploaded_media is None else _uploaded_to_data(state.uploaded_media),
+        "uploaded_at": None if uploaded_at is None else uploaded_at.isoformat(),
+        # Subscription destinations are chat IDs, and only those can be recorded
+        "sent_to": [dest for dest in state.sent_to if isinstance(dest, int)],
+    }
+
+
+def _state_from_record(record: Dict) -> SubmissionCheckState:
+    full_data = record["full_data"]
+    cache_entry = record["cache_entry"]
+    uploaded_media = record["uploaded_media"]
+    return SubmissionCheckState(
+        SubmissionID.from_inline_code(record["id"]),
+        full_data=None if full_data is None else _submission_from_data(full_data),
+        cache_entry=None if cache_entry is None else _cache_entry_from_data(cache_entry),
+        uploaded_media=None if uploaded_media is None else _uploaded_from_data(uploaded_media),
+        sent_to=list(record["sent_to"]),
+    )
+
+
+def _submission_to_data(submission: FASubmissionFull) -> Dict:
+    return {
+        "id": submission.submission_id,
+        "thumbnail_url": submission.thumbnail_url,
+        "download_url": submission.download_url,
+        "full_image_url": submission.full_image_url,
+        "title": submission.title,
+        "author": [submission.author.name, submission.author.profile_name],
+        "description": submission.description,
+        "keywords": submission.keywords,
+        "rating": submission.rating.name,
+        "posted_at": submission.posted_at.isoformat(),
+    }
+
+
+def _submission_from_data(data: Dict) -> FASubmissionFull:
+    return FASubmissionFull(
+        data["id"],
+        data["thumbnail_url"],
+        data["download_url"],
+        data["full_image_url"],
+        data["title"],
+        FAUserShort(*data["author"]),
+        data["description"],
+        data["keywords"],
+        Rating[data["rating"]],
+        dateutil.parser.parse(data["posted_at"]),
+    )
+
+
+def _cache_entry_to_data(cache_entry: SentSubmission) -> Dict:
+    data = dataclasses.asdict(cache_entry)
+    data["sub_id"] = cache_entry.sub_id.to_inline_code()
+    return data
+
+
+def _cache_entry_from_data(data: Dict) -> SentSubmission:
+    return SentSubmission(**{**data, "sub_id": SubmissionID.from_inline_code(data["sub_id"])})
+
+
+def _uploaded_to_data(uploaded: UploadedMedia) -> Dict:
+    # Uploaded media is a telegram object, which is stored in telegram's own binary format
+    media = None if uploaded.media is None else base64.b64encode(bytes(uploaded.media)).decode("ascii")
+    return {
+        "sub_id": uploaded.sub_id.to_inline_code(),
+        "media": media,
+        "settings": dataclasses.asdict(uploaded.settings),
+    }
+
+
+def _uploaded_from_data(data: Dict) -> UploadedMedia:
+    media = None
+    if data["media"] is not None:
+        media = BinaryReader(base64.b64decode(data["media"])).tgread_object()
+    settings = data["settings"]
+    return UploadedMedia(
+        SubmissionID.from_inline_code(data["sub_id"]),
+        media,
+        SendSettings(CaptionSettings(**settings["caption"]), settings["force_doc"], settings["save_cache"]),
+    )
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import bisect
+import math
+import re
+from typing import TYPE_CHECKING
+
+from fa_search_bot.subscriptions.phrase_automaton import fold_case
+
+if TYPE_CHECKING:
+    from typing import List, Optional, Pattern, Sequence, Tuple
+
+    Span = Tuple[int, int]
+
+
+def _fold(text: str) -> str:
+    # The dotted capital I is the only character which lowercases to more than one character, and re.IGNORECASE treats
+    # it as an i, so it is swapped for one to fold every text in place
+    folded = fold_case(text)
+    if folded is None:
+        folded = fold_case(text.replace("\u0130", "i"))
+        assert folded is not None
+    return folded
+
+
+class WildcardPattern:
+    """
+    Matches a word with asterisks in it, where each asterisk stands for one or more characters which are not whitespace
+    or boundary characters, and the whole match must start and end at a word boundary. This finds the same matches as
+    the equivalent regex would, but without backtracking, so that the time taken grows linearly with the length of the
+    text (up to a log factor), however many asterisks there are.
+
+    For each part of the pattern, working backwards from the last, it finds the positions where that part, and the rest
+    of the pattern after it, can match. Each asterisk is then extended as far as the regex's greedy search would extend
+    it, by picking the furthest position where the rest of the pattern can match, within the same run of characters.
+
+    The regex is quicker for short texts, such as single words, and can only backtrack so far in them, so is still used
+    for texts up to regex_max_length characters.
+    """
+
+    # Roughly the most steps the regex may take on a short text: it can try each start, and for each, each way of
+    # placing the asterisks
+    REGEX_STEP_BUDGET = 10_000
+
+    def __init__(self, parts: Sequence[str], boundary_chars: str, regex: Pattern[str]) -> None:
+        if len(parts) < 2:
+            raise ValueError("Wildcard pattern needs at least one asterisk")
+        self.parts = [_fold(part) for part in parts]
+        self._required_parts = [part for part in self.parts if part]
+        self._min_length = sum(len(part) for part in self.parts) + len(self.parts) - 1
+        self._boundary_chars = frozenset(boundary_chars)
+        self._boundary_regex = re.compile("[\\s" + re.escape(boundary_chars) + "]")
+        self._regex = regex
+        wildcard_count = len(parts) - 1
+        max_length = 0
+        while (max_length + 1) * math.comb(max_length + 1, wildcard_count) <= self.REGEX_STEP_BUDGET:
+            max_length += 1
+        self.regex_max_length = max_length
+
+    def _is_boundary(self, char: str) -> bool:
+        return char in self._boundary_chars or char.isspace()
+
+    def search(self, text: str) -> bool:
+        """
+        Returns whether the pattern matches anywhere in the text.
+        """
+        if len(text) < self._min_length:
+            return False
+        if len(text) <= self.regex_max_length:
+            return self._regex.search(text) is not None
+        folded = _fold(text)
+        if not all(part in folded for part in self._required_parts):
+            return False
+        return bool(self._match_starts(folded, self._boundary_positions(folded))[0])
+
+    def spans(self, text: str) -> List[Span]:
+        """
+        Returns the start and end of each match in the text, as a regex finditer() would find them.
+        """
+        if len(text) < self._min_length:
+            return []
+        if len(text) <= self.regex_max_length:
+            return [m.span() for m in self._regex.finditer(text)]
+        folded = _fold(text)
+        if not all(part in folded for part in self._required_parts):
+            return []
+        boundaries = self._boundary_positions(folded)
+        starts, part_positions = self._match_starts(folded, boundaries)
+        text_len = len(folded)
+        spans = []
+        search_from = 0
+        for start in starts:
+            if start < search_from:
+                continue
+            end = start + len(self.parts[0])
+            for part, positions in zip(self.parts[1:], part_positions[1:]):
+                run_end = self._run_end(boundaries, end, text_len)
+                if positions is None:
+                    end = run_end
+                else:
+                    end = positions[bisect.bisect_right(positions, run_end) - 1]
+                end += len(part)
+            spans.append((start, end))
+            search_from = end
+        return spans
+
+    def _boundary_positions(self, folded: str) -> List[int]:
+        return [m.start() for m in self._boundary_regex.finditer(folded)]
+
+    @staticmethod
+    def _run_end(boundaries: List[int], pos: int, text_len: int) -> int:
+        # The end of the run of non-boundary characters starting at pos
+        index = bisect.bisect_left(boundaries, pos)
+        return boundaries[index] if index < len(boundaries) else text_len
+
+    @staticmethod
+    def _occurrences(folded: str, part: str) -> List[int]:
+        positions = []
+        pos = folded.find(part)
+        while pos != -1:
+            positions.append(pos)
+            pos = folded.find(part, pos + 1)
+        return positions
+
+    def _match_starts(self, folded: str, boundaries: List[int]) -> Tuple[List[int], List[Optional[List[int]]]]:
+        """
+        Returns the positions where a match of the whole pattern can start, and for each part of the pattern, the sorted
+        positions where that part and the rest of the pattern after it can match. None is given for an empty last
+        part, which can match at any word boundary.
+        """
+        text_len = len(folded)
+        is_boundary = self._is_boundary
+        last_part = self.parts[-1]
+        # Each asterisk ends at the end of its run at the latest, which is always a word boundary, so an empty last part
+        # always matches
+        next_positions: Optional[List[int]] = None
+        if last_part:
+            next_positions = [
+                pos
+                for pos in self._occurrences(folded, last_part)
+                if pos + len(last_part) == text_len or is_boundary(folded[pos + len(last_part)])
+            ]
+        part_positions: List[Optional[List[int]]] = [next_positions]
+        for part in reversed(self.parts[1:-1]):
+            positions = self._followed_by_asterisk(
+                folded, boundaries, self._occurrences(folded, part), len(part), next_positions
+            )
+            next_positions = positions
+            part_positions.append(positions)
+        first_part = self.parts[0]
+        if first_part:
+            word_starts = [
+                pos for pos in self._occurrences(folded, first_part) if pos == 0 or is_boundary(folded[pos - 1])
+            ]
+            starts = self._followed_by_asterisk(folded, boundaries, word_starts, len(first_part), next_positions)
+        elif next_positions is None:
+            # Any run of non-boundary characters matches, so each run start is a match start
+            run_starts = [0] + [boundary + 1 for boundary in boundaries]
+            starts = [pos for pos in run_starts if pos < text_len and not is_boundary(folded[pos])]
+        else:
+            # The first asterisk must start at a word boundary, which is the start of the run before the next part
+            starts = []
+            for pos in next_positions:
+                if pos == 0 or is_boundary(folded[pos - 1]):
+                    continue
+                index = bisect.bisect_left(boundaries, pos - 1)
+                start = boundaries[index - 1] + 1 if index else 0
+                if not starts or starts[-1] != start:
+                    starts.append(start)
+        part_positions.append(starts)
+        part_positions.reverse()
+        return starts, part_positions
+
+    def _followed_by_asterisk(
+        self,
+        folded: str,
+        boundaries: List[int],
+        positions: List[int],
+        part_len: int,
+        next_positions: Optional[List[int]],
+    ) -> List[int]:
+        """
+        Filters the sorted positions of a part down to those where an asterisk can follow the part, covering one or more
+        characters, and be followed by the next part at one of next_positions. The positions, boundaries and next
+        positions are all sorted, so each is walked through once, rather than searched for each position.
+        """
+        text_len = len(folded)
+        is_boundary = self._is_boundary
+        next_count = len(next_positions) if next_positions is not None else 0
+        boundary_count = len(boundaries)
+        next_index = 0
+        boundary_index = 0
+        result = []
+        for pos in positions:
+            asterisk_start = pos + part_len
+            if asterisk_start >= text_len or is_boundary(folded[asterisk_start]):
+                continue
+            if next_positions is None:
+                result.append(pos)
+                continue
+            while next_index < next_count and next_positions[next_index] <= asterisk_start:
+                next_index += 1
+            if next_index == next_count:
+                break
+            while boundary_index < boundary_count and boundaries[boundary_index] < asterisk_start:
+                boundary_index += 1
+            run_end = boundaries[boundary_index] if boundary_index < boundary_count else text_len
+            if next_positions[next_index] <= run_end:
+                result.append(pos)
+        return result
@@ -1,6 +1,9 @@
+from unittest import mock
+
 import pytest
 from telethon.events import StopPropagation
 
+from fa_search_bot.config import SubscriptionWatcherConfig
 from fa_search_bot.functionalities.subscriptions import BlocklistFunctionality
 from fa_search_bot.subscriptions.subscription_watcher import SubscriptionWatcher
 from fa_search_bot.tests.util.mock_export_api import MockExportAPI
@@ -86,6 +89,18 @@ def test_add_to_blocklist__no_add_blank(mock_client):
     assert len(watcher.blocklists) == 0
 
 
+def test_add_to_blocklist__too_many_wildcards():
+    config = SubscriptionWatcherConfig(True, 1, 1)
+    watcher = SubscriptionWatcher(config, MockExportAPI(), mock.Mock(), MockSubmissionCache())
+    func = BlocklistFunctionality(watcher)
+
+    resp = func._add_to_blocklist(18749, "a*" * 20)
+
+    assert resp.startswith("Failed to parse blocklist query")
+    assert "wildcards" in resp
+    assert len(watcher.blocklists) == 0
+
+
 def test_add_to_blocklist__creates_blocklist_for_channel(mock_client):
     api = MockExportAPI()
     cache = MockSubmissionCache()
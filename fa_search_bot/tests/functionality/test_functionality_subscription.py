@@ -1,8 +1,10 @@
 import datetime
+from unittest import mock
 
 import pytest
 from telethon.events import StopPropagation
 
+from fa_search_bot.config import SubscriptionWatcherConfig
 from fa_search_bot.functionalities.subscriptions import SubscriptionFunctionality
 from fa_search_bot.subscriptions.subscription_watcher import SubscriptionWatcher
 from fa_search_bot.subscriptions.subscription import Subscription
@@ -160,6 +162,18 @@ def test_add_sub__invalid_query(mock_client):
     assert len(watcher.subscriptions) == 0
 
 
+def test_add_sub__too_many_wildcards():
+    config = SubscriptionWatcherConfig(True, 1, 1)
+    watcher = SubscriptionWatcher(config, MockExportAPI(), mock.Mock(), MockSubmissionCache())
+    func = SubscriptionFunctionality(watcher)
+
+    resp = func._add_sub(18749, "a*" * 20)
+
+    assert resp.startswith("Failed to parse subscription query")
+    assert "wildcards" in resp
+    assert len(watcher.subscriptions) == 0
+
+
 def test_add_sub__no_add_duplicate(mock_client):
     api = MockExportAPI()
     cache = MockSubmissionCache()
@@ -0,0 +1,121 @@
+import pytest
+
+from fa_search_bot.subscriptions.affix_trie import AffixRegistry, AffixTrie
+from fa_search_bot.subscriptions.query_parser import (
+    TERM_PREFIX,
+    TERM_SUFFIX,
+    AnyField,
+    SubmissionText,
+    TitleField,
+    parse_query,
+    register_query,
+    unregister_query,
+)
+from fa_search_bot.tests.util.query_corpus import CORPUS_QUERIES, corpus_submissions
+from fa_search_bot.tests.util.submission_builder import SubmissionBuilder
+
+
+def test_trie__prefixes():
+    trie = AffixTrie(["dee", "do", "ca"])
+
+    assert trie.matches(["deer", "dog", "cat"]) == {"dee", "do", "ca"}
+
+
+def test_trie__suffixes():
+    trie = AffixTrie(["eer", "og", "ca"], reverse=True)
+
+    assert trie.matches(["deer", "dog", "cat"]) == {"eer", "og"}
+
+
+def test_trie__does_not_match_whole_word():
+    assert AffixTrie(["deer"]).matches(["deer"]) == set()
+    assert AffixTrie(["deer"], reverse=True).matches(["deer"]) == set()
+
+
+def test_trie__nested_affixes():
+    trie = AffixTrie(["d", "de", "dee", "deer"])
+
+    assert trie.matches(["deer"]) == {"d", "de", "dee"}
+
+
+def test_trie__empty():
+    assert AffixTrie([]).matches(["deer"]) == set()
+
+
+def test_registry__rebuilds_on_change():
+    registry = AffixRegistry(TERM_PREFIX)
+    registry.add("dee")
+    trie = registry.trie
+
+    registry.add("dee")
+    assert registry.trie is trie
+
+    registry.remove("dee")
+    assert registry.trie is trie
+
+    registry.remove("dee")
+    assert registry.trie is not trie
+    assert len(registry) == 0
+
+
+def test_registry__add_query_takes_own_kind():
+    prefixes = AffixRegistry(TERM_PREFIX)
+    suffixes = AffixRegistry(TERM_SUFFIX, reverse=True)
+    query = parse_query("Dee* or title:*OG or cat")
+
+    prefixes.add_query(query)
+    suffixes.add_query(query)
+
+    assert prefixes.trie.affixes == {"dee"}
+    assert suffixes.trie.affixes == {"og"}
+
+
+@pytest.mark.parametrize("registered", [True, False])
+def test_submission_text__has_prefix(registered):
+    query = parse_query("dee* or title:do* or d*")
+    if registered:
+        register_query(query)
+    try:
+        sub = SubmissionBuilder(title="deer", description="dog", keywords=["d"]).build_full_submission()
+        text = SubmissionText(sub)
+
+        assert text.has_prefix(AnyField(), "dee")
+        assert text.has_prefix(AnyField(), "do")
+        assert not text.has_prefix(TitleField(), "do")
+        assert text.has_prefix(AnyField(), "d")
+        assert not text.has_prefix(AnyField(), "deer")
+    finally:
+        if registered:
+            unregister_query(query)
+
+
+@pytest.mark.parametrize("registered", [True, False])
+def test_submission_text__has_suffix(registered):
+    query = parse_query("*eer or title:*og or *r")
+    if registered:
+        register_query(query)
+    try:
+        sub = SubmissionBuilder(title="deer", description="dog", keywords=["r"]).build_full_submission()
+        text = SubmissionText(sub)
+
+        assert text.has_suffix(AnyField(), "eer")
+        assert text.has_suffix(AnyField(), "og")
+        assert not text.has_suffix(TitleField(), "og")
+        assert text.has_suffix(AnyField(), "r")
+        assert not text.has_suffix(AnyField(), "deer")
+    finally:
+        if registered:
+            unregister_query(query)
+
+
+@pytest.mark.parametrize("query_str", CORPUS_QUERIES)
+def test_registered_queries_match_same_submissions(query_str):
+    query = parse_query(query_str)
+    submissions = list(corpus_submissions())
+    unregistered = [query.matches_submission(submission) for submission in submissions]
+
+    register_query(query)
+    try:
+        assert [query.matches_submission(submission) for submission in submissions] == unregistered
+    finally:
+        unregister_query(query)
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import asyncio
+from unittest import mock
+
+import pytest
+
+from fa_search_bot.config import SubscriptionWatcherConfig
+from fa_search_bot.sites.submission_id import SubmissionID
+from fa_search_bot.subscriptions.data_fetcher import DataFetcher
+from fa_search_bot.subscriptions.runnable import ShutdownError
+from fa_search_bot.subscriptions.subscription import Subscription
+from fa_search_bot.subscriptions.subscription_watcher import SubscriptionWatcher
+from fa_search_bot.tests.util.mock_export_api import MockExportAPI, MockSubmission
+from fa_search_bot.tests.util.mock_submission_cache import MockSubmissionCache
+
+
+class SlowExportAPI(MockExportAPI):
+    def __init__(self):
+        super().__init__()
+        self.active_fetches = 0
+        self.max_active_fetches = 0
+
+    async def get_full_submission(self, submission_id: str):
+        self.active_fetches += 1
+        self.max_active_fetches = max(self.max_active_fetches, self.active_fetches)
+        try:
+            await asyncio.sleep(0.01)
+            return await super().get_full_submission(submission_id)
+        finally:
+            self.active_fetches -= 1
+
+
+@pytest.mark.asyncio
+async def test_do_process__fetches_batch_concurrently():
+    api = SlowExportAPI().with_submissions(
+        [MockSubmission(str(num), keywords=["deer"] if num % 2 else ["dog"]) for num in range(1, 5)]
+    )
+    watcher = SubscriptionWatcher(SubscriptionWatcherConfig(True, 1, 1), api, mock.Mock(), MockSubmissionCache())
+    watcher.subscriptions.add(Subscription("deer", 123))
+    for num in range(1, 6):
+        await watcher.wait_pool.add_sub_id(SubmissionID("fa", str(num)))
+    fetcher = DataFetcher(watcher)
+    fetcher.BATCH_QUEUE_THRESHOLD = 1
+    fetcher.running = True
+
+    await fetcher.do_process()
+
+    assert api.max_active_fetches == 5
+    assert fetcher.last_sub_ids == []
+    # Submission 5 does not exist, and the even submissions do not match any subscription
+    assert set(watcher.wait_pool.submission_state.keys()) == {SubmissionID("fa", "1"), SubmissionID("fa", "3")}
+    assert watcher.wait_pool.qsize_fetch() == 0
+
+
+@pytest.mark.asyncio
+async def test_do_process__failed_fetch_cancels_rest_of_batch():
+    watcher = SubscriptionWatcher(
+        SubscriptionWatcherConfig(True, 1, 1), MockExportAPI(), mock.Mock(), MockSubmissionCache()
+    )
+    for num in range(1, 6):
+        await watcher.wait_pool.add_sub_id(SubmissionID("fa", str(num)))
+    fetcher = DataFetcher(watcher)
+    fetcher.BATCH_QUEUE_THRESHOLD = 1
+    fetcher.running = True
+    cancelled = []
+    finished = []
+
+    async def fetch_data(sub_id: SubmissionID):
+        if sub_id.submission_id == "2":
+            raise ShutdownError("Stopped")
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            cancelled.append(sub_id)
+            raise
+        finished.append(sub_id)
+        return MockSubmission(sub_id.submission_id)
+
+    fetcher.fetch_data = fetch_data
+
+    with pytest.raises(ShutdownError):
+        await fetcher.do_process()
+    await fetcher.revert_last_attempt()
+    await asyncio.sleep(0.1)
+
+    assert len(cancelled) == 4
+    assert finished == []
+    assert fetcher.last_sub_ids == []
+    assert watcher.wait_pool.qsize_fetch() == 5
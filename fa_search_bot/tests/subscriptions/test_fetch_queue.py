@@ -0,0 +1,93 @@
+import datetime
+import random
+from unittest import mock
+
+import pytest
+
+from fa_search_bot.sites.submission_id import SubmissionID
+from fa_search_bot.subscriptions.fetch_queue import RefreshCounter, TooManyRefresh
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def advance(self, seconds: float) -> None:
+        self.now += datetime.timedelta(seconds=seconds)
+
+
+@pytest.fixture
+def clock():
+    clock = _Clock()
+    with mock.patch("fa_search_bot.subscriptions.fetch_queue.datetime") as mock_datetime:
+        mock_datetime.timezone = datetime.timezone
+        mock_datetime.datetime.now.side_effect = lambda tz=None: clock.now
+        yield clock
+
+
+def _sub_id(number: int) -> SubmissionID:
+    return SubmissionID("fa", str(number))
+
+
+def test_add__counts_refreshes(clock):
+    counter = RefreshCounter(refresh_limit=10)
+
+    counter.add(_sub_id(1))
+    counter.add(_sub_id(2))
+    counter.add(_sub_id(1))
+
+    assert counter._refresh_dict[_sub_id(1)].refresh_count == 2
+    assert counter._refresh_dict[_sub_id(2)].refresh_count == 1
+    assert counter.max_count() == 2
+
+
+def test_add__raises_past_limit(clock):
+    counter = RefreshCounter(refresh_limit=3)
+
+    for _ in range(4):
+        counter.add(_sub_id(1))
+    with pytest.raises(TooManyRefresh):
+        counter.add(_sub_id(1))
+
+
+def test_add__forgets_expired_entries(clock):
+    counter = RefreshCounter(refresh_limit=10)
+    counter.add(_sub_id(1))
+    counter.add(_sub_id(1))
+    counter.add(_sub_id(2))
+
+    clock.advance(RefreshCounter.MAX_AGE.total_seconds() + 1)
+    counter.add(_sub_id(3))
+
+    assert list(counter._refresh_dict.keys()) == [_sub_id(3)]
+    assert counter.max_count() == 1
+    assert len(counter._expiry_queue) == 1
+
+
+def test_add__keeps_entries_seen_again(clock):
+    counter = RefreshCounter(refresh_limit=10)
+    counter.add(_sub_id(1))
+    counter.add(_sub_id(2))
+    clock.advance(RefreshCounter.MAX_AGE.total_seconds() - 10)
+    counter.add(_sub_id(1))
+
+    # The first time submission 1 was seen has expired, but not the latest
+    clock.advance(20)
+    counter.add(_sub_id(3))
+
+    assert set(counter._refresh_dict.keys()) == {_sub_id(1), _sub_id(3)}
+    assert counter._refresh_dict[_sub_id(1)].refresh_count == 2
+    assert counter.max_count() == 2
+
+
+def test_max_count__matches_entries_after_random_adds(clock):
+    rand = random.Random(1234)
+    counter = RefreshCounter(refresh_limit=1000)
+
+    for _ in range(5000):
+        clock.advance(rand.uniform(0, 40))
+        counter.add(_sub_id(rand.randint(1, 20)))
+        expected = max(entry.refresh_count for entry in counter._refresh_dict.values())
+        assert counter.max_count() == expected
+        # Each entry has one item in the queue for the latest time it was seen, plus some which will be skipped
+        assert len(counter._expiry_queue) >= len(counter._refresh_dict)
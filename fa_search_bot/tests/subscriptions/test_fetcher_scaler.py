@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import asyncio
+from unittest import mock
+
+import pytest
+
+from fa_search_bot.config import SubscriptionWatcherConfig
+from fa_search_bot.sites.submission_id import SubmissionID
+from fa_search_bot.subscriptions.fetcher_scaler import (
+    REASON_BACKLOG,
+    REASON_CLOUDFLARE,
+    REASON_IDLE,
+    REASON_SLOWDOWN,
+    REASON_UPLOAD_BACKLOG,
+    FetcherScaler,
+    ScalingStats,
+)
+from fa_search_bot.subscriptions.subscription_watcher import SubscriptionWatcher
+from fa_search_bot.tests.util.mock_export_api import MockExportAPI
+from fa_search_bot.tests.util.mock_submission_cache import MockSubmissionCache
+
+
+def _scaler(num_data: int = 2, num_media: int = 2) -> FetcherScaler:
+    config = SubscriptionWatcherConfig(
+        True,
+        num_data,
+        num_media,
+        min_data_fetchers=1,
+        max_data_fetchers=4,
+        min_media_fetchers=1,
+        max_media_fetchers=4,
+    )
+    watcher = SubscriptionWatcher(config, MockExportAPI(), mock.Mock(), MockSubmissionCache())
+    watcher.data_fetchers = [mock.Mock() for _ in range(num_data)]
+    watcher.media_fetchers = [mock.Mock() for _ in range(num_media)]
+    return FetcherScaler(watcher)
+
+
+async def _fill_fetch_queue(scaler: FetcherScaler, count: int) -> None:
+    for num in range(count):
+        await scaler.watcher.wait_pool.add_sub_id(SubmissionID("fa", str(num)))
+
+
+def test_config_bounds__default_to_fixed_size():
+    config = SubscriptionWatcherConfig(True, 3, 2)
+
+    assert config.data_fetcher_bounds == (3, 3)
+    assert config.media_fetcher_bounds == (2, 2)
+    assert not config.autoscaling_enabled
+
+
+def test_config_bounds__include_starting_size():
+    config = SubscriptionWatcherConfig(True, 3, 2, min_data_fetchers=0, max_data_fetchers=2, max_media_fetchers=5)
+
+    assert config.data_fetcher_bounds == (1, 3)
+    assert config.media_fetcher_bounds == (2, 5)
+    assert config.autoscaling_enabled
+
+
+def test_target_data_fetchers__idle_scales_down():
+    scaler = _scaler()
+
+    assert scaler.target_data_fetchers(ScalingStats()) == (1, REASON_IDLE)
+
+
+@pytest.mark.asyncio
+async def test_target_data_fetchers__backlog_scales_up_to_max():
+    scaler = _scaler(num_data=4)
+    await _fill_fetch_queue(scaler, 300)
+
+    assert scaler.target_data_fetchers(ScalingStats()) == (4, REASON_BACKLOG)
+    scaler.watcher.data_fetchers.pop()
+    assert scaler.target_data_fetchers(ScalingStats()) == (4, REASON_BACKLOG)
+
+
+@pytest.mark.asyncio
+async def test_target_data_fetchers__not_while_upload_backlog_full():
+    scaler = _scaler()
+    await _fill_fetch_queue(scaler, 300)
+    scaler.watcher.wait_pool._waiting_for_upload_count = scaler.watcher.wait_pool.MAX_READY_FOR_UPLOAD
+
+    assert scaler.target_data_fetchers(ScalingStats()) == (2, REASON_BACKLOG)
+
+
+@pytest.mark.asyncio
+async def test_target_data_fetchers__slowdown_scales_down_despite_backlog():
+    scaler = _scaler(num_data=3)
+    await _fill_fetch_queue(scaler, 300)
+    scaler.watcher.api.slow_down_status = True
+
+    assert scaler.target_data_fetchers(ScalingStats()) == (2, REASON_SLOWDOWN)
+
+
+@pytest.mark.asyncio
+async def test_target_data_fetchers__cloudflare_errors_scale_down():
+    scaler = _scaler(num_data=3)
+    await _fill_fetch_queue(scaler, 300)
+
+    stats = ScalingStats(fetch_attempts=10, cloudflare_errors=3)
+
+    assert scaler.target_data_fetchers(stats) == (2, REASON_CLOUDFLARE)
+
+
+def test_target_media_fetchers__uses_upload_latency():
+    scaler = _scaler()
+    scaler.watcher.wait_pool._ready_for_upload_count = 10
+    quick = ScalingStats()
+    quick.record_upload(1)
+    slow = ScalingStats()
+    slow.record_upload(20)
+
+    assert scaler.target_media_fetchers(quick) == (2, REASON_UPLOAD_BACKLOG)
+    assert scaler.target_media_fetchers(slow) == (3, REASON_UPLOAD_BACKLOG)
+    assert scaler.target_media_fetchers(ScalingStats()) == (2, REASON_UPLOAD_BACKLOG)
+
+
+def test_target_media_fetchers__idle_scales_down_to_min():
+    scaler = _scaler(num_media=1)
+
+    assert scaler.target_media_fetchers(ScalingStats()) == (1, REASON_IDLE)
+
+
+@pytest.mark.asyncio
+async def test_rescale__starts_and_stops_fetchers():
+    config = SubscriptionWatcherConfig(True, 1, 2, max_data_fetchers=3, min_media_fetchers=1)
+    watcher = SubscriptionWatcher(config, MockExportAPI(), mock.Mock(), MockSubmissionCache())
+    scaler = FetcherScaler(watcher)
+    for num in range(100):
+        await watcher.wait_pool.add_sub_id(SubmissionID("fa", str(num)))
+
+    with mock.patch("fa_search_bot.subscriptions.runnable.Runnable.update_heartbeat"):
+        watcher.add_data_fetcher()
+        watcher.add_media_fetcher()
+        watcher.add_media_fetcher()
+        removed_fetcher = watcher.media_fetchers[-1]
+        scaler.rescale(ScalingStats())
+        await asyncio.sleep(0.01)
+
+        assert len(watcher.data_fetchers) == 2
+        assert len(watcher.media_fetchers) == 1
+        assert not removed_fetcher.running
+        for fetcher in watcher.data_fetchers + watcher.media_fetchers:
+            fetcher.stop()
+        await asyncio.wait_for(asyncio.gather(*watcher.sub_tasks), 1)
@@ -0,0 +1,161 @@
+import re
+
+import pytest
+
+from fa_search_bot.subscriptions.phrase_automaton import PhraseAutomaton, PhraseRegistry, fold_case
+from fa_search_bot.subscriptions.query_parser import (
+    PhraseQuery,
+    boundary_pattern_end,
+    boundary_pattern_start,
+    parse_query,
+    phrase_registry,
+    punctuation,
+)
+from fa_search_bot.tests.util.query_corpus import CORPUS_QUERIES, corpus_submissions
+
+
+def _regex_spans(phrase, text):
+    regex = re.compile(boundary_pattern_start + re.escape(phrase) + boundary_pattern_end, re.I)
+    return [m.span() for m in regex.finditer(text)]
+
+
+def test_fold_case__keeps_positions():
+    assert fold_case("Hello World") == "hello world"
+    assert fold_case("") == ""
+
+
+def test_fold_case__matches_ignorecase_equivalents():
+    assert fold_case("ſock") == fold_case("SOCK")
+    assert fold_case("ınk") == fold_case("ink")
+    assert fold_case("Σας") == fold_case("σασ")
+
+
+def test_fold_case__length_changing_text():
+    assert fold_case("İstanbul") is None
+
+
+def test_find__matches_at_boundaries():
+    automaton = PhraseAutomaton(["big deer"], punctuation)
+
+    hits = automaton.find("A Big Deer, and a bigger big deer")
+
+    assert hits.spans("big deer") == [(2, 10), (25, 33)]
+
+
+def test_find__ignores_matches_inside_words():
+    automaton = PhraseAutomaton(["deer"], punctuation)
+
+    hits = automaton.find("reindeer deers deer.like")
+
+    assert hits.spans("deer") == [(15, 19)]
+
+
+def test_find__overlapping_phrases():
+    automaton = PhraseAutomaton(["deer dog", "dog", "a deer"], punctuation)
+
+    hits = automaton.find("a deer dog")
+
+    assert hits.spans("a deer") == [(0, 6)]
+    assert hits.spans("deer dog") == [(2, 10)]
+    assert hits.spans("dog") == [(7, 10)]
+
+
+def test_find__repeated_phrase_does_not_overlap_itself():
+    automaton = PhraseAutomaton(["a a"], punctuation)
+
+    assert automaton.find("a a a a").spans("a a") == _regex_spans("a a", "a a a a")
+
+
+def test_find__unregistered_phrase():
+    automaton = PhraseAutomaton(["deer"], punctuation)
+
+    assert automaton.find("dog").spans("dog") is None
+    assert automaton.find("dog").spans("deer") == []
+
+
+def test_find__unfoldable_text_is_not_searched():
+    automaton = PhraseAutomaton(["istanbul"], punctuation)
+
+    assert automaton.find("İstanbul").spans("istanbul") is None
+
+
+@pytest.mark.parametrize(
+    "phrase,text",
+    [
+        ("deer", "Deer deer DEER"),
+        ("deer", "deer.deer,deer"),
+        ("-deer", "a -deer b-deer"),
+        ("deer dog", "deer  dog deer dog"),
+        ("sock", "ſock SOCK"),
+        ("σασ", "ΣΑΣ σας"),
+        ("deer", "deer\n"),
+    ],
+)
+def test_find__matches_regex(phrase, text):
+    automaton = PhraseAutomaton([fold_case(phrase)], punctuation)
+
+    assert automaton.find(text).spans(fold_case(phrase)) == _regex_spans(phrase, text)
+
+
+def test_registry__rebuilds_on_change():
+    registry = PhraseRegistry(punctuation)
+    registry.add("deer")
+    automaton = registry.automaton
+
+    registry.add("deer")
+    assert registry.automaton is automaton
+
+    registry.add("dog")
+    assert registry.automaton is not automaton
+    assert registry.automaton.phrases == {"deer", "dog"}
+
+
+def test_registry__counts_references():
+    registry = PhraseRegistry(punctuation)
+    registry.add("deer")
+    registry.add("deer")
+
+    registry.remove("deer")
+    assert "deer" in registry
+
+    registry.remove("deer")
+    assert "deer" not in registry
+    assert len(registry) == 0
+
+
+def test_registry__add_query():
+    registry = PhraseRegistry(punctuation)
+    query = parse_query('"Big Deer" or dog except "dog house" or title:"cat"')
+
+    registry.add_query(query)
+
+    assert registry.automaton.phrases == {"big deer", "dog", "dog house", "cat"}
+
+    registry.remove_query(query)
+
+    assert len(registry) == 0
+
+
+def test_phrase_query__registered_matches_same_as_unregistered():
+    phrase = PhraseQuery("test submission")
+    submissions = list(corpus_submissions())
+    unregistered = [phrase.match_locations(submission) for submission in submissions]
+
+    phrase_registry.add_query(phrase)
+    try:
+        assert [phrase.match_locations(submission) for submission in submissions] == unregistered
+    finally:
+        phrase_registry.remove_query(phrase)
+
+
+@pytest.mark.parametrize("query_str", CORPUS_QUERIES)
+def test_registered_queries_match_same_submissions(query_str):
+    query = parse_query(query_str)
+    submissions = list(corpus_submissions())
+    unregistered = [query.matches_submission(submission) for submission in submissions]
+
+    phrase_registry.add_query(query)
+    try:
+        assert [query.matches_submission(submission) for submission in submissions] == unregistered
+    finally:
+        phrase_registry.remove_query(query)
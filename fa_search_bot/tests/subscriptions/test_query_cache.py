@@ -0,0 +1,156 @@
+import json
+import os
+from unittest import mock
+
+import pytest
+
+from fa_search_bot.config import SubscriptionWatcherConfig
+from fa_search_bot.subscriptions import query_cache as query_cache_module
+from fa_search_bot.subscriptions.query_cache import QueryCache
+from fa_search_bot.subscriptions.query_parser import (
+    GRAMMAR_VERSION,
+    InvalidQueryException,
+    parse_query,
+    query_from_data,
+)
+from fa_search_bot.subscriptions.subscription_watcher import SubscriptionWatcher
+from fa_search_bot.tests.util.mock_export_api import MockExportAPI
+from fa_search_bot.tests.util.mock_method import MockMethod
+from fa_search_bot.tests.util.mock_submission_cache import MockSubmissionCache
+from fa_search_bot.tests.util.query_corpus import CORPUS_QUERIES
+
+TEST_CACHE_FILE = "./test_query_cache.json"
+
+
+@pytest.fixture
+def cache_file():
+    if os.path.exists(TEST_CACHE_FILE):
+        os.remove(TEST_CACHE_FILE)
+    yield TEST_CACHE_FILE
+    if os.path.exists(TEST_CACHE_FILE):
+        os.remove(TEST_CACHE_FILE)
+
+
+@pytest.mark.parametrize("query_str", CORPUS_QUERIES)
+def test_to_data__round_trip(query_str):
+    query = parse_query(query_str)
+
+    data = json.loads(json.dumps(query.to_data()))
+
+    assert query_from_data(data) == query
+    assert type(query_from_data(data)) is type(query)
+
+
+@pytest.mark.parametrize("data", [[], ["unknown", "deer"], ["word", "deer", "nowhere"], ["rating", "PG"], None])
+def test_query_from_data__invalid(data):
+    with pytest.raises(ValueError):
+        query_from_data(data)
+
+
+def test_parse__uses_cache_without_parsing(cache_file, monkeypatch):
+    query = parse_query("deer or dog")
+    cache = QueryCache(cache_file, {"cached query": query.to_data()})
+    mock_parse = MockMethod()
+    monkeypatch.setattr(query_cache_module, "parse_query", mock_parse.call)
+
+    result = cache.parse("cached query")
+
+    assert result == query
+    assert not mock_parse.called
+    assert cache.hits == 1
+    assert cache.misses == 0
+
+
+def test_parse__parses_missing_queries(cache_file):
+    cache = QueryCache(cache_file)
+
+    result = cache.parse("deer or dog")
+
+    assert result == parse_query("deer or dog")
+    assert cache.misses == 1
+    assert cache.entries["deer or dog"] == result.to_data()
+
+
+def test_parse__invalid_cache_entry_is_parsed(cache_file):
+    cache = QueryCache(cache_file, {"deer": ["nonsense"]})
+
+    result = cache.parse("deer")
+
+    assert result == parse_query("deer")
+    assert cache.misses == 1
+
+
+def test_parse__invalid_query_raises(cache_file):
+    cache = QueryCache(cache_file)
+
+    with pytest.raises(InvalidQueryException):
+        cache.parse("(deer")
+
+
+def test_save_and_load(cache_file):
+    cache = QueryCache(cache_file)
+    cache.parse("deer")
+    cache.parse("dog except dog-house")
+    cache.parse("unused")
+
+    cache.save_to_file(["deer", "dog except dog-house"])
+    loaded = QueryCache.load_from_file(cache_file)
+
+    assert set(loaded.entries) == {"deer", "dog except dog-house"}
+    assert loaded.parse("dog except dog-house") == parse_query("dog except dog-house")
+    assert loaded.hits == 1
+
+
+def test_load__missing_file(cache_file):
+    cache = QueryCache.load_from_file(cache_file)
+
+    assert cache.entries == {}
+
+
+def test_load__stale_grammar_version(cache_file):
+    with open(cache_file, "w") as f:
+        json.dump(
+            {
+                "cache_version": QueryCache.CACHE_VERSION,
+                "grammar_version": GRAMMAR_VERSION - 1,
+                "queries": {"deer": parse_query("deer").to_data()},
+            },
+            f,
+        )
+
+    cache = QueryCache.load_from_file(cache_file)
+
+    assert cache.entries == {}
+
+
+def test_load__corrupt_file(cache_file):
+    with open(cache_file, "w") as f:
+        f.write("{not json")
+
+    cache = QueryCache.load_from_file(cache_file)
+
+    assert cache.entries == {}
+
+
+def test_load_from_json_new_format__uses_query_cache(cache_file):
+    config = SubscriptionWatcherConfig(True, 1, 1)
+    data = {
+        "latest_ids": [],
+        "destinations": {
+            "123": {
+                "subscriptions": [{"query": "deer", "latest_update": None}],
+                "blocks": [{"query": "ych"}],
+            },
+        },
+    }
+    query_cache = QueryCache(cache_file, {"deer": parse_query("deer").to_data()})
+
+    watcher = SubscriptionWatcher.load_from_json_new_format(
+        data, config, MockExportAPI(), mock.Mock(), MockSubmissionCache(), query_cache
+    )
+
+    assert len(watcher.subscriptions) == 1
+    assert next(iter(watcher.subscriptions)).query == parse_query("deer")
+    assert watcher.blocklist_query_cache["ych"] == parse_query("ych")
+    assert query_cache.hits == 1
+    assert query_cache.misses == 1
@@ -0,0 +1,107 @@
+import pytest
+
+from fa_search_bot.sites.furaffinity.fa_submission import Rating
+from fa_search_bot.subscriptions.query_parser import (
+    AndQuery,
+    NotQuery,
+    OrQuery,
+    PhraseQuery,
+    RatingQuery,
+    SubmissionBatch,
+    TitleField,
+    WordQuery,
+    bit_indexes,
+    optimise_query,
+    parse_query,
+)
+from fa_search_bot.tests.util.mock_method import MockMultiMethod
+from fa_search_bot.tests.util.query_corpus import CORPUS_QUERIES, corpus_submissions
+from fa_search_bot.tests.util.submission_builder import SubmissionBuilder
+
+
+def test_bit_indexes():
+    assert list(bit_indexes(0)) == []
+    assert list(bit_indexes(0b101001)) == [0, 3, 5]
+    assert list(bit_indexes(1 << 100)) == [100]
+
+
+def test_batch__word_and_rating_bits():
+    batch = SubmissionBatch(
+        [
+            SubmissionBuilder(title="deer", keywords=["dog"], rating=Rating.GENERAL).build_full_submission(),
+            SubmissionBuilder(title="dog", keywords=[], rating=Rating.ADULT).build_full_submission(),
+            SubmissionBuilder(title="deer dog", keywords=[], rating=Rating.GENERAL).build_full_submission(),
+        ]
+    )
+
+    assert batch.matches(WordQuery("deer")) == 0b101
+    assert batch.matches(WordQuery("dog", TitleField())) == 0b110
+    assert batch.matches(RatingQuery(Rating.GENERAL)) == 0b101
+    assert batch.matches(WordQuery("fox")) == 0
+
+
+def test_batch__connectors():
+    batch = SubmissionBatch(
+        [
+            SubmissionBuilder(title="deer", description="", keywords=[]).build_full_submission(),
+            SubmissionBuilder(title="dog", description="", keywords=[]).build_full_submission(),
+            SubmissionBuilder(title="deer dog", description="", keywords=[]).build_full_submission(),
+        ]
+    )
+
+    assert batch.matches(AndQuery([WordQuery("deer"), WordQuery("dog")])) == 0b100
+    assert batch.matches(OrQuery([WordQuery("deer"), WordQuery("dog")])) == 0b111
+    assert batch.matches(NotQuery(WordQuery("dog"))) == 0b001
+    assert batch.matches(AndQuery([])) == 0b111
+    assert batch.matches(OrQuery([])) == 0
+
+
+def test_batch__mask_limits_results():
+    batch = SubmissionBatch(
+        [SubmissionBuilder(title="deer", description="", keywords=[]).build_full_submission() for _ in range(3)]
+    )
+
+    assert batch.matches(WordQuery("deer"), 0b010) == 0b010
+    assert batch.matches(NotQuery(WordQuery("dog")), 0b110) == 0b110
+
+
+def test_batch__only_checks_each_submission_once():
+    batch = SubmissionBatch(
+        [SubmissionBuilder(title="hello world", description="", keywords=[]).build_full_submission() for _ in range(3)]
+    )
+    query = PhraseQuery("hello world")
+    checks = MockMultiMethod([True, True, True])
+    query._matcher = checks.call
+
+    assert batch.matches(query, 0b011) == 0b011
+    assert batch.matches(query) == 0b111
+    assert batch.matches(query, 0b101) == 0b101
+    assert checks.calls == 3
+
+
+def test_batch__and_skips_submissions_already_ruled_out():
+    batch = SubmissionBatch(
+        [
+            SubmissionBuilder(title="deer", description="", keywords=[]).build_full_submission(),
+            SubmissionBuilder(title="dog", description="", keywords=[]).build_full_submission(),
+        ]
+    )
+    phrase = PhraseQuery("deer")
+    checks = MockMultiMethod([True])
+    phrase._matcher = checks.call
+
+    assert batch.matches(AndQuery([WordQuery("deer"), phrase])) == 0b01
+    assert checks.calls == 1
+
+
+@pytest.mark.parametrize("query_str", CORPUS_QUERIES)
+def test_batch__matches_same_submissions(query_str):
+    query = parse_query(query_str)
+    optimised = optimise_query(query)
+    submissions = corpus_submissions()
+    batch = SubmissionBatch(submissions)
+
+    expected = sum(1 << i for i, submission in enumerate(submissions) if query.matches_submission(submission))
+    assert batch.matches(query) == expected
+    assert batch.matches(optimised) == expected
+    assert batch.matches(query, 0b1010) == expected & 0b1010
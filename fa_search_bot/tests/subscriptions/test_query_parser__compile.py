@@ -0,0 +1,66 @@
+import pytest
+
+from fa_search_bot.sites.furaffinity.fa_submission import Rating
+from fa_search_bot.subscriptions.query_parser import (
+    AndQuery,
+    OrQuery,
+    RatingQuery,
+    SubmissionText,
+    TitleField,
+    WordQuery,
+    compile_query,
+    optimise_query,
+    parse_query,
+)
+from fa_search_bot.tests.util.query_corpus import CORPUS_QUERIES, corpus_submissions
+from fa_search_bot.tests.util.submission_builder import SubmissionBuilder
+
+
+def test_compile__word():
+    submission = SubmissionBuilder(title="test", description="", keywords=[]).build_full_submission()
+
+    assert compile_query(WordQuery("Test"))(submission)
+    assert not compile_query(WordQuery("example"))(submission)
+
+
+def test_compile__grouped_words_or():
+    submission = SubmissionBuilder(title="test", description="example", keywords=[]).build_full_submission()
+    query = OrQuery([WordQuery("test", TitleField()), WordQuery("example", TitleField()), WordQuery("other")])
+
+    assert compile_query(query)(submission)
+    assert not compile_query(OrQuery([WordQuery("example", TitleField()), WordQuery("other")]))(submission)
+
+
+def test_compile__grouped_words_and():
+    submission = SubmissionBuilder(title="test", description="example", keywords=[]).build_full_submission()
+
+    assert compile_query(AndQuery([WordQuery("test"), WordQuery("example")]))(submission)
+    assert not compile_query(AndQuery([WordQuery("test", TitleField()), WordQuery("example", TitleField())]))(
+        submission
+    )
+
+
+def test_compile__empty_connectors():
+    submission = SubmissionBuilder().build_full_submission()
+
+    assert compile_query(AndQuery([]))(submission)
+    assert not compile_query(OrQuery([]))(submission)
+
+
+def test_compile__text_matcher_uses_submission_text():
+    submission = SubmissionBuilder(rating=Rating.MATURE).build_full_submission()
+    matcher = RatingQuery(Rating.MATURE).compile()
+
+    assert matcher(SubmissionText(submission))
+
+
+@pytest.mark.parametrize("query_str", CORPUS_QUERIES)
+def test_compile__matches_same_submissions(query_str):
+    query = parse_query(query_str)
+    compiled = compile_query(query)
+    compiled_optimised = compile_query(optimise_query(query))
+
+    for submission in corpus_submissions():
+        expected = query.matches_submission(submission)
+        assert compiled(submission) == expected
+        assert compiled_optimised(submission) == expected
@@ -0,0 +1,127 @@
+import random
+
+import pytest
+
+from fa_search_bot.subscriptions.query_parser import (
+    InvalidQueryException,
+    QueryStringParser,
+    WordQuery,
+    parse_query,
+    parse_query_pyparsing,
+)
+from fa_search_bot.tests.util.query_corpus import CORPUS_QUERIES
+
+# Queries from the parser tests, along with awkward corners of the grammar, valid and invalid
+GRAMMAR_QUERIES = [
+    "first",
+    "first document",
+    "-first",
+    "!first",
+    "! first",
+    "not first",
+    "NOT first",
+    "first not second",
+    "first AND doc OR document",
+    "first doc OR document",
+    "(first)",
+    "first (doc or document)",
+    "first (doc or document",
+    '"first document"',
+    '"Hello WORLD!"',
+    'not (hello "first :) document")',
+    '"hello " document"',
+    '"hello \\" document"',
+    '"tab\\tand \\x42 \\u0041 \\012 \\03 \\\\"',
+    '"tab\tstop"',
+    '""',
+    "keyword:first document",
+    'keyword:"first document"',
+    "keyword:(first and document)",
+    "@keyword first document",
+    "@ keyword first",
+    "@keyword",
+    "@keyword (first)",
+    "@keyword:first",
+    "keywords:(deer ych)",
+    "TITLE: first",
+    "title : first",
+    "title:",
+    'title:""',
+    "author:va-artist",
+    "rating:general",
+    "-rating:adult",
+    "rating:General",
+    'rating:"general adult"',
+    "rating:alright",
+    "rating:general except adult",
+    "fake:first",
+    "first*",
+    "*first",
+    "fi*st",
+    "*fi*st*",
+    "multi* except multitude",
+    'multi* except (multitude or "no multi" or multicol*)',
+    "keywords:multi* except multicol*",
+    "keywords:(multi* except multicol*)",
+    "multi* except keywords:multitude",
+    "multi* except (multiple and multitude)",
+    "multi* except (not multitude)",
+    'multi* except ""',
+    "deer except",
+    "deer except-dog",
+    "deer IGNORE dog",
+    "deer exceptional",
+    "notice",
+    "not-deer",
+    "not",
+    "deer or",
+    "deer or-dog",
+    "deer or*",
+    "deer order",
+    "and",
+    "--deer",
+    "",
+    "   ",
+    "deer)",
+    "café",
+    "deer dog",
+]
+
+
+def parse_outcome(parse, query_str):
+    try:
+        return parse(query_str).to_data()
+    except InvalidQueryException:
+        return None
+
+
+def random_query(rand: random.Random) -> str:
+    pieces = ["deer", "dog", "or", "and", "not", "except", "ignore", "OR", "-", "!", "(", ")", ":", "@", '"', '"a b"']
+    pieces += [" ", " ", " ", "title", "rating", "general", "keyword", "*", "d*", "*g", "\\", "\t", "$", "ı"]
+    return "".join(rand.choice(pieces) for _ in range(rand.randint(1, 10)))
+
+
+@pytest.mark.parametrize("query_str", CORPUS_QUERIES + GRAMMAR_QUERIES)
+def test_parser_matches_pyparsing(query_str):
+    assert parse_outcome(lambda q: QueryStringParser(q).parse(), query_str) == parse_outcome(
+        parse_query_pyparsing, query_str
+    )
+
+
+def test_parser_matches_pyparsing__random_queries():
+    rand = random.Random(4321)
+
+    for _ in range(2000):
+        query_str = random_query(rand)
+        assert parse_outcome(lambda q: QueryStringParser(q).parse(), query_str) == parse_outcome(
+            parse_query_pyparsing, query_str
+        ), query_str
+
+
+def test_parser_matches_pyparsing__field_falls_back_to_word():
+    assert parse_query("@keyword") == WordQuery("@keyword")
+
+
+def test_invalid_query__message_has_position():
+    with pytest.raises(InvalidQueryException, match="at char 5"):
+        QueryStringParser("deer )").parse()
@@ -0,0 +1,95 @@
+import pytest
+
+from fa_search_bot.sites.furaffinity.fa_submission import Rating
+from fa_search_bot.subscriptions.query_parser import (
+    AndQuery,
+    LocationOrQuery,
+    NotQuery,
+    OrQuery,
+    PrefixQuery,
+    RatingQuery,
+    SubmissionText,
+    TitleField,
+    WordQuery,
+    intern_query,
+    parse_query,
+)
+from fa_search_bot.subscriptions.subscription import Subscription
+from fa_search_bot.tests.util.mock_method import MockMultiMethod
+from fa_search_bot.tests.util.query_corpus import CORPUS_QUERIES
+from fa_search_bot.tests.util.submission_builder import SubmissionBuilder
+
+
+@pytest.mark.parametrize("query_str", CORPUS_QUERIES)
+def test_hash__equal_queries_hash_equal(query_str):
+    assert hash(parse_query(query_str)) == hash(parse_query(query_str))
+
+
+def test_hash__field_is_included():
+    assert hash(WordQuery("deer")) != hash(WordQuery("deer", TitleField()))
+    assert WordQuery("deer") in {WordQuery("deer")}
+    assert WordQuery("deer", TitleField()) not in {WordQuery("deer")}
+
+
+def test_intern__equal_queries_are_shared():
+    query1 = parse_query("rating:general (deer or dog)")
+    query2 = parse_query("rating:general (deer or dog)")
+
+    assert query1 is query2
+
+
+def test_intern__shared_sub_expressions():
+    sub1 = Subscription("rating:general deer", 123)
+    sub2 = Subscription("rating:general dog", 456)
+
+    rating1 = [q for q in sub1.query.sub_queries if isinstance(q, RatingQuery)][0]
+    rating2 = [q for q in sub2.query.sub_queries if isinstance(q, RatingQuery)][0]
+    assert rating1 is rating2
+
+
+def test_intern__keeps_query_types():
+    location_or = LocationOrQuery([WordQuery("deer"), WordQuery("dog")])
+    plain_or = OrQuery([WordQuery("deer"), WordQuery("dog")])
+
+    assert type(intern_query(plain_or)) is OrQuery
+    assert type(intern_query(location_or)) is LocationOrQuery
+
+
+def test_intern__interns_children():
+    interned_word = intern_query(WordQuery("deer"))
+    query = intern_query(NotQuery(AndQuery([WordQuery("deer"), RatingQuery(Rating.ADULT)])))
+
+    assert query.sub_query.sub_queries[0] is interned_word
+
+
+def test_memo__shared_node_evaluated_once():
+    query = intern_query(PrefixQuery("memo_test_prefix"))
+    compiled = MockMultiMethod([True, True])
+    query.compile = lambda: compiled.call
+    matcher1 = AndQuery([query, WordQuery("deer")]).matcher()
+    matcher2 = AndQuery([query, WordQuery("dog")]).matcher()
+    submission = SubmissionBuilder(title="deer dog", description="", keywords=[]).build_full_submission()
+    text = SubmissionText(submission)
+
+    with text.memoised():
+        assert matcher1(text)
+        assert matcher2(text)
+
+    assert compiled.calls == 1
+
+
+def test_memo__only_lasts_while_memoised():
+    query = intern_query(PrefixQuery("memo_test_prefix_2"))
+    compiled = MockMultiMethod([True, False, True])
+    query.compile = lambda: compiled.call
+    matcher = query.matcher()
+    submission = SubmissionBuilder(title="deer", description="", keywords=[]).build_full_submission()
+    text = SubmissionText(submission)
+
+    with text.memoised():
+        assert matcher(text)
+    assert not matcher(text)
+    with text.memoised():
+        assert matcher(text)
+
+    assert compiled.calls == 3
@@ -0,0 +1,137 @@
+import pytest
+
+from fa_search_bot.sites.furaffinity.fa_submission import FAUser, Rating
+from fa_search_bot.subscriptions.query_parser import (
+    AndQuery,
+    ExceptionQuery,
+    LocationOrQuery,
+    NotQuery,
+    OrQuery,
+    PhraseQuery,
+    PrefixQuery,
+    RatingQuery,
+    RegexQuery,
+    WordQuery,
+    optimise_query,
+    parse_query,
+)
+from fa_search_bot.tests.util.submission_builder import SubmissionBuilder
+
+QUERIES = [
+    "deer",
+    "deer dog",
+    "deer dog deer",
+    "deer and (dog and (cat and deer))",
+    "deer or dog or deer",
+    "deer or (dog or (cat or deer))",
+    "deer and dog or cat",
+    "(deer or dog) and (cat or deer)",
+    '"big deer" deer* rating:general',
+    "-deer",
+    "not -deer",
+    "-(deer or -dog)",
+    "d*r* rating:adult deer",
+    "deer except deer-dog rating:mature",
+    "title:deer or description:dog or keyword:cat",
+    "artist:fender dog",
+    '"deer dog" or deer* or *dog or rating:general',
+    "(deer dog) (deer dog) (deer -cat)",
+    "deer* except (deers or deerly) *dog",
+]
+
+
+def _submissions():
+    return [
+        SubmissionBuilder(
+            title="Deer and dog",
+            description="a big deer with a dog, deer-dog",
+            keywords=["deer", "dog", "deerdog"],
+            rating=Rating.GENERAL,
+            author=FAUser("Fender", "fender"),
+        ).build_full_submission(),
+        SubmissionBuilder(
+            title="Just a dog",
+            description="This is a hotdog, not a cervine. deers",
+            keywords=["dog", "cat"],
+            rating=Rating.MATURE,
+        ).build_full_submission(),
+        SubmissionBuilder(
+            title="Reindeer",
+            description="deerly beloved, big Deer",
+            keywords=["reindeer", "winter"],
+            rating=Rating.ADULT,
+        ).build_full_submission(),
+        SubmissionBuilder(
+            title="Nothing",
+            description="Nothing to see here",
+            keywords=[],
+            rating=Rating.ADULT,
+        ).build_full_submission(),
+        SubmissionBuilder(
+            title="deer cat",
+            description="deer-dog except for deer",
+            keywords=["deer-dog"],
+            rating=Rating.MATURE,
+        ).build_full_submission(),
+    ]
+
+
+def test_optimise__flattens_and():
+    query = AndQuery([WordQuery("a"), AndQuery([WordQuery("b"), AndQuery([WordQuery("c"), WordQuery("d")])])])
+
+    assert optimise_query(query) == AndQuery([WordQuery("a"), WordQuery("b"), WordQuery("c"), WordQuery("d")])
+
+
+def test_optimise__flattens_or():
+    query = OrQuery([OrQuery([WordQuery("a"), WordQuery("b")]), WordQuery("c")])
+
+    assert optimise_query(query) == OrQuery([WordQuery("a"), WordQuery("b"), WordQuery("c")])
+
+
+def test_optimise__does_not_flatten_mixed_connectors():
+    query = AndQuery([OrQuery([WordQuery("a"), WordQuery("b")]), WordQuery("c")])
+
+    assert optimise_query(query) == AndQuery([WordQuery("c"), OrQuery([WordQuery("a"), WordQuery("b")])])
+
+
+def test_optimise__removes_duplicates():
+    query = AndQuery([WordQuery("a"), AndQuery([WordQuery("b"), WordQuery("a")])])
+
+    assert optimise_query(query) == AndQuery([WordQuery("a"), WordQuery("b")])
+
+
+def test_optimise__single_child_is_unwrapped():
+    query = OrQuery([WordQuery("a"), WordQuery("a")])
+
+    assert optimise_query(query) == WordQuery("a")
+
+
+def test_optimise__double_negative():
+    query = NotQuery(NotQuery(WordQuery("a")))
+
+    assert optimise_query(query) == WordQuery("a")
+
+
+def test_optimise__cheap_queries_first():
+    exception = ExceptionQuery(WordQuery("a"), LocationOrQuery([WordQuery("b")]))
+    regex = RegexQuery.from_string_with_asterisks("a*b")
+    query = AndQuery(
+        [exception, regex, PhraseQuery("a b"), PrefixQuery("a"), WordQuery("a"), RatingQuery(Rating.ADULT)]
+    )
+
+    assert optimise_query(query) == AndQuery(
+        [RatingQuery(Rating.ADULT), WordQuery("a"), PrefixQuery("a"), PhraseQuery("a b"), regex, exception]
+    )
+
+
+def test_optimise__leaves_empty_and():
+    assert optimise_query(AndQuery([])) == AndQuery([])
+
+
+@pytest.mark.parametrize("query_str", QUERIES)
+def test_optimise__matches_same_submissions(query_str):
+    query = parse_query(query_str)
+    optimised = optimise_query(query)
+
+    for submission in _submissions():
+        assert optimised.matches_submission(submission) == query.matches_submission(submission)
@@ -1,5 +1,8 @@
+from unittest import mock
+
 from fa_search_bot.subscriptions.query_parser import (
     AndQuery,
+    AnyField,
     ArtistField,
     DescriptionField,
     ExceptionQuery,
@@ -13,11 +16,14 @@ from fa_search_bot.subscriptions.query_parser import (
     PrefixQuery,
     RatingQuery,
     RegexQuery,
+    SortedIntervals,
+    SubmissionText,
     SuffixQuery,
     TitleField,
     WordQuery,
 )
 from fa_search_bot.sites.furaffinity.fa_submission import FAUser, Rating
+from fa_search_bot.tests.util.mock_method import MockMultiMethod
 from fa_search_bot.tests.util.submission_builder import SubmissionBuilder
 
 
@@ -95,6 +101,30 @@ def test_match_location_overlaps_any__overlaps_only_in_other_fields():
     assert not location1.overlaps_any([location2, location3])
 
 
+def test_sorted_intervals__overlaps():
+    intervals = SortedIntervals([(10, 15), (0, 4), (5, 8)])
+
+    assert intervals.overlaps(3, 6)
+    assert intervals.overlaps(12, 20)
+    assert intervals.overlaps(6, 7)
+    assert intervals.overlaps(1, 30)
+
+
+def test_sorted_intervals__no_overlap():
+    intervals = SortedIntervals([(10, 15), (0, 4), (5, 8)])
+
+    assert not intervals.overlaps(4, 5)
+    assert not intervals.overlaps(8, 10)
+    assert not intervals.overlaps(15, 20)
+    assert not SortedIntervals([]).overlaps(0, 5)
+
+
+def test_sorted_intervals__long_interval_before_span():
+    intervals = SortedIntervals([(0, 20), (5, 6)])
+
+    assert intervals.overlaps(10, 12)
+
+
 def test_or_query__both():
     submission = SubmissionBuilder(rating=Rating.GENERAL, title="test").build_full_submission()
     query = OrQuery([RatingQuery(Rating.GENERAL), WordQuery("test", TitleField())])
@@ -1940,3 +1970,86 @@ def test_exception_query__one_match_many_except_no_overlap():
     query = ExceptionQuery(PrefixQuery("hel"), WordQuery("test"))
 
     assert query.matches_submission(submission)
+
+
+def test_exception_query__only_searches_exception_where_word_matches():
+    submission = SubmissionBuilder(
+        title="test",
+        description="hello world",
+        keywords=["test", "thing"],
+    ).build_full_submission()
+    exception = WordQuery("hello")
+    location_spans = MockMultiMethod([[]])
+    exception.location_spans = location_spans.call
+    query = ExceptionQuery(WordQuery("world"), exception)
+
+    assert query.matches_submission(submission)
+    assert location_spans.calls == 1
+    assert location_spans.args[0][1] == FieldLocation("description")
+
+
+def test_prefix_query__location_spans():
+    submission = SubmissionBuilder(
+        title="test", description="hello world, help", keywords=["hello"]
+    ).build_full_submission()
+    query = PrefixQuery("hel", DescriptionField())
+    text = SubmissionText(submission)
+
+    assert query.location_spans(text, FieldLocation("description")) == [(0, 5), (13, 17)]
+    assert query.location_spans(text, FieldLocation("keyword_0")) == []
+    assert query.location_regex is query.location_regex
+
+
+def test_submission_text__shared_across_query_tree():
+    submission = SubmissionBuilder(title="deer dog").build_full_submission()
+    query = AndQuery([WordQuery("deer"), WordQuery("dog")])
+    build_field_words = AnyField.build_field_words
+
+    with mock.patch.object(AnyField, "build_field_words", autospec=True, side_effect=build_field_words) as build:
+        assert query.matches_submission(submission)
+        assert query.matches_submission(submission)
+
+    # Each check of the submission builds one view, which every query in the tree reads from
+    assert build.call_count == 2
+
+
+def test_submission_text__field_words_are_frozensets():
+    submission = SubmissionBuilder(
+        title="Hello, World",
+        description="an example",
+        keywords=["Test", "thing!"],
+        author=FAUser("Fender", "fender"),
+    ).build_full_submission()
+    text = SubmissionText(submission)
+
+    assert text.field_words(TitleField()) == frozenset({"hello", "world"})
+    assert text.field_words(KeywordField()) == frozenset({"test", "thing"})
+    assert text.field_words(AnyField()) == frozenset(
+        {"hello", "world", "an", "example", "test", "thing", "fender"}
+    )
+    assert text.field_words(TitleField()) is text.field_words(TitleField())
+
+
+def test_submission_text__texts():
+    submission = SubmissionBuilder(
+        title="Hello, World",
+        description="an example",
+        keywords=["Test", "thing!"],
+        author=FAUser("Fender", "fender"),
+    ).build_full_submission()
+    text = SubmissionText(submission)
+
+    assert text.texts(AnyField()) == ["Hello, World", "an example", "Test", "thing!", "Fender", "fender"]
+    assert text.texts_dict(KeywordField()) == {
+        FieldLocation("keyword_0"): "Test",
+        FieldLocation("keyword_1"): "thing!",
+    }
+
+
+def test_submission_text__index_words_include_split_texts():
+    submission = SubmissionBuilder(
+        title="title", description="", keywords=[], author=FAUser("Fen.der", "fender")
+    ).build_full_submission()
+    text = SubmissionText(submission)
+
+    assert text.index_words(ArtistField()) == frozenset({"fen.der", "fen", "der", "fender"})
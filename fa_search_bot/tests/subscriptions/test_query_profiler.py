@@ -0,0 +1,183 @@
+import json
+import os
+from unittest import mock
+
+import pytest
+from prometheus_client import REGISTRY
+
+from fa_search_bot.config import SubscriptionWatcherConfig
+from fa_search_bot.sites.furaffinity.fa_submission import Rating
+from fa_search_bot.subscriptions.query_parser import parse_query
+from fa_search_bot.subscriptions.query_profiler import KIND_BLOCKLIST, KIND_SUBSCRIPTION, QueryProfiler
+from fa_search_bot.subscriptions.subscription import Subscription
+from fa_search_bot.subscriptions.subscription_watcher import SubscriptionWatcher
+from fa_search_bot.tests.util.mock_export_api import MockExportAPI
+from fa_search_bot.tests.util.mock_submission_cache import MockSubmissionCache
+from fa_search_bot.tests.util.submission_builder import SubmissionBuilder
+
+TEST_REPORT_FILE = "./test_query_profile.json"
+
+
+@pytest.fixture
+def report_file():
+    for filename in [TEST_REPORT_FILE, TEST_REPORT_FILE + ".temp"]:
+        if os.path.exists(filename):
+            os.remove(filename)
+    yield TEST_REPORT_FILE
+    if os.path.exists(TEST_REPORT_FILE):
+        os.remove(TEST_REPORT_FILE)
+
+
+def test_should_sample__disabled():
+    profiler = QueryProfiler(0)
+
+    assert not profiler.enabled
+    assert not any(profiler.should_sample() for _ in range(100))
+
+
+def test_should_sample__always():
+    profiler = QueryProfiler(1)
+
+    assert profiler.enabled
+    assert all(profiler.should_sample() for _ in range(100))
+
+
+def test_record__accumulates_stats():
+    profiler = QueryProfiler(1)
+    query = parse_query("deer")
+
+    profiler.record(KIND_SUBSCRIPTION, 123, "deer", query, 0.5, True)
+    profiler.record(KIND_SUBSCRIPTION, 123, "deer", query, 1.5, False)
+
+    stats = profiler.stats[(KIND_SUBSCRIPTION, 123, "deer")]
+    assert stats.checks == 2
+    assert stats.hits == 1
+    assert stats.hit_ratio == 0.5
+    assert stats.total_seconds == 2
+    assert stats.mean_seconds == 1
+
+
+def test_top_queries__most_total_time_first():
+    profiler = QueryProfiler(1)
+    for query_str, seconds in [("deer", 1), ("dog", 3), ("cat", 2)]:
+        profiler.record(KIND_SUBSCRIPTION, 123, query_str, parse_query(query_str), seconds, False)
+    profiler.record(KIND_BLOCKLIST, 123, "deer", parse_query("deer"), 2.5, False)
+
+    top = profiler.top_queries(3)
+
+    assert [(stats.kind, stats.query_str) for stats in top] == [
+        (KIND_SUBSCRIPTION, "dog"),
+        (KIND_BLOCKLIST, "deer"),
+        (KIND_SUBSCRIPTION, "cat"),
+    ]
+    assert REGISTRY.get_sample_value("fasearchbot_queryprofiler_top_query_sampled_seconds", {"rank": "1"}) == 3
+    assert REGISTRY.get_sample_value("fasearchbot_queryprofiler_top_query_mean_seconds", {"rank": "2"}) == 2.5
+    assert REGISTRY.get_sample_value("fasearchbot_queryprofiler_top_query_sampled_seconds", {"rank": "5"}) == 0
+
+
+def test_save_report(report_file):
+    profiler = QueryProfiler(1, report_file)
+    profiler.record(KIND_SUBSCRIPTION, 123, "deer* -dog", parse_query("deer* -dog"), 0.25, True)
+
+    profiler.save_report()
+
+    with open(report_file) as f:
+        data = json.load(f)
+    assert data["sample_rate"] == 1
+    assert len(data["queries"]) == 1
+    entry = data["queries"][0]
+    assert entry["query"] == "deer* -dog"
+    assert entry["destination"] == 123
+    assert entry["parsed"] == repr(parse_query("deer* -dog"))
+    assert entry["mean_seconds"] == 0.25
+
+
+def test_prune__drops_removed_queries():
+    profiler = QueryProfiler(1)
+    for query_str in ["deer", "dog"]:
+        profiler.record(KIND_SUBSCRIPTION, 123, query_str, parse_query(query_str), 1, False)
+    profiler.record(KIND_BLOCKLIST, 123, "deer", parse_query("deer"), 1, False)
+
+    profiler.prune({(KIND_SUBSCRIPTION, 123, "dog"), (KIND_BLOCKLIST, 123, "deer"), (KIND_BLOCKLIST, 456, "cat")})
+
+    assert set(profiler.stats.keys()) == {(KIND_SUBSCRIPTION, 123, "dog"), (KIND_BLOCKLIST, 123, "deer")}
+
+
+def test_finish_sample__saves_report_periodically(report_file):
+    profiler = QueryProfiler(1, report_file)
+
+    for _ in range(QueryProfiler.REPORT_EVERY - 1):
+        profiler.finish_sample()
+    assert not os.path.exists(report_file)
+
+    profiler.finish_sample()
+    assert os.path.exists(report_file)
+
+
+def _sampled_watcher() -> SubscriptionWatcher:
+    # A plain mock client, as the mock_client fixture's Future needs an event loop to exist
+    config = SubscriptionWatcherConfig(True, 1, 1, query_profile_sample_rate=1)
+    watcher = SubscriptionWatcher(config, MockExportAPI(), mock.Mock(), MockSubmissionCache())
+    watcher.query_profiler.report_filename = None
+    return watcher
+
+
+def test_check_subscriptions__sampled_records_queries():
+    watcher = _sampled_watcher()
+    sub1 = Subscription("deer", 123)
+    sub2 = Subscription("deer rating:adult", 123)
+    sub3 = Subscription("deer", 456)
+    for sub in [sub1, sub2, sub3]:
+        watcher.subscriptions.add(sub)
+    watcher.add_to_blocklist(123, "ych")
+    watcher.add_to_blocklist(123, "comic")
+    submission = SubmissionBuilder(
+        title="deer ych", description="", keywords=[], rating=Rating.GENERAL
+    ).build_full_submission()
+
+    matches = watcher.check_subscriptions(submission)
+
+    assert matches == [sub3]
+    stats = watcher.query_profiler.stats
+    assert stats[(KIND_SUBSCRIPTION, 123, "deer")].hits == 1
+    assert stats[(KIND_SUBSCRIPTION, 123, "deer rating:adult")].hits == 0
+    assert stats[(KIND_SUBSCRIPTION, 456, "deer")].checks == 1
+    assert stats[(KIND_BLOCKLIST, 123, "ych")].hits == 1
+    assert stats[(KIND_BLOCKLIST, 123, "comic")].hits == 0
+    assert watcher.query_profiler.sample_count == 1
+
+
+def test_check_subscriptions_batch__sampled_matches_same():
+    watcher = _sampled_watcher()
+    sub1 = Subscription("deer", 123)
+    sub2 = Subscription("dog", 123)
+    watcher.subscriptions.add(sub1)
+    watcher.subscriptions.add(sub2)
+    submissions = [
+        SubmissionBuilder(title="deer", description="", keywords=[]).build_full_submission(),
+        SubmissionBuilder(title="dog", description="", keywords=[]).build_full_submission(),
+    ]
+
+    match_matrix = watcher.check_subscriptions_batch(submissions)
+
+    assert match_matrix == [[sub1], [sub2]]
+    assert watcher.query_profiler.sample_count == 2
+
+
+def test_check_subscriptions__sampled_drops_removed_queries():
+    watcher = _sampled_watcher()
+    sub1 = Subscription("deer", 123)
+    sub2 = Subscription("deer", 456)
+    watcher.subscriptions.add(sub1)
+    watcher.subscriptions.add(sub2)
+    watcher.add_to_blocklist(123, "ych")
+    submission = SubmissionBuilder(title="deer", description="", keywords=[]).build_full_submission()
+    watcher.check_subscriptions(submission)
+
+    watcher.subscriptions.remove(sub2)
+    watcher.remove_from_blocklist(123, "ych")
+    watcher.check_subscriptions(submission)
+
+    stats = watcher.query_profiler.stats
+    assert set(stats.keys()) == {(KIND_SUBSCRIPTION, 123, "deer")}
+    assert stats[(KIND_SUBSCRIPTION, 123, "deer")].checks == 2
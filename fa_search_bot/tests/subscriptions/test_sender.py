@@ -1,13 +1,19 @@
 from __future__ import annotations
 
+import asyncio
 from unittest import mock
 
 import pytest
 from telethon.errors import UserIsBlockedError, InputUserDeactivatedError
 
+from fa_search_bot.config import SubscriptionWatcherConfig
+from fa_search_bot.sites.submission_id import SubmissionID
+from fa_search_bot.subscriptions.sender import Sender
 from fa_search_bot.subscriptions.subscription import Subscription
 from fa_search_bot.subscriptions.subscription_watcher import SubscriptionWatcher
+from fa_search_bot.subscriptions.wait_pool import SubmissionCheckState
 from fa_search_bot.tests.util.mock_export_api import MockExportAPI
+from fa_search_bot.tests.util.mock_method import MockMethod, MockMultiMethod
 from fa_search_bot.tests.util.mock_submission_cache import MockSubmissionCache
 from fa_search_bot.tests.util.submission_builder import SubmissionBuilder
 
@@ -153,3 +159,126 @@ async def test_send_updates__blocked_pauses_other_subs(mock_client):
     assert subscription1.paused
     assert subscription2.paused
     assert not subscription3.paused
+
+
+def _sender_with_subscriptions(*subscriptions: Subscription) -> Sender:
+    config = SubscriptionWatcherConfig(True, 1, 1)
+    watcher = SubscriptionWatcher(config, MockExportAPI(), mock.Mock(), MockSubmissionCache())
+    watcher.subscriptions = subscriptions
+    return Sender(watcher)
+
+
+def _matched_state(sender: Sender, subscriptions: list[Subscription]) -> SubmissionCheckState:
+    submission = SubmissionBuilder(title="deer", description="", keywords=[]).build_full_submission()
+    return SubmissionCheckState(
+        SubmissionID("fa", submission.submission_id),
+        full_data=submission,
+        matching_subscriptions=subscriptions,
+        matched_version=sender.watcher.subscriptions.version,
+    )
+
+
+@pytest.mark.asyncio
+async def test_send_updates__reuses_matches_when_unchanged():
+    subscription = Subscription("deer", 12345)
+    sender = _sender_with_subscriptions(subscription)
+    state = _matched_state(sender, [subscription])
+    check = MockMethod([])
+    send = MockMultiMethod()
+
+    with mock.patch.object(sender.watcher, "check_subscriptions", check.call):
+        with mock.patch.object(sender, "_try_send_subscription_update", send.async_call):
+            await sender._send_updates(state)
+
+    assert not check.called
+    assert send.calls == 1
+    assert send.args[0][2] == 12345
+    assert subscription.latest_update is not None
+
+
+@pytest.mark.asyncio
+async def test_send_updates__rematches_after_pause():
+    subscription1 = Subscription("deer", 12345)
+    subscription2 = Subscription("deer", 54321)
+    sender = _sender_with_subscriptions(subscription1, subscription2)
+    state = _matched_state(sender, [subscription1, subscription2])
+    send = MockMultiMethod()
+
+    subscription1.paused = True
+    with mock.patch.object(sender, "_try_send_subscription_update", send.async_call):
+        await sender._send_updates(state)
+
+    assert send.calls == 1
+    assert send.args[0][2] == 54321
+
+
+@pytest.mark.asyncio
+async def test_send_updates__rematches_after_removal_and_blocklist_change():
+    subscription1 = Subscription("deer", 12345)
+    subscription2 = Subscription("deer", 54321)
+    sender = _sender_with_subscriptions(subscription1, subscription2)
+    state = _matched_state(sender, [subscription1, subscription2])
+    send = MockMultiMethod()
+
+    sender.watcher.subscriptions.remove(subscription1)
+    sender.watcher.add_to_blocklist(54321, "deer")
+    with mock.patch.object(sender, "_try_send_subscription_update", send.async_call):
+        await sender._send_updates(state)
+
+    assert send.calls == 0
+
+
+@pytest.mark.asyncio
+async def test_do_process__stop_interrupts_waiting():
+    sender = _sender_with_subscriptions()
+
+    with mock.patch.object(sender, "update_heartbeat"):
+        task = asyncio.ensure_future(sender.run())
+        await asyncio.sleep(0.01)
+        assert sender.running
+        sender.stop()
+        await asyncio.wait_for(task, 1)
+    assert not sender.running
+
+
+@pytest.mark.asyncio
+async def test_flood_wait__stop_interrupts_waiting():
+    sender = _sender_with_subscriptions()
+    sender.running = True
+
+    task = asyncio.ensure_future(sender._flood_wait(600))
+    await asyncio.sleep(0.01)
+    assert not task.done()
+    sender.stop()
+    await asyncio.wait_for(task, 1)
+
+
+@pytest.mark.asyncio
+async def test_revert_last_attempt__state_sent_again():
+    subscription = Subscription("deer", 12345)
+    sender = _sender_with_subscriptions(subscription)
+    sender.watcher.save_to_json = MockMethod().call
+    state = _matched_state(sender, [subscription])
+    wait_pool = sender.watcher.wait_pool
+    await wait_pool.add_sub_id(state.sub_id)
+    await wait_pool.get_next_for_data_fetch()
+    await wait_pool.set_fetched_data(state.sub_id, state.full_data, [subscription], state.matched_version)
+    await wait_pool.set_uploaded(state.sub_id, mock.Mock())
+    send = MockMultiMethod([RuntimeError("Send failed"), None])
+
+    async def send_update(*args):
+        result = send.call(*args)
+        if isinstance(result, Exception):
+            raise result
+
+    with mock.patch.object(sender, "_send_subscription_update", send_update):
+        with pytest.raises(RuntimeError):
+            await sender.do_process()
+        await sender.revert_last_attempt()
+        assert wait_pool.size() == 1
+        await sender.do_process()
+
+    assert send.calls == 2
+    assert send.args[1][2] == 12345
+    assert wait_pool.size() == 0
+    assert wait_pool._states_in_progress() == []
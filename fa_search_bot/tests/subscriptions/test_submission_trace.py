@@ -0,0 +1,110 @@
+import datetime
+import logging
+from unittest import mock
+
+import pytest
+from prometheus_client import REGISTRY
+
+from fa_search_bot.sites.submission_id import SubmissionID
+from fa_search_bot.subscriptions.submission_trace import (
+    STAGE_FETCH_END,
+    STAGE_FETCH_START,
+    STAGE_GATHERED,
+    STAGE_MATCHED,
+    STAGE_SENT,
+    STAGE_UPLOAD_END,
+    STAGE_UPLOAD_START,
+    SubmissionTrace,
+)
+from fa_search_bot.subscriptions.wait_pool import WaitPool
+from fa_search_bot.tests.util.submission_builder import SubmissionBuilder
+
+
+def _sample(name: str, labels=None) -> float:
+    return REGISTRY.get_sample_value(name, labels or {}) or 0
+
+
+def _posted_ago(seconds: float) -> datetime.datetime:
+    return datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(seconds=seconds)
+
+
+@pytest.mark.asyncio
+async def test_wait_pool__traces_each_step():
+    sub_id = SubmissionID("fa", "1")
+    full_data = SubmissionBuilder(submission_id="1").build_full_submission()
+    sent_before = _sample("fasearchbot_submissiontrace_stage_seconds_count", {"stage": STAGE_SENT})
+    lag_before = _sample("fasearchbot_submissiontrace_total_lag_seconds_count")
+
+    pool = WaitPool()
+    await pool.add_sub_id(sub_id)
+    await pool.get_next_for_data_fetch()
+    pool.mark_stage(sub_id, STAGE_FETCH_START)
+    pool.mark_stage(sub_id, STAGE_FETCH_END)
+    pool.mark_stage(sub_id, STAGE_MATCHED)
+    await pool.set_fetched_data(sub_id, full_data)
+    await pool.get_next_for_media_upload()
+    await pool.set_uploaded(sub_id, mock.Mock())
+    state = await pool.pop_next_ready_to_send()
+    await pool.set_sent_to(state, 12345)
+    await pool.set_sent_to(state, 67890)
+    await pool.finish_sending(state)
+
+    stages = [stage for stage, _ in state.trace.steps]
+    assert stages == [
+        STAGE_GATHERED,
+        STAGE_FETCH_START,
+        STAGE_FETCH_END,
+        STAGE_MATCHED,
+        STAGE_UPLOAD_START,
+        STAGE_UPLOAD_END,
+        STAGE_SENT,
+        STAGE_SENT,
+    ]
+    timestamps = [timestamp for _, timestamp in state.trace.steps]
+    assert timestamps == sorted(timestamps)
+    assert _sample("fasearchbot_submissiontrace_stage_seconds_count", {"stage": STAGE_SENT}) == sent_before + 2
+    assert _sample("fasearchbot_submissiontrace_total_lag_seconds_count") == lag_before + 2
+
+
+def test_mark_sent__observes_lag_since_posted():
+    trace = SubmissionTrace()
+    trace.mark(STAGE_GATHERED)
+    lag_sum_before = _sample("fasearchbot_submissiontrace_total_lag_seconds_sum")
+
+    trace.mark_sent(_posted_ago(100))
+
+    lag = _sample("fasearchbot_submissiontrace_total_lag_seconds_sum") - lag_sum_before
+    assert 100 <= lag < 110
+
+
+def test_finish__logs_sampled_outliers(caplog):
+    trace = SubmissionTrace()
+    trace.mark(STAGE_GATHERED)
+    trace.mark_sent(_posted_ago(2 * SubmissionTrace.OUTLIER_SECONDS))
+    outliers_before = _sample("fasearchbot_submissiontrace_outliers_total")
+
+    with caplog.at_level(logging.INFO, "fa_search_bot.subscriptions.submission_trace"):
+        with mock.patch("fa_search_bot.subscriptions.submission_trace.random.random", return_value=0.99):
+            trace.finish(SubmissionID("fa", "1"), _posted_ago(2 * SubmissionTrace.OUTLIER_SECONDS))
+        assert "Slow submission trace" not in caplog.text
+        with mock.patch("fa_search_bot.subscriptions.submission_trace.random.random", return_value=0):
+            trace.finish(SubmissionID("fa", "1"), _posted_ago(2 * SubmissionTrace.OUTLIER_SECONDS))
+
+    assert "Slow submission trace" in caplog.text
+    assert '"sub_id": "fa:1"' in caplog.text
+    assert '"stage": "sent"' in caplog.text
+    assert _sample("fasearchbot_submissiontrace_outliers_total") == outliers_before + 2
+
+
+def test_finish__ignores_quick_submissions(caplog):
+    trace = SubmissionTrace()
+    trace.mark(STAGE_GATHERED)
+    trace.mark_sent(_posted_ago(10))
+    outliers_before = _sample("fasearchbot_submissiontrace_outliers_total")
+
+    with caplog.at_level(logging.INFO, "fa_search_bot.subscriptions.submission_trace"):
+        with mock.patch("fa_search_bot.subscriptions.submission_trace.random.random", return_value=0):
+            trace.finish(SubmissionID("fa", "1"), _posted_ago(10))
+
+    assert "Slow submission trace" not in caplog.text
+    assert _sample("fasearchbot_submissiontrace_outliers_total") == outliers_before
@@ -805,6 +805,14 @@ def test_from_json_new_format():
     assert sub.latest_update == datetime.datetime(2019, 9, 17, 21, 14, 7, tzinfo=datetime.timezone.utc)
 
 
+def test_from_json_new_format__many_wildcards():
+    # Saved subscriptions are loaded even if they have more wildcards than new subscriptions are allowed
+    data = {"query": "a*" * 20, "latest_update": None}
+
+    sub = Subscription.from_json_new_format(data, 17839)
+    assert sub.query_str == "a*" * 20
+
+
 def test_from_json_paused_unset():
     data = {"query": "example query", "latest_update": "2020-11-01T22:16:26Z"}
 
@@ -0,0 +1,330 @@
+from fa_search_bot.sites.furaffinity.fa_submission import FAUser, Rating
+from fa_search_bot.subscriptions.query_parser import (
+    TERM_PREFIX,
+    TERM_RATING,
+    TERM_SUFFIX,
+    TERM_WORD,
+    AnyField,
+    ArtistField,
+    IndexTerm,
+    TitleField,
+    parse_query,
+    phrase_registry,
+    prefix_registry,
+)
+from fa_search_bot.subscriptions.subscription import Subscription
+from fa_search_bot.subscriptions.subscription_index import SubscriptionIndex
+from fa_search_bot.subscriptions.subscription_set import SubscriptionSet
+from fa_search_bot.tests.util.submission_builder import SubmissionBuilder
+
+QUERIES = [
+    "deer",
+    "deer dog",
+    "deer or dog",
+    "-deer",
+    "deer -dog",
+    "rating:general",
+    "rating:adult deer",
+    "title:deer",
+    "artist:fender",
+    "@artist fender",
+    "deer*",
+    "*deer",
+    "d*r",
+    '"deer dog"',
+    '"deer-dog"',
+    "deer except deer-dog",
+    "deer* except (deers or deerly)",
+    "keyword:deer*",
+    "title:(deer except deer-dog)",
+    "(deer or -dog) rating:mature",
+    'description:"big deer"',
+    "fen*",
+]
+
+
+def _submissions():
+    return [
+        SubmissionBuilder(
+            title="Deer and dog",
+            description="a big deer with a dog, deer-dog",
+            keywords=["deer", "dog", "deerdog"],
+            rating=Rating.GENERAL,
+            author=FAUser("Fender", "fender"),
+        ).build_full_submission(),
+        SubmissionBuilder(
+            title="Just a dog",
+            description="This is a dog, not a cervine",
+            keywords=["dog", "deers"],
+            rating=Rating.MATURE,
+        ).build_full_submission(),
+        SubmissionBuilder(
+            title="Reindeer",
+            description="deerly beloved, big Deer",
+            keywords=["reindeer", "winter"],
+            rating=Rating.ADULT,
+        ).build_full_submission(),
+        SubmissionBuilder(
+            title="Nothing",
+            description="Nothing to see here",
+            keywords=[],
+            rating=Rating.ADULT,
+            author=FAUser("Fen.der", "fender2"),
+        ).build_full_submission(),
+    ]
+
+
+def test_index_terms__word():
+    assert parse_query("Deer").index_terms() == {IndexTerm(TERM_WORD, AnyField, "deer")}
+    assert parse_query("title:deer").index_terms() == {IndexTerm(TERM_WORD, TitleField, "deer")}
+    assert parse_query("artist:fender").index_terms() == {IndexTerm(TERM_WORD, ArtistField, "fender")}
+
+
+def test_index_terms__prefix_and_suffix():
+    assert parse_query("deer*").index_terms() == {IndexTerm(TERM_PREFIX, AnyField, "deer")}
+    assert parse_query("*deer").index_terms() == {IndexTerm(TERM_SUFFIX, AnyField, "deer")}
+
+
+def test_index_terms__rating():
+    assert parse_query("rating:general").index_terms() == {IndexTerm(TERM_RATING, None, Rating.GENERAL)}
+
+
+def test_index_terms__phrase_uses_longest_word():
+    assert parse_query('"a big deer"').index_terms() == {IndexTerm(TERM_WORD, AnyField, "deer")}
+
+
+def test_index_terms__and_prefers_words_to_ratings():
+    assert parse_query("rating:general deer").index_terms() == {IndexTerm(TERM_WORD, AnyField, "deer")}
+
+
+def test_index_terms__or_combines_terms():
+    assert parse_query("deer or dog").index_terms() == {
+        IndexTerm(TERM_WORD, AnyField, "deer"),
+        IndexTerm(TERM_WORD, AnyField, "dog"),
+    }
+
+
+def test_index_terms__unindexable():
+    assert parse_query("-deer").index_terms() is None
+    assert parse_query("deer or -dog").index_terms() is None
+    assert parse_query("d*r").index_terms() is None
+
+
+def test_index_terms__exception_uses_word():
+    assert parse_query("deer except deer-dog").index_terms() == {IndexTerm(TERM_WORD, AnyField, "deer")}
+
+
+def test_candidates__only_returns_possible_matches():
+    index = SubscriptionIndex()
+    deer = Subscription("deer", 123)
+    dog = Subscription("dog", 123)
+    index.add(deer)
+    index.add(dog)
+    submission = SubmissionBuilder(title="deer", description="", keywords=[]).build_full_submission()
+
+    assert index.candidates(submission) == {deer}
+
+
+def test_candidates__unindexed_always_returned():
+    index = SubscriptionIndex()
+    not_deer = Subscription("-deer", 123)
+    index.add(not_deer)
+    submission = SubmissionBuilder(title="deer", description="", keywords=[]).build_full_submission()
+
+    assert index.candidates(submission) == {not_deer}
+
+
+def test_candidates__prefix_does_not_return_exact_word():
+    index = SubscriptionIndex()
+    prefix = Subscription("deer*", 123)
+    index.add(prefix)
+    exact = SubmissionBuilder(title="deer", description="", keywords=[]).build_full_submission()
+    longer = SubmissionBuilder(title="deers", description="", keywords=[]).build_full_submission()
+
+    assert index.candidates(exact) == set()
+    assert index.candidates(longer) == {prefix}
+
+
+def test_candidates__removed_subscription():
+    index = SubscriptionIndex()
+    deer = Subscription("deer", 123)
+    index.add(deer)
+    index.remove(deer)
+    submission = SubmissionBuilder(title="deer", description="", keywords=[]).build_full_submission()
+
+    assert index.candidates(submission) == set()
+    assert len(index) == 0
+
+
+def test_candidates__superset_of_matches():
+    index = SubscriptionIndex()
+    subscriptions = [Subscription(query, 123) for query in QUERIES]
+    for subscription in subscriptions:
+        index.add(subscription)
+
+    for submission in _submissions():
+        candidates = index.candidates(submission)
+        for subscription in subscriptions:
+            if subscription.query.matches_submission(submission):
+                assert subscription in candidates, subscription.query_str
+
+
+def test_candidates__case_folded_like_matching():
+    index = SubscriptionIndex()
+    # The long s matches an s case-insensitively, but does not lowercase to one, and the dotted capital I matches an i
+    # but lowercases to two characters
+    queries = ['"big star"', 'star except "star wars"', 'st* except "star wars"', '"istanbul"', '"\u0130stanbul"']
+    subscriptions = [Subscription(query, 123) for query in queries]
+    for subscription in subscriptions:
+        index.add(subscription)
+    submission = SubmissionBuilder(
+        title="a big \u017ftar", description="\u0130stanbul", keywords=[]
+    ).build_full_submission()
+
+    candidates = index.candidates(submission)
+
+    for subscription in subscriptions:
+        assert subscription.query.matches_submission(submission), subscription.query_str
+        assert subscription in candidates, subscription.query_str
+
+
+def test_subscription_set__pause_and_resume_update_index():
+    subs = SubscriptionSet()
+    deer = Subscription("deer", 123)
+    subs.add(deer)
+    submission = SubmissionBuilder(title="deer", description="", keywords=[]).build_full_submission()
+
+    deer.paused = True
+
+    assert deer in subs
+    assert subs.candidates(submission) == set()
+
+    deer.paused = False
+
+    assert subs.candidates(submission) == {deer}
+
+
+def test_subscription_set__add_paused_subscription():
+    subs = SubscriptionSet()
+    deer = Subscription("deer", 123)
+    deer.paused = True
+    subs.add(deer)
+    submission = SubmissionBuilder(title="deer", description="", keywords=[]).build_full_submission()
+
+    assert subs.candidates(submission) == set()
+
+
+def test_subscription_set__remove_equal_subscription():
+    subs = SubscriptionSet()
+    deer = Subscription("deer", 123)
+    subs.add(deer)
+    submission = SubmissionBuilder(title="deer", description="", keywords=[]).build_full_submission()
+
+    subs.remove(Subscription("DEER", 123))
+
+    assert len(subs) == 0
+    assert subs.candidates(submission) == set()
+    assert deer.subscription_set is None
+
+
+def test_subscription_set__for_destination_and_get_by_query():
+    deer = Subscription("Deer", 123)
+    dog = Subscription("dog", 123)
+    other = Subscription("deer", 456)
+    subs = SubscriptionSet([deer, dog, other])
+
+    assert set(subs.for_destination(123)) == {deer, dog}
+    assert subs.for_destination(456) == [other]
+    assert subs.for_destination(789) == []
+    assert subs.get_by_query(123, "DEER") is deer
+    assert subs.get_by_query(456, "dog") is None
+
+    subs.remove(Subscription("deer", 123))
+
+    assert subs.for_destination(123) == [dog]
+    assert subs.get_by_query(123, "deer") is None
+    subs.remove(dog)
+    assert subs.for_destination(123) == []
+    assert subs.count_destinations() == 1
+
+
+def test_subscription_set__counts_follow_pauses():
+    deer = Subscription("deer", 123)
+    dog = Subscription("dog", 123)
+    dog.paused = True
+    other = Subscription("deer", 456)
+    subs = SubscriptionSet([deer, dog, other])
+
+    assert subs.count_active() == 2
+    assert subs.count_paused() == 1
+    assert subs.count_active(123) == 1
+    assert subs.count_paused(123) == 1
+    assert subs.count_destinations() == 2
+    assert subs.count_destinations(active_only=True) == 2
+
+    other.paused = True
+    dog.paused = False
+
+    assert subs.count_active() == 2
+    assert subs.count_active(123) == 2
+    assert subs.count_paused(456) == 1
+    assert subs.count_destinations(active_only=True) == 1
+
+    subs.discard(deer)
+
+    assert subs.count_active() == 1
+    assert subs.count_paused() == 1
+    assert subs.count_active(123) == 1
+
+
+def test_subscription_set__removed_subscription_pause_ignored():
+    deer = Subscription("deer", 123)
+    subs = SubscriptionSet([deer])
+    subs.remove(deer)
+    subs.add(Subscription("deer", 123))
+
+    deer.paused = True
+
+    assert subs.count_active() == 1
+    assert subs.count_paused() == 0
+
+
+def test_subscription_set__version_changes_on_mutation():
+    deer = Subscription("deer", 123)
+    subs = SubscriptionSet()
+    versions = [subs.version]
+
+    subs.add(deer)
+    versions.append(subs.version)
+    subs.add(Subscription("DEER", 123))
+    assert subs.version == versions[-1]
+    deer.paused = True
+    versions.append(subs.version)
+    deer.paused = True
+    assert subs.version == versions[-1]
+    subs.mark_changed()
+    versions.append(subs.version)
+    subs.discard(deer)
+    versions.append(subs.version)
+    versions.append(SubscriptionSet().version)
+
+    assert len(set(versions)) == len(versions)
+
+
+def test_subscription_set__clear_unregisters_queries():
+    deer = Subscription('"setclear phrase" setclearprefix*', 123)
+    subs = SubscriptionSet([deer])
+    assert "setclear phrase" in phrase_registry
+    assert "setclearprefix" in prefix_registry
+    version = subs.version
+
+    subs.clear()
+
+    assert "setclear phrase" not in phrase_registry
+    assert "setclearprefix" not in prefix_registry
+    assert len(subs) == 0
+    assert len(subs.index) == 0
+    assert subs.count_destinations() == 0
+    assert subs.count_active() == 0
+    assert deer.subscription_set is None
+    assert subs.version != version
@@ -2,18 +2,23 @@ from __future__ import annotations
 
 import asyncio
 import datetime
+import gc
 import json
 import os
+import weakref
 from typing import TYPE_CHECKING
+from unittest import mock
 
 import pytest
 
+from fa_search_bot.config import SubscriptionWatcherConfig
+from fa_search_bot.sites.furaffinity.fa_submission import Rating
 from fa_search_bot.sites.submission_id import SubmissionID
-from fa_search_bot.subscriptions.query_parser import AndQuery, NotQuery, WordQuery
+from fa_search_bot.subscriptions.query_parser import AndQuery, NotQuery, WordQuery, phrase_registry
 from fa_search_bot.subscriptions.subscription_watcher import SubscriptionWatcher
 from fa_search_bot.subscriptions.subscription import Subscription
 from fa_search_bot.tests.util.mock_export_api import MockExportAPI, MockSubmission
-from fa_search_bot.tests.util.mock_method import MockMethod
+from fa_search_bot.tests.util.mock_method import MockMethod, MockMultiMethod
 from fa_search_bot.tests.util.mock_submission_cache import MockSubmissionCache
 from fa_search_bot.tests.util.submission_builder import SubmissionBuilder
 
@@ -47,6 +52,12 @@ async def watcher_killer(watcher: SubscriptionWatcher):
     watcher.running = False
 
 
+def _watcher() -> SubscriptionWatcher:
+    # A plain mock client, as the mock_client fixture's Future needs an event loop to exist
+    config = SubscriptionWatcherConfig(True, 1, 1)
+    return SubscriptionWatcher(config, MockExportAPI(), mock.Mock(), MockSubmissionCache())
+
+
 def test_init(mock_client):
     api = MockExportAPI()
     cache = MockSubmissionCache()
@@ -608,3 +619,156 @@ def test_to_json_and_back(mock_client):
     finally:
         SubscriptionWatcher.FILENAME = old_filename
         os.remove(test_watcher_file)
+
+
+def test_check_subscriptions__applies_destination_blocklist():
+    watcher = _watcher()
+    sub1 = Subscription("deer", 123)
+    sub2 = Subscription("deer rating:general", 123)
+    sub3 = Subscription("deer", 456)
+    watcher.subscriptions.add(sub1)
+    watcher.subscriptions.add(sub2)
+    watcher.subscriptions.add(sub3)
+    watcher.add_to_blocklist(123, "ych")
+    submission = SubmissionBuilder(title="deer ych", description="", keywords=[]).build_full_submission()
+
+    matches = watcher.check_subscriptions(submission)
+
+    assert matches == [sub3]
+
+
+def test_check_subscriptions__blocklist_checked_once_per_destination():
+    watcher = _watcher()
+    watcher.subscriptions.add(Subscription("deer", 123))
+    watcher.subscriptions.add(Subscription("deer rating:general", 123))
+    watcher.subscriptions.add(Subscription("dog", 456))
+    watcher.add_to_blocklist(123, "ych")
+    watcher.add_to_blocklist(456, "ych")
+    checks = MockMultiMethod([True])
+    other_checks = MockMultiMethod([True])
+    watcher.get_destination_blocklist_matcher(123)
+    watcher.get_destination_blocklist_matcher(456)
+    watcher.destination_blocklist_matchers[123] = checks.call
+    watcher.destination_blocklist_matchers[456] = other_checks.call
+    submission = SubmissionBuilder(
+        title="deer", description="", keywords=[], rating=Rating.GENERAL
+    ).build_full_submission()
+
+    matches = watcher.check_subscriptions(submission)
+
+    assert len(matches) == 2
+    assert checks.calls == 1
+    assert other_checks.calls == 0
+
+
+def test_check_subscriptions__submissions_freed_after_checking():
+    watcher = _watcher()
+    watcher.subscriptions.add(Subscription("deer", 123))
+    watcher.add_to_blocklist(123, "ych")
+    submissions = [
+        SubmissionBuilder(title="deer", description="", keywords=[]).build_full_submission() for _ in range(10)
+    ]
+    refs = [weakref.ref(submission) for submission in submissions]
+
+    watcher.check_subscriptions(submissions[0])
+    watcher.check_subscriptions_batch(submissions[1:])
+    del submissions
+    gc.collect()
+
+    assert all(ref() is None for ref in refs)
+
+
+def test_check_subscriptions_batch__matches_each_submission():
+    watcher = _watcher()
+    sub1 = Subscription("deer", 123)
+    sub2 = Subscription("deer rating:general", 123)
+    sub3 = Subscription("deer", 456)
+    sub4 = Subscription("dog", 456)
+    sub5 = Subscription("dog", 789)
+    sub5.paused = True
+    for sub in [sub1, sub2, sub3, sub4, sub5]:
+        watcher.subscriptions.add(sub)
+    watcher.add_to_blocklist(123, "ych")
+    submissions = [
+        SubmissionBuilder(title="deer ych", description="", keywords=[]).build_full_submission(),
+        SubmissionBuilder(title="deer", description="", keywords=[], rating=Rating.GENERAL).build_full_submission(),
+        SubmissionBuilder(title="dog", description="", keywords=[]).build_full_submission(),
+        SubmissionBuilder(title="fox", description="", keywords=[]).build_full_submission(),
+    ]
+
+    match_matrix = watcher.check_subscriptions_batch(submissions)
+
+    assert [set(matches) for matches in match_matrix] == [{sub3}, {sub1, sub2, sub3}, {sub4}, set()]
+    for submission, matches in zip(submissions, match_matrix):
+        assert set(matches) == set(watcher.check_subscriptions(submission))
+
+
+def test_check_subscriptions_batch__blocklist_checked_once_per_submission():
+    watcher = _watcher()
+    watcher.subscriptions.add(Subscription("deer", 123))
+    watcher.subscriptions.add(Subscription("deer rating:general", 123))
+    watcher.add_to_blocklist(123, "ych")
+    blocklist_query = watcher.get_destination_blocklist_query(123)
+    checks = MockMultiMethod([True, True])
+    blocklist_query.batch_matches = lambda batch, mask: checks.call(mask) and mask
+    submissions = [
+        SubmissionBuilder(title="deer", description="", keywords=[], rating=Rating.GENERAL).build_full_submission(),
+        SubmissionBuilder(title="deer", description="", keywords=[], rating=Rating.GENERAL).build_full_submission(),
+    ]
+
+    match_matrix = watcher.check_subscriptions_batch(submissions)
+
+    assert [len(matches) for matches in match_matrix] == [2, 2]
+    assert checks.calls == 1
+
+
+def test_get_destination_blocklist_query__rebuilt_on_change():
+    watcher = _watcher()
+    assert watcher.get_destination_blocklist_query(123) is None
+
+    watcher.add_to_blocklist(123, "ych")
+    query = watcher.get_destination_blocklist_query(123)
+
+    assert query == NotQuery(WordQuery("ych"))
+    assert watcher.get_destination_blocklist_query(123) is query
+
+    watcher.remove_from_blocklist(123, "ych")
+
+    assert watcher.get_destination_blocklist_query(123) is None
+
+
+def test_get_destination_blocklist_query__migrate_chat():
+    watcher = _watcher()
+    watcher.save_to_json = MockMethod().call
+    watcher.add_to_blocklist(123, "ych")
+    watcher.add_to_blocklist(456, "deer")
+    assert watcher.get_destination_blocklist_query(123) is not None
+    assert watcher.get_destination_blocklist_query(456) is not None
+
+    watcher.migrate_chat(123, 456)
+
+    assert watcher.get_destination_blocklist_query(123) is None
+    assert watcher.get_destination_blocklist_query(456) in [
+        AndQuery([NotQuery(WordQuery("ych")), NotQuery(WordQuery("deer"))]),
+        AndQuery([NotQuery(WordQuery("deer")), NotQuery(WordQuery("ych"))]),
+    ]
+
+
+def test_subscriptions_setter__unregisters_old_queries():
+    watcher = _watcher()
+    old_sub = Subscription('"setter old phrase"', 123)
+    kept_sub = Subscription('"setter kept phrase"', 123)
+    watcher.subscriptions = [old_sub, kept_sub]
+
+    watcher.subscriptions = [kept_sub, Subscription('"setter new phrase"', 456)]
+
+    assert "setter old phrase" not in phrase_registry
+    assert "setter kept phrase" in phrase_registry
+    assert "setter new phrase" in phrase_registry
+    assert old_sub.subscription_set is None
+    assert kept_sub.subscription_set is watcher.subscriptions
+    watcher.subscriptions = watcher.subscriptions
+    assert "setter kept phrase" in phrase_registry
+    watcher.subscriptions = []
+    assert "setter kept phrase" not in phrase_registry
+    assert "setter new phrase" not in phrase_registry
@@ -0,0 +1,239 @@
+import asyncio
+import random
+from asyncio import QueueEmpty
+from unittest import mock
+
+import pytest
+from prometheus_client import REGISTRY
+
+from fa_search_bot.sites.submission_id import SubmissionID
+from fa_search_bot.subscriptions.wait_pool import WaitPool
+from fa_search_bot.tests.util.submission_builder import SubmissionBuilder
+
+
+def _sub_id(number: int) -> SubmissionID:
+    return SubmissionID("fa", str(number))
+
+
+def _full_data(number: int):
+    return SubmissionBuilder(submission_id=str(number)).build_full_submission()
+
+
+async def _add_fetched(pool: WaitPool, *numbers: int) -> None:
+    for number in numbers:
+        await pool.add_sub_id(_sub_id(number))
+        await pool.get_next_for_data_fetch()
+        await pool.set_fetched_data(_sub_id(number), _full_data(number))
+
+
+@pytest.mark.asyncio
+async def test_get_next_for_media_upload__lowest_first_and_not_repeated():
+    pool = WaitPool()
+    await _add_fetched(pool, 30, 10, 20)
+
+    uploads = [(await pool.get_next_for_media_upload()).submission_id for _ in range(3)]
+    with pytest.raises(QueueEmpty):
+        await pool.get_next_for_media_upload()
+
+    assert uploads == ["10", "20", "30"]
+    # States being uploaded are still in the upload queue until they are uploaded, but no longer take up capacity
+    assert pool.qsize_upload() == 3
+    assert pool.qsize_waiting_for_upload() == 0
+
+
+@pytest.mark.asyncio
+async def test_get_next_for_media_upload__skips_removed_and_reverted():
+    pool = WaitPool()
+    await _add_fetched(pool, 1, 2, 3)
+    await pool.remove_state(_sub_id(1))
+    await pool.revert_data_fetch(_sub_id(2))
+
+    next_upload = await pool.get_next_for_media_upload()
+
+    assert next_upload.submission_id == "3"
+    assert pool.qsize_upload() == 1
+
+
+@pytest.mark.asyncio
+async def test_pop_next_ready_to_send__waits_for_lowest():
+    pool = WaitPool()
+    await _add_fetched(pool, 1, 2)
+    await pool.set_uploaded(_sub_id(2), mock.Mock())
+
+    first = await pool.pop_next_ready_to_send()
+    await pool.set_cached(_sub_id(1), mock.Mock())
+    second = await pool.pop_next_ready_to_send()
+    third = await pool.pop_next_ready_to_send()
+    fourth = await pool.pop_next_ready_to_send()
+
+    assert first is None
+    assert second.sub_id == _sub_id(1)
+    assert third.sub_id == _sub_id(2)
+    assert fourth is None
+    assert pool.size() == 0
+    assert pool.qsize_upload() == 0
+
+
+@pytest.mark.asyncio
+async def test_return_populated_state__sent_again_in_order():
+    pool = WaitPool()
+    await _add_fetched(pool, 5, 6)
+    await pool.set_uploaded(_sub_id(5), mock.Mock())
+    state = await pool.pop_next_ready_to_send()
+
+    await pool.return_populated_state(state)
+    state = await pool.pop_next_ready_to_send()
+
+    assert state.sub_id == _sub_id(5)
+
+
+@pytest.mark.asyncio
+async def test_state_heap__stays_compact():
+    pool = WaitPool()
+    await _add_fetched(pool, 1)
+    await pool.set_uploaded(_sub_id(1), mock.Mock())
+
+    for _ in range(1000):
+        state = await pool.pop_next_ready_to_send()
+        await pool.return_populated_state(state)
+        await pool.add_sub_id(_sub_id(2))
+
+    assert len(pool._state_heap) <= 2 * pool.size() + 100
+
+
+@pytest.mark.asyncio
+async def test_counts_match_states__random_operations():
+    rand = random.Random(1234)
+    pool = WaitPool()
+
+    for _ in range(2000):
+        number = rand.randint(1, 30)
+        sub_id = _sub_id(number)
+        action = rand.choice(["add", "fetch", "upload", "cache", "revert", "remove", "next_upload", "send"])
+        if action == "add":
+            await pool.add_sub_id(sub_id)
+        elif action == "fetch":
+            await pool.set_fetched_data(sub_id, _full_data(number))
+        elif action == "upload":
+            await pool.set_uploaded(sub_id, mock.Mock())
+        elif action == "cache":
+            await pool.set_cached(sub_id, mock.Mock())
+        elif action == "revert":
+            await pool.revert_data_fetch(sub_id)
+        elif action == "remove" and sub_id in pool.submission_state:
+            await pool.remove_state(sub_id)
+        elif action == "next_upload":
+            waiting = [
+                state.key()
+                for state in pool.submission_state.values()
+                if state.is_ready_for_media_upload() and not state.media_uploading
+            ]
+            if waiting:
+                assert int((await pool.get_next_for_media_upload()).submission_id) == min(waiting)
+            else:
+                with pytest.raises(QueueEmpty):
+                    await pool.get_next_for_media_upload()
+        elif action == "send":
+            lowest = min(pool.submission_state.values(), key=lambda state: state.key(), default=None)
+            state = await pool.pop_next_ready_to_send()
+            if lowest is not None and lowest.is_ready_to_send():
+                assert state is lowest
+            else:
+                assert state is None
+        assert pool.qsize_upload() == len(pool.states_ready_for_media_upload())
+        waiting_states = [state for state in pool.submission_state.values() if state.is_waiting_for_media_upload()]
+        assert pool.qsize_waiting_for_upload() == len(waiting_states)
+
+
+async def _wait_briefly(waiter) -> bool:
+    # Gives the waiter a chance to run, and says whether it has finished
+    task = asyncio.ensure_future(waiter)
+    for _ in range(5):
+        await asyncio.sleep(0)
+    if not task.done():
+        task.cancel()
+        return False
+    return True
+
+
+@pytest.mark.asyncio
+async def test_wait_for_data_fetch__wakes_on_new_id():
+    pool = WaitPool()
+    task = asyncio.ensure_future(pool.wait_for_data_fetch())
+    await asyncio.sleep(0)
+    assert not task.done()
+
+    await pool.add_sub_id(_sub_id(1))
+
+    await asyncio.wait_for(task, 1)
+
+
+@pytest.mark.asyncio
+async def test_wait_for_media_upload__wakes_on_fetched_data():
+    pool = WaitPool()
+    await pool.add_sub_id(_sub_id(1))
+    await pool.get_next_for_data_fetch()
+    task = asyncio.ensure_future(pool.wait_for_media_upload())
+    await asyncio.sleep(0)
+    assert not task.done()
+
+    await pool.set_fetched_data(_sub_id(1), _full_data(1))
+    await asyncio.wait_for(task, 1)
+
+    # Once its upload has started, other media fetchers should not be woken for it
+    await pool.get_next_for_media_upload()
+    assert not await _wait_briefly(pool.wait_for_media_upload())
+
+
+@pytest.mark.asyncio
+async def test_wait_for_ready_to_send__waits_for_lowest():
+    pool = WaitPool()
+    await _add_fetched(pool, 1, 2)
+    task = asyncio.ensure_future(pool.wait_for_ready_to_send())
+    await pool.set_uploaded(_sub_id(2), mock.Mock())
+    for _ in range(5):
+        await asyncio.sleep(0)
+    assert not task.done()
+
+    await pool.remove_state(_sub_id(1))
+
+    await asyncio.wait_for(task, 1)
+
+
+def _fetchers_blocked() -> float:
+    return REGISTRY.get_sample_value("fasearchbot_waitpool_fetchers_blocked_on_upload_capacity")
+
+
+@pytest.mark.asyncio
+async def test_set_fetched_data__waits_for_upload_capacity():
+    pool = WaitPool()
+    pool.MAX_READY_FOR_UPLOAD = 2
+    await _add_fetched(pool, 1, 2)
+    await pool.add_sub_id(_sub_id(3))
+    await pool.get_next_for_data_fetch()
+
+    task = asyncio.ensure_future(pool.set_fetched_data(_sub_id(3), _full_data(3)))
+
+    assert not await _wait_briefly(asyncio.shield(task))
+    assert _fetchers_blocked() == 1
+    # Starting an upload frees a slot
+    await pool.get_next_for_media_upload()
+    await asyncio.wait_for(task, 1)
+    assert pool.qsize_waiting_for_upload() == 2
+    assert _fetchers_blocked() == 0
+
+
+@pytest.mark.asyncio
+async def test_set_fetched_data__released_when_state_removed():
+    pool = WaitPool()
+    pool.MAX_READY_FOR_UPLOAD = 1
+    await _add_fetched(pool, 1)
+    await pool.add_sub_id(_sub_id(2))
+    await pool.get_next_for_data_fetch()
+
+    task = asyncio.ensure_future(pool.set_fetched_data(_sub_id(2), _full_data(2)))
+
+    assert not await _wait_briefly(asyncio.shield(task))
+    await pool.remove_state(_sub_id(1))
+    await asyncio.wait_for(task, 1)
+    assert pool.qsize_waiting_for_upload() == 1
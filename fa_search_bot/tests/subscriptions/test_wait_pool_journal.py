@@ -0,0 +1,240 @@
+import datetime
+from unittest import mock
+
+import pytest
+from telethon.tl.types import InputFile, InputMediaUploadedPhoto
+
+from fa_search_bot.sites.sendable import CaptionSettings, SendSettings, UploadedMedia
+from fa_search_bot.sites.sent_submission import SentSubmission
+from fa_search_bot.sites.submission_id import SubmissionID
+from fa_search_bot.subscriptions.wait_pool import WaitPool
+from fa_search_bot.subscriptions.wait_pool_journal import WaitPoolJournal
+from fa_search_bot.tests.util.submission_builder import SubmissionBuilder
+
+
+def _sub_id(number: int) -> SubmissionID:
+    return SubmissionID("fa", str(number))
+
+
+def _full_data(number: int):
+    return SubmissionBuilder(submission_id=str(number), keywords=["deer", "dragon"]).build_full_submission()
+
+
+async def _pool_with_journal(filename: str) -> WaitPool:
+    pool = WaitPool()
+    await pool.restore_from_journal(WaitPoolJournal(filename))
+    return pool
+
+
+async def _fetch(pool: WaitPool, number: int):
+    full_data = _full_data(number)
+    await pool.get_next_for_data_fetch()
+    await pool.set_fetched_data(_sub_id(number), full_data)
+    return full_data
+
+
+@pytest.mark.asyncio
+async def test_restore__keeps_progress(tmp_path):
+    filename = str(tmp_path / "journal.jsonl")
+    cache_entry = SentSubmission(_sub_id(3), True, 123, 456, "https://example.com/3.jpg", "caption", True)
+    uploaded = UploadedMedia(
+        _sub_id(4),
+        InputMediaUploadedPhoto(InputFile(789, 2, "4.jpg", "checksum")),
+        SendSettings(CaptionSettings(direct_link=True), force_doc=True),
+    )
+    pool = await _pool_with_journal(filename)
+    for number in range(1, 7):
+        await pool.add_sub_id(_sub_id(number))
+    await _fetch(pool, 1)
+    await pool.remove_state(_sub_id(1))
+    await _fetch(pool, 2)
+    full_data = await _fetch(pool, 3)
+    await pool.set_cached(_sub_id(3), cache_entry)
+    await _fetch(pool, 4)
+    await pool.set_uploaded(_sub_id(4), uploaded)
+    await pool.remove_state(_sub_id(2))
+    # Submission 3 is partly sent, and submission 5 was reverted after data was fetched
+    sending = await pool.pop_next_ready_to_send()
+    await pool.set_sent_to(sending, 12345)
+    await _fetch(pool, 5)
+    await pool.revert_data_fetch(_sub_id(5))
+    pool.journal.close()
+
+    pool = await _pool_with_journal(filename)
+    fetch_ids = []
+    while pool.qsize_fetch():
+        fetch_ids.append(await pool.get_next_for_data_fetch())
+    pool.journal.close()
+
+    assert set(pool.submission_state.keys()) == {_sub_id(3), _sub_id(4), _sub_id(5), _sub_id(6)}
+    # Only submissions without data need fetching again
+    assert set(fetch_ids) == {_sub_id(5), _sub_id(6)}
+    state3 = pool.submission_state[_sub_id(3)]
+    restored_data = state3.full_data
+    assert restored_data.submission_id == "3"
+    assert restored_data.title == full_data.title
+    assert restored_data.author.profile_name == full_data.author.profile_name
+    assert restored_data.description == full_data.description
+    assert restored_data.download_url == full_data.download_url
+    assert restored_data.keywords == ["deer", "dragon"]
+    assert restored_data.rating == full_data.rating
+    assert restored_data.posted_at == full_data.posted_at
+    assert state3.cache_entry == cache_entry
+    assert state3.sent_to == [12345]
+    state4 = pool.submission_state[_sub_id(4)]
+    assert state4.uploaded_media.sub_id == _sub_id(4)
+    assert state4.uploaded_media.settings == uploaded.settings
+    # Telegram objects do not compare equal, but their serialised forms can
+    assert bytes(state4.uploaded_media.media) == bytes(uploaded.media)
+    assert state4.sent_to == []
+    assert pool.submission_state[_sub_id(5)].full_data is None
+
+
+@pytest.mark.asyncio
+async def test_restore__finished_sending_not_restored(tmp_path):
+    filename = str(tmp_path / "journal.jsonl")
+    pool = await _pool_with_journal(filename)
+    await pool.add_sub_id(_sub_id(1))
+    await _fetch(pool, 1)
+    await pool.set_cached(_sub_id(1), SentSubmission(_sub_id(1), True, 1, 2, None, "caption", True))
+    state = await pool.pop_next_ready_to_send()
+    await pool.set_sent_to(state, 12345)
+    await pool.finish_sending(state)
+    pool.journal.close()
+
+    pool = await _pool_with_journal(filename)
+    pool.journal.close()
+
+    assert pool.size() == 0
+
+
+@pytest.mark.asyncio
+async def test_add_sub_id__does_not_reset_restored_state(tmp_path):
+    filename = str(tmp_path / "journal.jsonl")
+    pool = await _pool_with_journal(filename)
+    await pool.add_sub_id(_sub_id(1))
+    await _fetch(pool, 1)
+    pool.journal.close()
+
+    pool = await _pool_with_journal(filename)
+    # The submission ID gatherer will find the same submission again after restarting
+    await pool.add_sub_id(_sub_id(1))
+    await pool.add_sub_id(_sub_id(2))
+    pool.journal.close()
+
+    assert pool.submission_state[_sub_id(1)].full_data is not None
+    assert pool.qsize_fetch() == 1
+    assert pool.qsize_upload() == 1
+
+
+@pytest.mark.asyncio
+async def test_load__skips_cut_short_line(tmp_path):
+    filename = str(tmp_path / "journal.jsonl")
+    pool = await _pool_with_journal(filename)
+    await pool.add_sub_id(_sub_id(1))
+    await pool.add_sub_id(_sub_id(2))
+    pool.journal.close()
+    with open(filename, "a") as f:
+        f.write('{"type":"removed","id":"fa:')
+
+    states = WaitPoolJournal(filename).load()
+
+    assert [state.sub_id for state in states] == [_sub_id(1), _sub_id(2)]
+
+
+async def _pool_with_uploaded_media(filename: str, journal: WaitPoolJournal) -> WaitPool:
+    uploaded = UploadedMedia(
+        _sub_id(1),
+        InputMediaUploadedPhoto(InputFile(789, 2, "1.jpg", "checksum")),
+        SendSettings(CaptionSettings()),
+    )
+    pool = await _pool_with_journal(filename)
+    await pool.add_sub_id(_sub_id(1))
+    await _fetch(pool, 1)
+    await pool.set_uploaded(_sub_id(1), uploaded)
+    pool.journal.close()
+    pool = WaitPool()
+    await pool.restore_from_journal(journal)
+    return pool
+
+
+@pytest.mark.asyncio
+async def test_restore__uploaded_media_kept_through_snapshots(tmp_path):
+    filename = str(tmp_path / "journal.jsonl")
+    pool = await _pool_with_uploaded_media(filename, WaitPoolJournal(filename))
+    pool.journal.close()
+
+    # Restoring again reads the snapshot written by the previous restore
+    pool = await _pool_with_journal(filename)
+    pool.journal.close()
+
+    assert pool.submission_state[_sub_id(1)].uploaded_media is not None
+    assert pool.qsize_upload() == 0
+
+
+@pytest.mark.asyncio
+async def test_restore__expired_uploaded_media_uploaded_again(tmp_path):
+    filename = str(tmp_path / "journal.jsonl")
+    journal = WaitPoolJournal(filename)
+    journal.UPLOADED_MEDIA_MAX_AGE = datetime.timedelta(0)
+
+    pool = await _pool_with_uploaded_media(filename, journal)
+    pool.journal.close()
+
+    state = pool.submission_state[_sub_id(1)]
+    assert state.full_data is not None
+    assert state.uploaded_media is None
+    assert pool.qsize_upload() == 1
+    assert pool.qsize_fetch() == 0
+
+
+@pytest.mark.asyncio
+async def test_journal__written_after_lock_released(tmp_path):
+    filename = str(tmp_path / "journal.jsonl")
+    pool = await _pool_with_journal(filename)
+    flush = pool.journal.flush
+    locked_during_flush = []
+
+    def check_flush():
+        locked_during_flush.append(pool._lock.locked())
+        flush()
+
+    with mock.patch.object(pool.journal, "flush", check_flush):
+        await pool.add_sub_id(_sub_id(1))
+        await _fetch(pool, 1)
+        await pool.remove_state(_sub_id(1))
+        await pool.add_sub_id(_sub_id(2))
+
+    assert locked_during_flush == [False] * 4
+    # Each record is written out before the change returns
+    with open(filename) as f:
+        assert len(f.readlines()) == 5
+    pool.journal.close()
+    assert [state.sub_id for state in WaitPoolJournal(filename).load()] == [_sub_id(2)]
+
+
+def test_load__ignores_other_journal_version(tmp_path):
+    filename = tmp_path / "journal.jsonl"
+    filename.write_text('{"journal_version":0}\n{"type":"added","id":"fa:1"}\n')
+
+    assert WaitPoolJournal(str(filename)).load() == []
+
+
+@pytest.mark.asyncio
+async def test_journal__compacted_when_large(tmp_path):
+    filename = str(tmp_path / "journal.jsonl")
+    pool = await _pool_with_journal(filename)
+    pool.journal.COMPACT_MIN_RECORDS = 50
+
+    for _ in range(100):
+        await pool.add_sub_id(_sub_id(1))
+        await _fetch(pool, 1)
+    pool.journal.close()
+
+    with open(filename) as f:
+        lines = f.readlines()
+    assert len(lines) < 60
+    states = WaitPoolJournal(filename).load()
+    assert [state.sub_id for state in states] == [_sub_id(1)]
+    assert states[0].full_data is not None
+    assert pool.journal.record_count == len(lines) - 1
@@ -0,0 +1,137 @@
+import json
+import random
+
+import pytest
+
+from fa_search_bot.subscriptions.query_parser import (
+    MAX_WILDCARDS,
+    InvalidQueryException,
+    RegexQuery,
+    check_wildcard_limit,
+    parse_query,
+    parse_query_pyparsing,
+    query_from_data,
+)
+
+
+def linear_wildcard(word: str):
+    query = RegexQuery.from_string_with_asterisks(word)
+    wildcard = query.wildcard[1]
+    # Never hand over to the regex, so that the linear matcher can be compared against it
+    wildcard.regex_max_length = -1
+    return query, wildcard
+
+
+@pytest.mark.parametrize(
+    "word, text",
+    [
+        ("a*b", "ab acb a-b axxb"),
+        ("a*b*c", "abc aXbYc aXbYbZc"),
+        ("*a*", "a ba bab a-b"),
+        ("*a*a*", "aaa aaaa, banana"),
+        ("a*", "a ab abc, ab-cd"),
+        ("*b", "b ab cab, a.b"),
+        ("a*a", "aa aaa aaaa aaaaa"),
+        ("a.*b", "a.b a.xb a. xb"),
+        ("ab*ba", "aba abba abxba ababa"),
+        ("DEER*dog", "Deerxdog deerXDOG deer dog"),
+        ("i*s", "İxs ıxſ Ixs"),
+    ],
+)
+def test_wildcard__matches_regex(word, text):
+    query, wildcard = linear_wildcard(word)
+
+    assert wildcard.search(text) == (query.pattern.search(text) is not None)
+    assert wildcard.spans(text) == [m.span() for m in query.pattern.finditer(text)]
+
+
+def test_wildcard__matches_regex__random():
+    rand = random.Random(1234)
+    text_chars = ["a", "a", "b", "A", " ", ".", "-", "ı", "I", "ſ", "s", ",", "\n", "_", "İ"]
+    part_chars = ["a", "a", "b", "A", ".", "-", "I", "s", "ſ", "İ"]
+
+    for _ in range(2000):
+        parts = ["".join(rand.choice(part_chars) for _ in range(rand.randint(0, 3))) for _ in range(rand.randint(2, 6))]
+        word = "*".join(parts)
+        query, wildcard = linear_wildcard(word)
+        text = "".join(rand.choice(text_chars) for _ in range(rand.randint(0, 40)))
+
+        assert wildcard.search(text) == (query.pattern.search(text) is not None), (word, text)
+        assert wildcard.spans(text) == [m.span() for m in query.pattern.finditer(text)], (word, text)
+
+
+def test_wildcard__short_text_uses_regex():
+    query = RegexQuery.from_string_with_asterisks("a*b*c")
+    wildcard = query.wildcard[1]
+
+    assert wildcard.regex_max_length > 0
+    assert wildcard.search("axbxc")
+    assert wildcard.spans("axbxc axbyc") == [(0, 5), (6, 11)]
+
+
+def test_wildcard__adversarial_long_text():
+    query = RegexQuery.from_string_with_asterisks("*".join(["a"] * MAX_WILDCARDS) + "*b")
+    wildcard = query.wildcard[1]
+    text = "a" * 100_000 + " b"
+
+    assert not wildcard.search(text)
+    assert wildcard.spans(text) == []
+    assert wildcard.search("a" * 100_000 + "b")
+
+
+def test_wildcard__too_short_text():
+    _, wildcard = linear_wildcard("abc*def")
+
+    assert not wildcard.search("abcdef")
+    assert wildcard.spans("abcdef") == []
+
+
+@pytest.mark.parametrize("parse", [parse_query, parse_query_pyparsing])
+def test_parse__too_many_wildcards_still_parses(parse):
+    # Saved queries from before the limit must still load
+    word = "*".join(["a"] * (MAX_WILDCARDS + 1)) + "*"
+
+    query = parse(word)
+
+    assert isinstance(query, RegexQuery)
+    assert query.wildcard is not None
+
+
+def test_check_wildcard_limit__too_many_wildcards():
+    word = "*".join(["a"] * (MAX_WILDCARDS + 1)) + "*"
+
+    with pytest.raises(InvalidQueryException, match="wildcards"):
+        check_wildcard_limit(parse_query(word))
+
+
+def test_check_wildcard_limit__too_many_wildcards_in_sub_query():
+    word = "*".join(["a"] * (MAX_WILDCARDS + 1)) + "*"
+
+    with pytest.raises(InvalidQueryException, match="wildcards"):
+        check_wildcard_limit(parse_query(f"deer and not (dog or title:{word})"))
+    with pytest.raises(InvalidQueryException, match="wildcards"):
+        check_wildcard_limit(parse_query(f"deer except {word}"))
+
+
+def test_check_wildcard_limit__most_wildcards_allowed():
+    check_wildcard_limit(parse_query("deer and " + "a**" * MAX_WILDCARDS))
+
+
+@pytest.mark.parametrize("parse", [parse_query, parse_query_pyparsing])
+def test_parse__most_wildcards_allowed(parse):
+    word = "a**" * MAX_WILDCARDS
+
+    query = parse(word)
+
+    assert isinstance(query, RegexQuery)
+    assert query.wildcard is not None
+
+
+def test_to_data__wildcard_round_trip():
+    query = parse_query("title:deer*dog*")
+
+    data = json.loads(json.dumps(query.to_data()))
+
+    assert data[0] == "wildcard"
+    assert query_from_data(data) == query
+    assert query_from_data(data).wildcard[0] == query.wildcard[0]
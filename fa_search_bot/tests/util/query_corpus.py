@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from fa_search_bot.sites.furaffinity.fa_submission import FAUser, Rating
+from fa_search_bot.tests.util.submission_builder import SubmissionBuilder
+
+if TYPE_CHECKING:
+    from typing import List
+
+    from fa_search_bot.sites.furaffinity.fa_submission import FASubmissionFull
+
+
+# A selection of queries covering the query grammar, for checking alternative ways of matching give the same results
+CORPUS_QUERIES = [
+    "deer",
+    "deer dog",
+    "deer dog deer",
+    "deer and (dog and (cat and deer))",
+    "deer or dog or deer",
+    "deer or (dog or (cat or deer))",
+    "deer and dog or cat",
+    "(deer or dog) and (cat or deer)",
+    "-deer",
+    "deer -dog",
+    "not -deer",
+    "-(deer or -dog)",
+    "rating:general",
+    "rating:adult deer",
+    "(deer or -dog) rating:mature",
+    "title:deer",
+    "title:(deer except deer-dog)",
+    "title:deer or description:dog or keyword:cat",
+    "artist:fender",
+    "@artist fender",
+    "artist:fender dog",
+    "deer*",
+    "*deer",
+    "fen*",
+    "keyword:deer*",
+    "d*r",
+    "d*r* rating:adult deer",
+    '"deer dog"',
+    '"deer-dog"',
+    'description:"big deer"',
+    '"big deer" deer* rating:general',
+    '"deer dog" or deer* or *dog or rating:general',
+    "deer except deer-dog",
+    "deer except deer-dog rating:mature",
+    "deer* except (deers or deerly)",
+    "deer* except (deers or deerly) *dog",
+    "(deer dog) (deer dog) (deer -cat)",
+]
+
+
+def corpus_submissions() -> List[FASubmissionFull]:
+    return [
+        SubmissionBuilder(
+            title="Deer and dog",
+            description="a big deer with a dog, deer-dog",
+            keywords=["deer", "dog", "deerdog"],
+            rating=Rating.GENERAL,
+            author=FAUser("Fender", "fender"),
+        ).build_full_submission(),
+        SubmissionBuilder(
+            title="Just a dog",
+            description="This is a hotdog, not a cervine. deers",
+            keywords=["dog", "cat"],
+            rating=Rating.MATURE,
+        ).build_full_submission(),
+        SubmissionBuilder(
+            title="Reindeer",
+            description="deerly beloved, big Deer",
+            keywords=["reindeer", "winter"],
+            rating=Rating.ADULT,
+        ).build_full_submission(),
+        SubmissionBuilder(
+            title="Nothing",
+            description="Nothing to see here",
+            keywords=[],
+            rating=Rating.ADULT,
+            author=FAUser("Fen.der", "fender2"),
+        ).build_full_submission(),
+        SubmissionBuilder(
+            title="deer cat",
+            description="deer-dog except for deer",
+            keywords=["deer-dog"],
+            rating=Rating.MATURE,
+        ).build_full_submission(),
+    ]
@@ -3,6 +3,7 @@ import logging
 import os
 import sys
 from logging.handlers import TimedRotatingFileHandler
+from typing import Optional
 
 import click
 from prometheus_client import Counter
@@ -46,11 +47,19 @@ def setup_logging(log_level: str = "INFO") -> None:
 @click.option("--no-subscriptions", type=bool, default=False, help="Disable subscription watcher")
 @click.option("--sub-watcher-data-fetchers", type=int, default=2, help="Number of DataFetcher tasks which should spin up in the subscription watcher")
 @click.option("--sub-watcher-media-fetchers", type=int, default=2, help="Number of MediaFetcher tasks which should spin up in the subscription watcher")
+@click.option("--sub-watcher-min-data-fetchers", type=int, default=None, help="Minimum number of DataFetcher tasks to scale down to, when idle")
+@click.option("--sub-watcher-max-data-fetchers", type=int, default=None, help="Maximum number of DataFetcher tasks to scale up to, when catching up")
+@click.option("--sub-watcher-min-media-fetchers", type=int, default=None, help="Minimum number of MediaFetcher tasks to scale down to, when idle")
+@click.option("--sub-watcher-max-media-fetchers", type=int, default=None, help="Maximum number of MediaFetcher tasks to scale up to, when catching up")
 def main(
         log_level: str,
         no_subscriptions: bool,
         sub_watcher_data_fetchers: int,
         sub_watcher_media_fetchers: int,
+        sub_watcher_min_data_fetchers: Optional[int],
+        sub_watcher_max_data_fetchers: Optional[int],
+        sub_watcher_min_media_fetchers: Optional[int],
+        sub_watcher_max_media_fetchers: Optional[int],
 ) -> None:
     setup_logging(log_level)
     # Construct config and ingest flags
@@ -58,6 +67,14 @@ def main(
     config.subscription_watcher.enabled = not no_subscriptions
     config.subscription_watcher.num_data_fetchers = sub_watcher_data_fetchers
     config.subscription_watcher.num_media_fetchers = sub_watcher_media_fetchers
+    if sub_watcher_min_data_fetchers is not None:
+        config.subscription_watcher.min_data_fetchers = sub_watcher_min_data_fetchers
+    if sub_watcher_max_data_fetchers is not None:
+        config.subscription_watcher.max_data_fetchers = sub_watcher_max_data_fetchers
+    if sub_watcher_min_media_fetchers is not None:
+        config.subscription_watcher.min_media_fetchers = sub_watcher_min_media_fetchers
+    if sub_watcher_max_media_fetchers is not None:
+        config.subscription_watcher.max_media_fetchers = sub_watcher_max_media_fetchers
     # Create and start the bot
     bot = FASearchBot(config)
     loop = asyncio.get_event_loop()